@@ -1,229 +1,426 @@
-from flask import Flask, render_template, request, jsonify
-from langchain_openai import ChatOpenAI
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langgraph.prebuilt import create_react_agent
-from langchain import hub
-import os
-import ast
-import calendar
-import re
-from dotenv import load_dotenv
+import time
+_import_started = time.perf_counter()
 
-load_dotenv(".env.prod")
+from flask import Flask, g, render_template, request, jsonify, Response, stream_with_context, send_file, abort
+import os
+import agent_runtime
+import app_shared
+from answer_flow import new_metadata, finish_metadata, coalesced_stream_answer
+from app_shared import (
+    answer_mode,
+    batch_items,
+    build_answer,
+    cache_hit_metadata,
+    cancelled_payload,
+    coalesce_args,
+    conversation_for,
+    lookup_thread_answer,
+    message_to_step,
+    ndjson,
+    public_step,
+    replay_cached_answer,
+    request_id_for,
+    session_for,
+    set_session_cookie,
+    sse,
+    store_answer,
+    tool_call_events,
+)
+from batch_answers import BatchContext, BatchError, run_batch, summary_line
+from cancellation import CancelToken, RequestCancelled, RequestIdInUse, cancel_request, watch_disconnect
+from compression import compress_response
+from db_pool import pool_status
+from instrumentation import metrics_response
 
 app = Flask(__name__)
+# Compact JSON even under app.run(debug=True), which would otherwise pretty-print every response
+app.json.compact = True
 
-# Database connection setup
-azServer = os.getenv("AZSERVER")
-azDatabase = os.getenv("AZDATABASE")
-sqlUser = os.getenv("AZSQLUSER")
-sqlPass = os.getenv("AZSQLPASS")
-connectionString = f"mssql+pyodbc://{sqlUser}:{sqlPass}@{azServer}/{azDatabase}?driver=ODBC+Driver+17+for+SQL+Server"
-
-# LangChain and Database initialization
-llm = ChatOpenAI(model="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY"))
-db = SQLDatabase.from_uri(
-    connectionString,
-    include_tables=["vw_Maximo_Asset", "vw_Maximo_WorkOrders", "vw_Maximo_Locations"],
-    view_support=True,
-    schema="src"
-)
+# LangChain, the LLM client and the database connection are set up by agent_runtime,
+# lazily or in the background depending on AGENT_INIT_MODE, so the app can start
+# serving (and report readiness on /ready) before the agent has been built.
+agent_runtime.record_timing("import_app", time.perf_counter() - _import_started)
+agent_runtime.start()
 
-# Setup LangChain agent
-toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-tools = toolkit.get_tools()
-
-prompt_template = hub.pull("langchain-ai/sql-agent-system-prompt")
-system_message = prompt_template.format(dialect="mssql", top_k=5)
-system_message += "\n\nNote: All table and view names must be fully qualified with the schema prefix 'src.' in the SQL query."
-system_message += "\n\nNote: When joining 'vw_Maximo_Locations' and 'vw_Maximo_WorkOrders', use 'vw_Maximo_Locations.location_description' to join with 'vw_Maximo_WorkOrders.location_description'."
-system_message += "\n\nNote: When joining 'vw_Maximo_Asset' and 'vw_Maximo_WorkOrders', use 'vw_Maximo_Asset.assetnum' to join with 'vw_Maximo_WorkOrders.asset_id'."
-system_message += "\n\nNote: For date-based queries (e.g., those that filter by month, year, or date ranges), ensure that the SQL query selects and returns the year along with the month and work order count, with the output formatted as (work_order_count, month, year) — where the month is the second element and the year is the third."
-system_message += "\n\nNote: For non-date-based queries (e.g., querying for assets with the highest work orders), this requirement does not apply and a different data format may be used."
-
-
-agent_executor = create_react_agent(llm, tools, prompt=system_message)
-
-# def generate_dynamic_visualization_data(steps, visualize):
-#     """
-#     Dynamically parse the agent's output to create chart data.
-#     1. If 'visualize' is False, return None.
-#     2. Otherwise, iterate over each step:
-#        - If the content is a Python literal list of tuples, parse it.
-#        - Otherwise, if it contains bullet-point text with '###' headings and month bullets,
-#          parse that text.
-#     3. Return the first successfully parsed data or None if nothing could be parsed.
-#     """
-#     if not visualize:
-#         return None
-
-#     for step in steps:
-#         content = step.get('content', '').strip()
-
-#         # 1) Try parsing as Python literal data, e.g. [(1344, 6, 2023), (951, 7, 2023), ...]
-#         if content.startswith('[') and content.endswith(']'):
-#             chart_data = _parse_python_list_literal(content)
-#             if chart_data is not None:
-#                 return chart_data
-
-#         # 2) Otherwise, try parsing the bullet-point text format
-#         if '###' in content:
-#             chart_data = _parse_bullet_point_text(content)
-#             if chart_data is not None and len(chart_data['labels']) > 0:
-#                 return chart_data
-
-#     return None
-
-
-def generate_dynamic_visualization_data(steps, visualize):
-    """
-    Dynamically parse the agent's output to create chart data.
-    
-    1. If 'visualize' is False, return None.
-    2. Otherwise, iterate over each step:
-       - Attempt to parse as a Python literal list for date-based queries (e.g., [(work_order_count, month, year), ...]).
-       - If that fails, try parsing for multi-series data (e.g., [(work_order_count, asset_id), ...]).
-       - Finally, try parsing bullet-point text with a year header and month-value bullets.
-    3. Return the first successfully parsed data or None if nothing could be parsed.
-    """
-    if not visualize:
-        return None
-
-    for step in steps:
-        content = step.get('content', '').strip()
-
-        # 1) Try parsing as Python literal data for 3-element tuples
-        if content.startswith('[') and content.endswith(']'):
-            chart_data = _parse_python_list_literal(content)
-            if chart_data is not None:
-                return chart_data
-            # 1.1) If that fails, try parsing for multi-series (2-element tuples)
-            chart_data = _parse_multi_series_data(content)
-            if chart_data is not None:
-                return chart_data
-
-        # 2) Otherwise, try parsing the bullet-point text format
-        if '###' in content:
-            chart_data = _parse_bullet_point_text(content)
-            if chart_data is not None and len(chart_data['labels']) > 0:
-                return chart_data
-
-    return None
-
-
-def _parse_python_list_literal(content):
-    """
-    Parse a Python list literal of tuples, where each tuple is (value, month, year).
-    Returns a dict { 'labels': [...], 'values': [...] } or None on failure.
+
+@app.before_request
+def identify_session():
+    # The session owns the request's runs and threads (see app_shared.SESSION_COOKIE)
+    g.session = session_for(request.cookies)
+
+@app.after_request
+def compress(response):
     """
-    try:
-        data = ast.literal_eval(content)
-        if isinstance(data, list) and all(isinstance(item, tuple) and len(item) == 3 for item in data):
-            labels = []
-            values = []
-            for (val, month, year) in data:
-                month_name = calendar.month_name[month]
-                labels.append(f"{month_name} {year}")
-                values.append(val)
-            return {"labels": labels, "values": values}
-    except Exception:
-        return None
-    return None
-
-def _parse_bullet_point_text(content):
-    """
-    Parse bullet-point text with a year heading and month-value bullets.
-    For example:
-      ### 2024
-      - **January**: 1160
-      - **February**: 1382
-      - **March**: 1509
-      - **April**: 1228
-    Returns a dict { 'labels': [...], 'values': [...] }.
-    """
-    lines = content.split('\n')
-    current_year = None
-    labels = []
-    values = []
-
-    # Regex to match a year heading, e.g. "### 2024"
-    year_pattern = re.compile(r'^###\s+(\d{4})$')
-    # Regex to match a bullet line, e.g. "- **January**: 1160"
-    month_pattern = re.compile(r'^-\s\*\*(\w+)\*\*:\s(\d+)')
-
-    for line in lines:
-        line = line.strip()
-        match_year = year_pattern.match(line)
-        if match_year:
-            current_year = match_year.group(1)
-            continue
-
-        match_month = month_pattern.match(line)
-        if match_month and current_year:
-            month_name = match_month.group(1)
-            value = int(match_month.group(2))
-            labels.append(f"{month_name} {current_year}")
-            values.append(value)
-    
-    return {"labels": labels, "values": values}
-
-
-def _parse_multi_series_data(content):
-    """
-    Parse a Python list literal of tuples for multi-series data,
-    where each tuple is (work_order_count, asset_id).
-    Returns a dict in the format:
-      { 'labels': [<common label>], 'datasets': [ { 'label': asset_id, 'data': [work_order_count] }, ... ] }
-    Assumes the query is for a single time period (e.g., June 2023).
+    gzip/brotli-compress large buffered responses according to Accept-Encoding.
     """
-    try:
-        data = ast.literal_eval(content)
-        # Check if it's a list of 2-element tuples
-        if isinstance(data, list) and all(isinstance(item, tuple) and len(item) == 2 for item in data):
-            # Here, you may need to determine the common label (e.g., "June 2023").
-            # This could be extracted from the query or hard-coded if known.
-            common_label = "June 2023"
-            datasets = []
-            for count, asset in data:
-                datasets.append({"label": str(asset), "data": [count]})
-            return {"labels": [common_label], "datasets": datasets}
-    except Exception:
-        return None
-    return None
+    return compress_response(response, request.headers.get('Accept-Encoding', ''))
 
+@app.after_request
+def session_cookie(response):
+    return set_session_cookie(response, request.cookies, g.session)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+
+def _answer(question, visualize_flag, mode, include_trace=False, request_id=None, environ=None, parent_token=None,
+            conversation=None, session=None):
+    """
+    Answer a question the way /ask does; returns (payload, HTTP status).
+    environ: the WSGI environ, to cancel the run when the client goes away.
+    parent_token: a batch's CancelToken; cancelling it cancels this question too.
+    conversation: the thread the question continues (conversations).
+    session: the session that can cancel the run by request_id.
+    """
+    cache_status, cached = lookup_thread_answer(question, visualize_flag, conversation)
+    if cache_status == 'hit':
+        return {**cached, "cache": cache_status, "metadata": cache_hit_metadata(mode, conversation)}, 200
+
+    metadata = new_metadata(mode, include_trace, request_id, conversation, session)
+    cancel_token = metadata["cancel_token"]
+    if environ is not None:
+        watch_disconnect(environ, cancel_token)
+    stop_following = None
+    if parent_token is not None:
+        stop_following = parent_token.on_cancel(lambda: cancel_token.cancel(parent_token.reason))
+    response_steps = []
+    coalesced_answer = None
+    try:
+        for kind, item in coalesced_stream_answer(agent_runtime.get_runtime(), question, mode, metadata,
+                                                  *coalesce_args(question, visualize_flag, conversation)):
+            if kind == 'message':
+                response_steps.append(message_to_step(item))
+            elif kind == 'restart':
+                response_steps.clear()
+            elif kind == 'cached':
+                coalesced_answer = item
+    except RequestCancelled:
+        # 499: nginx's "client closed request"
+        return cancelled_payload(metadata), 499
+    except RequestIdInUse as e:
+        return {"error": str(e), "request_id": metadata["request_id"]}, 409
+    finally:
+        if stop_following is not None:
+            stop_following()
+
+    if coalesced_answer is not None:
+        return {**coalesced_answer, "cache": 'hit', "metadata": finish_metadata(metadata)}, 200
+
+    answer = build_answer(response_steps, visualize_flag)
+    if cache_status != 'bypass':
+        store_answer(question, visualize_flag, answer, response_steps, metadata)
+
+    return {**answer, "cache": cache_status, "metadata": finish_metadata(metadata)}, 200
+
+
 @app.route('/ask', methods=['POST'])
 def ask():
+    payload, status = _answer(request.json.get('question', ''), request.json.get('visualize', False),
+                              answer_mode(request.json), include_trace=bool(request.json.get('trace')),
+                              request_id=request_id_for(request.json), environ=request.environ,
+                              conversation=conversation_for(request.json, g.session), session=g.session)
+    return jsonify(payload), status
+
+@app.route('/ask/stream', methods=['POST'])
+def ask_stream():
+    """
+    Stream the agent run as Server-Sent Events.
+
+    Events, in order of appearance:
+      - 'start':     sent immediately so the client gets its first byte before the first LLM call;
+                     carries the request_id for /ask/<request_id>/cancel
+      - 'token':     incremental LLM output as it is generated
+      - 'step':      each complete message (AI message or tool result)
+      - 'tool_call': each tool call requested by the model, with the SQL statement for 'sql_db_query'
+      - 'final':     the final answer, the visualization payload, the cache status and the run metadata
+      - 'error':     sent instead of 'final' if the agent run fails
+      - 'cancelled': sent instead of 'final' if the run was cancelled through the cancel endpoint
+      - 'restart':   the identical question's run this request was sharing was abandoned; the
+                     steps and tokens so far are void and the question starts over
+
+    A cache hit replays the cached steps followed by 'final' without running the agent.
+    An identical question already being answered is shared rather than run again (singleflight).
+    With a thread_id the question continues that conversation thread (conversations); the
+    final metadata carries the thread_id.
+    If the client disconnects, the run is cancelled (cancellation.watch_disconnect).
+    """
     question = request.json.get('question', '')
     visualize_flag = request.json.get('visualize', False)
-    response_steps = []
-    final_answer = ""
-
-    for step in agent_executor.stream(
-        {"messages": [{"role": "user", "content": question}]},
-        stream_mode="values",
-    ):
-        message = step["messages"][-1]
-        response_steps.append({
-            'type': 'AI Message' if 'AiMessage' in str(type(message)) else 'Tool Message',
-            'content': message.content
+    mode = answer_mode(request.json)
+    include_trace = bool(request.json.get('trace'))
+    request_id = request_id_for(request.json)
+    session = g.session
+    conversation = conversation_for(request.json, session)
+
+    def generate():
+        yield sse('start', {'question': question, 'mode': mode, 'request_id': request_id})
+
+        cache_status, cached = lookup_thread_answer(question, visualize_flag, conversation)
+        if cache_status == 'hit':
+            yield from replay_cached_answer(cached, cache_hit_metadata(mode, conversation))
+            return
+
+        metadata = new_metadata(mode, include_trace, request_id, conversation, session)
+        watch_disconnect(request.environ, metadata["cancel_token"])
+        response_steps = []
+        coalesced_answer = None
+        try:
+            runtime = agent_runtime.get_runtime()
+            for kind, item in coalesced_stream_answer(runtime, question, mode, metadata,
+                                                      *coalesce_args(question, visualize_flag, conversation),
+                                                      stream_tokens=True):
+                if kind == 'token':
+                    yield sse('token', {'content': item})
+                    continue
+                if kind == 'restart':
+                    response_steps.clear()
+                    yield sse('restart', {})
+                    continue
+                if kind == 'cached':
+                    coalesced_answer = item
+                    continue
+                step = message_to_step(item)
+                response_steps.append(step)
+                yield sse('step', public_step(step))
+                for tool_call in tool_call_events(item):
+                    yield sse('tool_call', tool_call)
+        except RequestCancelled:
+            yield sse('cancelled', cancelled_payload(metadata))
+            return
+        except Exception as e:
+            yield sse('error', {'error': str(e)})
+            return
+
+        if coalesced_answer is not None:
+            yield from replay_cached_answer(coalesced_answer, finish_metadata(metadata))
+            return
+
+        answer = build_answer(response_steps, visualize_flag)
+        if cache_status != 'bypass':
+            store_answer(question, visualize_flag, answer, response_steps, metadata)
+
+        yield sse('final', {
+            "final_answer": answer['final_answer'],
+            "visualizationData": answer['visualizationData'],
+            "cache": cache_status,
+            "metadata": finish_metadata(metadata)
         })
 
-    final_answer = response_steps[-1]['content'] if response_steps else "No answer generated."
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+
+@app.route('/ask/batch', methods=['POST'])
+def ask_batch():
+    """
+    Answer a list of questions, at most 'concurrency' at a time, as NDJSON.
+
+    Body: {"questions": ["...", {"question": "...", "id": "...", "visualize": true}, ...],
+           "visualize": false, "mode": "agent", "concurrency": 4, "request_id": "..."}
 
-    # Generate dynamic visualization data from the response steps
-    visualization_data = generate_dynamic_visualization_data(response_steps, visualize_flag)
+    A 'start' line first, {"start": {"request_id": ..., "questions": ..., "concurrency": ...}}, then
+    one line per question as it is answered, in completion order:
+      {"index": 3, "id": ..., "question": ..., <the /ask response>}
+    or with "error" or "cancelled" instead of the answer; then a closing
+      {"batch": {"request_id": ..., "questions": ..., "answered": ..., "cached": ..., "error": ..., "cancelled": ...}}
+
+    The batch's request id cancels the whole batch through /ask/<request_id>/cancel,
+    '<request_id>-<index>' a single question. See batch_answers.
+    """
+    data = request.json or {}
+    try:
+        items, concurrency = batch_items(data)
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    batch_id = request_id_for(data)
+    include_trace = bool(data.get('trace'))
+    session = g.session
+
+    def generate():
+        started = time.perf_counter()
+        try:
+            batch_token = CancelToken(batch_id, session).register()
+        except RequestIdInUse as e:
+            yield ndjson({"error": str(e), "request_id": batch_id})
+            return
+        watch_disconnect(request.environ, batch_token)
+        batch = BatchContext(agent_runtime.get_runtime(), [item["question"] for item in items])
+
+        def answer(item):
+            with batch.use():
+                payload, _status = _answer(item["question"], item["visualize"], item["mode"], include_trace,
+                                           f"{batch_id}-{item['index']}", parent_token=batch_token, session=session)
+            return payload
+
+        lines = []
+        try:
+            yield ndjson({"start": {"request_id": batch_id, "questions": len(items), "concurrency": concurrency}})
+            for line in run_batch(items, answer, concurrency, batch_token):
+                lines.append(line)
+                yield ndjson(line)
+            yield ndjson(summary_line(batch_id, lines, concurrency, started))
+        finally:
+            batch_token.stop()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/ask/<request_id>/cancel', methods=['POST'])
+def ask_cancel(request_id):
+    """
+    Cancel a running question: its graph stops, its LLM call and SQL statement are aborted.
+    Only the session that asked the question can cancel it; for any other it is a 404.
+    """
+    if not cancel_request(request_id, g.session):
+        return jsonify({"cancelled": False, "request_id": request_id}), 404
+    return jsonify({"cancelled": True, "request_id": request_id})
 
-    return jsonify({
-        "steps": response_steps,
-        "final_answer": final_answer,
-        "visualizationData": visualization_data
-    })
+@app.route('/threads/<thread_id>')
+def thread(thread_id):
+    """
+    A conversation thread's turns, summary and kept result sets; the session's own threads only.
+    """
+    conversations = app_shared.conversations
+    conversation = conversations.get(thread_id, create=False, owner=g.session) if conversations is not None else None
+    if conversation is None:
+        abort(404)
+    return jsonify(conversation.describe())
+
+@app.route('/threads/<thread_id>', methods=['DELETE'])
+def delete_thread(thread_id):
+    conversations = app_shared.conversations
+    if conversations is None or not conversations.delete(thread_id, g.session):
+        abort(404)
+    return jsonify({"deleted": True, "thread_id": thread_id})
+
+@app.route('/examples')
+def examples():
+    runtime = agent_runtime.get_runtime()
+    if runtime.example_bank is None:
+        return jsonify({"enabled": False})
+    question = request.args.get('question')
+    if question:
+        return jsonify([{"similarity": round(similarity, 3), **example}
+                        for similarity, example in runtime.example_bank.search(question)])
+    return jsonify(runtime.example_bank.stats())
+
+@app.route('/examples', methods=['POST'])
+def add_example():
+    """
+    Add a verified question -> SQL pair to the few-shot example bank.
+    """
+    runtime = agent_runtime.get_runtime()
+    if runtime.example_bank is None:
+        return jsonify({"enabled": False}), 404
+    question = (request.json.get('question') or '').strip()
+    sql = (request.json.get('sql') or '').strip()
+    if not question or not sql:
+        return jsonify({"error": "question and sql are required"}), 400
+    added = runtime.example_bank.add(question, sql, note=request.json.get('note'),
+                                     source=request.json.get('source', 'curated'))
+    return jsonify({"added": added, **runtime.example_bank.stats()}), 201 if added else 200
+
+@app.route('/cache/stats')
+def cache_stats():
+    """
+    Report answer cache, SQL result cache and single-flight counters so hit rates can be measured,
+    and the memory held by conversation threads.
+    """
+    runtime = agent_runtime.current_runtime()
+    sql_cache = runtime.sql_cache if runtime is not None else None
+    stores = {"answers": app_shared.answer_cache, "sql": sql_cache, "singleflight": app_shared.single_flight,
+              "conversations": app_shared.conversations}
+    return jsonify({name: store.stats() if store is not None else None for name, store in stores.items()})
+
+@app.route('/metrics')
+def metrics():
+    """
+    Prometheus metrics: request, LLM, tool and SQL histograms for this process.
+    """
+    body, content_type = metrics_response()
+    return Response(body, content_type=content_type)
+
+@app.route('/ready')
+def ready():
+    """
+    Readiness probe: 200 once the agent is built, 503 before that (or if building failed).
+    Includes the per-phase initialization timings.
+    """
+    status = agent_runtime.readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/schema')
+def schema():
+    """
+    Return the schema snapshot that is injected into the agent prompt.
+    """
+    runtime = agent_runtime.get_runtime()
+    if runtime.schema_snapshots is None:
+        return jsonify({"enabled": False})
+    return jsonify(runtime.schema_snapshots.snapshot)
+
+@app.route('/schema/refresh', methods=['POST'])
+def schema_refresh():
+    """
+    Rebuild the schema snapshot from the database and persist it.
+    """
+    runtime = agent_runtime.get_runtime()
+    if runtime.schema_snapshots is None:
+        return jsonify({"enabled": False}), 404
+    changed = runtime.schema_snapshots.refresh()
+    return jsonify({"changed": changed, "fingerprint": runtime.schema_snapshots.snapshot["fingerprint"]})
+
+@app.route('/rollup')
+def rollup():
+    """
+    Return the rollup store's high-water mark, last refresh and size.
+    """
+    runtime = agent_runtime.get_runtime()
+    if runtime.rollup_store is None:
+        return jsonify({"enabled": False})
+    return jsonify(runtime.rollup_store.status())
+
+@app.route('/rollup/refresh', methods=['POST'])
+def rollup_refresh():
+    """
+    Pull new and changed work orders into the rollup store; ?full=true rebuilds it from scratch.
+    """
+    runtime = agent_runtime.get_runtime()
+    if runtime.rollup_store is None:
+        return jsonify({"enabled": False}), 404
+    rows_read = runtime.rollup_store.refresh(full=request.args.get('full', 'false').lower() == 'true')
+    return jsonify({"rows_read": rows_read, **runtime.rollup_store.status()})
+
+@app.route('/pool/stats')
+def pool_stats():
+    """
+    Return the database connection pool's occupancy, connect latency and checkout wait times.
+    """
+    runtime = agent_runtime.current_runtime()
+    if runtime is None:
+        return jsonify({"ready": False}), 503
+    return jsonify(pool_status(runtime.db._engine))
+
+@app.route('/results/<spill_id>')
+def download_result(spill_id):
+    """
+    Download the full result of a query whose preview was truncated for the model.
+    """
+    runtime = agent_runtime.current_runtime()
+    executor = runtime.query_executor if runtime is not None else None
+    path = executor.spill_path(spill_id) if executor is not None else None
+    if path is None or not os.path.exists(path):
+        abort(404)
+    return send_file(os.path.abspath(path), mimetype='text/csv', as_attachment=True,
+                     download_name=f"query_result_{spill_id}.csv")
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,378 @@
+"""
+Asyncio-native (ASGI) serving mode for the SQL question app.
+
+Serves the same routes as Sql_Question_App.py, driving the same
+create_react_agent graph through 'astream'. LLM calls go through the async
+OpenAI client and blocking SQL work runs on the bounded pool from
+sql_tools.get_sql_executor(), so one process can hold hundreds of in-flight
+questions without a thread per request.
+
+Run with:
+    hypercorn Sql_Question_App_Async:app --bind 0.0.0.0:8000
+"""
+import asyncio
+import os
+import time
+
+from quart import Quart, Response, g, render_template, request, jsonify, make_response, send_file, abort
+
+import agent_runtime
+import app_shared
+from answer_flow import new_metadata, finish_metadata, acoalesced_stream_answer
+from app_shared import (
+    answer_mode,
+    batch_items,
+    build_answer,
+    cache_hit_metadata,
+    cancelled_payload,
+    coalesce_args,
+    conversation_for,
+    lookup_thread_answer,
+    message_to_step,
+    ndjson,
+    public_step,
+    replay_cached_answer,
+    request_id_for,
+    session_for,
+    set_session_cookie,
+    sse,
+    store_answer,
+    tool_call_events,
+)
+from batch_answers import BatchContext, BatchError, arun_batch, summary_line
+from cancellation import CancelToken, RequestCancelled, RequestIdInUse, cancel_request
+from compression import compress_async_response
+from db_pool import pool_status
+from instrumentation import metrics_response
+from sql_tools import get_sql_executor
+
+app = Quart(__name__)
+
+# See Sql_Question_App: the agent is built lazily or in the background (AGENT_INIT_MODE)
+agent_runtime.start()
+
+# Upper bound on concurrently running agent graphs in this process;
+# requests beyond it wait for a free slot instead of piling onto OpenAI and SQL Server.
+_agent_slots = None
+
+
+@app.before_serving
+async def _configure_executors():
+    global _agent_slots
+    _agent_slots = asyncio.Semaphore(int(os.getenv("ASYNC_MAX_IN_FLIGHT", "500")))
+    # Tools without a native async implementation (e.g. sql_db_schema) fall back to
+    # the loop's default executor, so bound that by the same SQL pool.
+    asyncio.get_running_loop().set_default_executor(get_sql_executor())
+
+
+@app.before_request
+async def identify_session():
+    g.session = session_for(request.cookies)
+
+
+@app.after_request
+async def compress(response):
+    return await compress_async_response(response, request.headers.get('Accept-Encoding', ''))
+
+
+@app.after_request
+async def session_cookie(response):
+    return set_session_cookie(response, request.cookies, g.session)
+
+
+@app.route('/')
+async def index():
+    return await render_template('index.html')
+
+async def _answer(question, visualize_flag, mode, include_trace=False, request_id=None, parent_token=None,
+                  conversation=None, session=None):
+    """
+    Answer a question the way /ask does; returns (payload, HTTP status). Same as the Flask
+    app's _answer; the client going away cancels the handler task instead.
+    """
+    cache_status, cached = await asyncio.to_thread(lookup_thread_answer, question, visualize_flag, conversation)
+    if cache_status == 'hit':
+        return {**cached, "cache": cache_status, "metadata": cache_hit_metadata(mode, conversation)}, 200
+
+    runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+    metadata = new_metadata(mode, include_trace, request_id, conversation, session)
+    cancel_token = metadata["cancel_token"]
+    stop_following = None
+    if parent_token is not None:
+        stop_following = parent_token.on_cancel(lambda: cancel_token.cancel(parent_token.reason))
+    response_steps = []
+    coalesced_answer = None
+    try:
+        async with _agent_slots:
+            async for kind, item in acoalesced_stream_answer(runtime, question, mode, metadata,
+                                                             *coalesce_args(question, visualize_flag, conversation)):
+                if kind == 'message':
+                    response_steps.append(message_to_step(item))
+                elif kind == 'restart':
+                    response_steps.clear()
+                elif kind == 'cached':
+                    coalesced_answer = item
+    except RequestCancelled:
+        return cancelled_payload(metadata), 499
+    except RequestIdInUse as e:
+        return {"error": str(e), "request_id": metadata["request_id"]}, 409
+    finally:
+        if stop_following is not None:
+            stop_following()
+
+    if coalesced_answer is not None:
+        return {**coalesced_answer, "cache": 'hit', "metadata": finish_metadata(metadata)}, 200
+
+    # Chart inference and downsampling walk the whole result: keep them off the event loop
+    answer = await asyncio.to_thread(build_answer, response_steps, visualize_flag)
+    if cache_status != 'bypass':
+        await asyncio.to_thread(store_answer, question, visualize_flag, answer, response_steps, metadata)
+
+    return {**answer, "cache": cache_status, "metadata": finish_metadata(metadata)}, 200
+
+@app.route('/ask', methods=['POST'])
+async def ask():
+    data = await request.get_json()
+    payload, status = await _answer(data.get('question', ''), data.get('visualize', False), answer_mode(data),
+                                    include_trace=bool(data.get('trace')), request_id=request_id_for(data),
+                                    conversation=conversation_for(data, g.session), session=g.session)
+    return jsonify(payload), status
+
+@app.route('/ask/stream', methods=['POST'])
+async def ask_stream():
+    """
+    Stream the agent run as Server-Sent Events; same events as the Flask endpoint.
+    """
+    data = await request.get_json()
+    question = data.get('question', '')
+    visualize_flag = data.get('visualize', False)
+    mode = answer_mode(data)
+    include_trace = bool(data.get('trace'))
+    request_id = request_id_for(data)
+    session = g.session
+    conversation = conversation_for(data, session)
+
+    async def generate():
+        yield sse('start', {'question': question, 'mode': mode, 'request_id': request_id})
+
+        cache_status, cached = await asyncio.to_thread(lookup_thread_answer, question, visualize_flag, conversation)
+        if cache_status == 'hit':
+            for event in replay_cached_answer(cached, cache_hit_metadata(mode, conversation)):
+                yield event
+            return
+
+        metadata = new_metadata(mode, include_trace, request_id, conversation, session)
+        response_steps = []
+        coalesced_answer = None
+        try:
+            runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+            async with _agent_slots:
+                async for kind, item in acoalesced_stream_answer(runtime, question, mode, metadata,
+                                                                 *coalesce_args(question, visualize_flag,
+                                                                                 conversation),
+                                                                 stream_tokens=True):
+                    if kind == 'token':
+                        yield sse('token', {'content': item})
+                        continue
+                    if kind == 'restart':
+                        response_steps.clear()
+                        yield sse('restart', {})
+                        continue
+                    if kind == 'cached':
+                        coalesced_answer = item
+                        continue
+                    step = message_to_step(item)
+                    response_steps.append(step)
+                    yield sse('step', public_step(step))
+                    for tool_call in tool_call_events(item):
+                        yield sse('tool_call', tool_call)
+        except RequestCancelled:
+            yield sse('cancelled', cancelled_payload(metadata))
+            return
+        except Exception as e:
+            yield sse('error', {'error': str(e)})
+            return
+
+        if coalesced_answer is not None:
+            for event in replay_cached_answer(coalesced_answer, finish_metadata(metadata)):
+                yield event
+            return
+
+        answer = await asyncio.to_thread(build_answer, response_steps, visualize_flag)
+        if cache_status != 'bypass':
+            await asyncio.to_thread(store_answer, question, visualize_flag, answer, response_steps, metadata)
+
+        yield sse('final', {
+            "final_answer": answer['final_answer'],
+            "visualizationData": answer['visualizationData'],
+            "cache": cache_status,
+            "metadata": finish_metadata(metadata)
+        })
+
+    response = await make_response(
+        generate(),
+        {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Agent runs routinely outlast Quart's default response timeout
+    response.timeout = None
+    return response
+
+@app.route('/ask/batch', methods=['POST'])
+async def ask_batch():
+    """
+    Answer a list of questions as NDJSON; same body and lines as the Flask endpoint.
+    """
+    data = await request.get_json() or {}
+    try:
+        items, concurrency = batch_items(data)
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    batch_id = request_id_for(data)
+    include_trace = bool(data.get('trace'))
+    session = g.session
+
+    async def generate():
+        started = time.perf_counter()
+        try:
+            batch_token = CancelToken(batch_id, session).register()
+        except RequestIdInUse as e:
+            yield ndjson({"error": str(e), "request_id": batch_id})
+            return
+        runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+        batch = await asyncio.to_thread(BatchContext, runtime, [item["question"] for item in items])
+
+        async def answer(item):
+            with batch.use():
+                payload, _status = await _answer(item["question"], item["visualize"], item["mode"], include_trace,
+                                                 f"{batch_id}-{item['index']}", parent_token=batch_token,
+                                                 session=session)
+            return payload
+
+        lines = []
+        try:
+            yield ndjson({"start": {"request_id": batch_id, "questions": len(items), "concurrency": concurrency}})
+            async for line in arun_batch(items, answer, concurrency, batch_token):
+                lines.append(line)
+                yield ndjson(line)
+            yield ndjson(summary_line(batch_id, lines, concurrency, started))
+        finally:
+            batch_token.stop()
+
+    response = await make_response(
+        generate(),
+        {'Content-Type': 'application/x-ndjson', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.timeout = None
+    return response
+
+@app.route('/ask/<request_id>/cancel', methods=['POST'])
+async def ask_cancel(request_id):
+    if not cancel_request(request_id, g.session):
+        return jsonify({"cancelled": False, "request_id": request_id}), 404
+    return jsonify({"cancelled": True, "request_id": request_id})
+
+@app.route('/threads/<thread_id>')
+async def thread(thread_id):
+    conversations = app_shared.conversations
+    conversation = conversations.get(thread_id, create=False, owner=g.session) if conversations is not None else None
+    if conversation is None:
+        abort(404)
+    return jsonify(conversation.describe())
+
+@app.route('/threads/<thread_id>', methods=['DELETE'])
+async def delete_thread(thread_id):
+    conversations = app_shared.conversations
+    if conversations is None or not conversations.delete(thread_id, g.session):
+        abort(404)
+    return jsonify({"deleted": True, "thread_id": thread_id})
+
+@app.route('/examples')
+async def examples():
+    runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+    if runtime.example_bank is None:
+        return jsonify({"enabled": False})
+    question = request.args.get('question')
+    if question:
+        return jsonify([{"similarity": round(similarity, 3), **example}
+                        for similarity, example in runtime.example_bank.search(question)])
+    return jsonify(runtime.example_bank.stats())
+
+@app.route('/examples', methods=['POST'])
+async def add_example():
+    runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+    if runtime.example_bank is None:
+        return jsonify({"enabled": False}), 404
+    data = await request.get_json()
+    question = (data.get('question') or '').strip()
+    sql = (data.get('sql') or '').strip()
+    if not question or not sql:
+        return jsonify({"error": "question and sql are required"}), 400
+    added = await asyncio.to_thread(runtime.example_bank.add, question, sql, data.get('note'),
+                                    data.get('source', 'curated'))
+    return jsonify({"added": added, **runtime.example_bank.stats()}), 201 if added else 200
+
+@app.route('/cache/stats')
+async def cache_stats():
+    runtime = agent_runtime.current_runtime()
+    sql_cache = runtime.sql_cache if runtime is not None else None
+    stores = {"answers": app_shared.answer_cache, "sql": sql_cache, "singleflight": app_shared.single_flight,
+              "conversations": app_shared.conversations}
+    return jsonify({name: store.stats() if store is not None else None for name, store in stores.items()})
+
+@app.route('/metrics')
+async def metrics():
+    body, content_type = metrics_response()
+    return Response(body, content_type=content_type)
+
+@app.route('/ready')
+async def ready():
+    status = agent_runtime.readiness()
+    return jsonify(status), 200 if status["ready"] else 503
+
+@app.route('/schema')
+async def schema():
+    runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+    if runtime.schema_snapshots is None:
+        return jsonify({"enabled": False})
+    return jsonify(runtime.schema_snapshots.snapshot)
+
+@app.route('/schema/refresh', methods=['POST'])
+async def schema_refresh():
+    runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+    if runtime.schema_snapshots is None:
+        return jsonify({"enabled": False}), 404
+    changed = await asyncio.to_thread(runtime.schema_snapshots.refresh)
+    return jsonify({"changed": changed, "fingerprint": runtime.schema_snapshots.snapshot["fingerprint"]})
+
+@app.route('/rollup')
+async def rollup():
+    runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+    if runtime.rollup_store is None:
+        return jsonify({"enabled": False})
+    return jsonify(await asyncio.to_thread(runtime.rollup_store.status))
+
+@app.route('/rollup/refresh', methods=['POST'])
+async def rollup_refresh():
+    runtime = await asyncio.to_thread(agent_runtime.get_runtime)
+    if runtime.rollup_store is None:
+        return jsonify({"enabled": False}), 404
+    full = request.args.get('full', 'false').lower() == 'true'
+    rows_read = await asyncio.to_thread(runtime.rollup_store.refresh, full)
+    return jsonify({"rows_read": rows_read, **(await asyncio.to_thread(runtime.rollup_store.status))})
+
+@app.route('/pool/stats')
+async def pool_stats():
+    runtime = agent_runtime.current_runtime()
+    if runtime is None:
+        return jsonify({"ready": False}), 503
+    return jsonify(pool_status(runtime.db._engine))
+
+@app.route('/results/<spill_id>')
+async def download_result(spill_id):
+    runtime = agent_runtime.current_runtime()
+    executor = runtime.query_executor if runtime is not None else None
+    path = executor.spill_path(spill_id) if executor is not None else None
+    if path is None or not os.path.exists(path):
+        abort(404)
+    return await send_file(os.path.abspath(path), mimetype='text/csv', as_attachment=True,
+                           attachment_filename=f"query_result_{spill_id}.csv")
@@ -0,0 +1,531 @@
+"""
+Lazily initialized agent runtime shared by the Flask and ASGI apps.
+
+Building the agent means importing LangChain, creating the LLM client, connecting
+to SQL Server and reflecting the three Maximo views, which takes several seconds.
+None of that happens at import time: the runtime is built on first use, or in a
+background thread at startup (AGENT_INIT_MODE), and every phase is timed so that
+time-to-ready can be tracked across changes.
+
+AGENT_INIT_MODE:
+  - 'background' (default): start building as soon as the app is imported; requests wait for it
+  - 'lazy':                 build on the first request that needs the agent
+  - 'eager':                build synchronously while the app is imported
+"""
+import os
+import threading
+import time
+
+PROMPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+
+INCLUDE_TABLES = ["vw_Maximo_Asset", "vw_Maximo_WorkOrders", "vw_Maximo_Locations"]
+
+SCHEMA_QUALIFICATION_NOTE = "Note: All table and view names must be fully qualified with the schema prefix 'src.' in the SQL query."
+
+PROMPT_NOTES = [
+    "Note: For date-based queries (e.g., those that filter by month, year, or date ranges), ensure that the SQL query selects and returns the year along with the month and work order count, with the output formatted as (work_order_count, month, year) — where the month is the second element and the year is the third.",
+    "Note: For non-date-based queries (e.g., querying for assets with the highest work orders), this requirement does not apply and a different data format may be used.",
+]
+
+ROLLUP_NOTE = "Note: For work order counts grouped or filtered by year, month, work type, location, asset or status, prefer the maximo_rollup_query tool, which answers from a local pre-aggregated rollup in milliseconds. Use sql_db_query only for questions the rollup cannot answer (e.g. individual work orders, descriptions, or columns other than those in wo_rollup)."
+
+# Discovery steps in the vendored prompt; replaced when a schema snapshot is injected
+DISCOVERY_INSTRUCTIONS = (
+    "To start you should ALWAYS look at the tables in the database to see what you can query.\n"
+    "Do NOT skip this step.\n"
+    "Then you should query the schema of the most relevant tables."
+)
+SNAPSHOT_INSTRUCTIONS = (
+    "The schema of the available views, with sample rows and join hints, is provided at the end of this message.\n"
+    "Use it directly instead of calling sql_db_list_tables or sql_db_schema; only call those tools "
+    "if a query fails because a table or column is missing."
+)
+
+# Seconds spent in each initialization phase, in the order they ran
+startup_timings = {}
+
+_runtime = None
+_runtime_lock = threading.Lock()
+_init_error = None
+_init_thread = None
+
+
+class AgentRuntime:
+    """
+    Everything the request handlers need to run the agent.
+    """
+
+    def __init__(self, llm, db, tools, sql_cache, base_prompt, schema_snapshots=None, rollup_store=None,
+                 query_executor=None, example_bank=None, schema_context=None):
+        self.llm = llm
+        self.db = db
+        self.tools = tools
+        self.sql_cache = sql_cache
+        self.base_prompt = base_prompt
+        self.schema_snapshots = schema_snapshots
+        self.rollup_store = rollup_store
+        self.query_executor = query_executor
+        self.example_bank = example_bank
+        self.schema_context = schema_context
+        self.agent_executor = None
+        self.direct_pipeline = None
+
+    def system_message(self, schema_text):
+        """
+        The system prompt with the notes and the given schema text (None without a snapshot).
+        """
+        extra_notes = [ROLLUP_NOTE] if self.rollup_store is not None else []
+        return compose_system_message(self.base_prompt, schema_text, extra_notes)
+
+    def schema_for(self, question=None):
+        """
+        (schema text, stats) for question's prompts: the snapshot pruned to the views and columns
+        the question needs with a schema context, all of it otherwise; (None, None) without a snapshot.
+        """
+        from schema_context import full_context
+
+        if self.schema_snapshots is None:
+            return None, None
+        if self.schema_context is not None and question:
+            return self.schema_context.render(question)
+        return full_context(self.schema_snapshots.rendered())
+
+    def _schema_text(self, question):
+        from batch_answers import current_batch
+        from instrumentation import record_schema_context
+
+        batch = current_batch()
+        schema_text, stats = batch.schema_for(question) if batch is not None else self.schema_for(question)
+        record_schema_context(stats)
+        return schema_text
+
+    def table_info(self, question=None):
+        """
+        Schema description for the direct pipeline's query-writing prompt, pruned to question
+        like the agent's; the batch's, in a batch.
+        """
+        from batch_answers import current_batch
+
+        if self.schema_snapshots is not None:
+            return f"{self._schema_text(question)}\n\n{SCHEMA_QUALIFICATION_NOTE}"
+        batch = current_batch()
+        return batch.table_info() if batch is not None else self.describe_tables()
+
+    def describe_tables(self):
+        """
+        Schema description from the database, for running without a snapshot.
+        """
+        from schema_snapshot import JOIN_HINTS
+
+        schema_text = self.db.get_table_info() + "".join(f"\n{hint}" for hint in JOIN_HINTS)
+        return f"{schema_text}\n\n{SCHEMA_QUALIFICATION_NOTE}"
+
+    def examples_for(self, question):
+        """
+        The few-shot examples most similar to question as prompt text, or None.
+        """
+        from batch_answers import current_batch
+
+        if self.example_bank is None or not question:
+            return None
+        batch = current_batch()
+        if batch is not None and question in batch.examples:
+            return batch.examples[question]
+        return self.example_bank.render(question)
+
+    def agent_prompt(self, state):
+        """
+        Prompt callable for create_react_agent; re-reads the schema snapshot on
+        every call so a refresh takes effect without rebuilding the agent, and
+        appends the examples for the run's question and, in a conversation thread,
+        its summary and kept results. The schema is pruned to what the thread's
+        questions need (schema_context); a batch's questions share its snapshot.
+        """
+        from langchain_core.messages import SystemMessage
+        from conversations import current_conversation
+
+        questions = [message.content for message in state["messages"] if message.type == "human"]
+        # The last question: in a conversation thread the earlier ones come first
+        question = questions[-1] if questions else None
+        conversation = current_conversation()
+        # A follow-up ("now by month") needs the columns of the questions before it too
+        schema_question = "\n".join(questions) if conversation is not None else question
+        parts = [self.system_message(self._schema_text(schema_question)), self.examples_for(question),
+                 conversation.context_note() if conversation is not None else None]
+        content = "\n\n".join(part for part in parts if part)
+        return [SystemMessage(content=content)] + state["messages"]
+
+
+class _phase:
+    """
+    Context manager recording the duration of an initialization phase.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        startup_timings[self.name] = round(time.perf_counter() - self.started, 4)
+
+
+def record_timing(name, seconds):
+    """
+    Record a phase measured outside this module (e.g. importing the app).
+    """
+    startup_timings[name] = round(seconds, 4)
+
+
+def load_system_prompt(dialect="mssql", top_k=5):
+    """
+    Load the agent system prompt.
+    Uses the vendored snapshot in prompts/ unless AGENT_PROMPT_SOURCE=hub,
+    in which case the hub is tried first and the snapshot is the fallback.
+    """
+    if os.getenv("AGENT_PROMPT_SOURCE", "vendored").lower() == "hub":
+        try:
+            from langchain import hub
+            prompt_template = hub.pull("langchain-ai/sql-agent-system-prompt")
+            return prompt_template.format(dialect=dialect, top_k=top_k)
+        except Exception:
+            pass
+
+    return read_vendored_prompt("sql_agent_system_prompt").format(dialect=dialect, top_k=top_k)
+
+
+def read_vendored_prompt(name):
+    """
+    Return the unformatted text of prompts/<name>.<AGENT_PROMPT_VERSION>.txt.
+    """
+    version = os.getenv("AGENT_PROMPT_VERSION", "v1")
+    path = os.path.join(PROMPT_DIR, f"{name}.{version}.txt")
+    with open(path, encoding="utf-8") as prompt_file:
+        return prompt_file.read()
+
+
+def compose_system_message(base_prompt, schema_text=None, extra_notes=None):
+    """
+    Combine the base prompt with the notes and the rendered schema snapshot.
+    Without a snapshot the join hints are added as notes and the agent keeps
+    the discovery steps from the base prompt.
+    """
+    from schema_snapshot import JOIN_HINTS
+
+    extra_notes = list(extra_notes or [])
+    if schema_text is None:
+        notes = [SCHEMA_QUALIFICATION_NOTE] + [f"Note: {hint}" for hint in JOIN_HINTS] + PROMPT_NOTES + extra_notes
+        return base_prompt + "".join(f"\n\n{note}" for note in notes)
+
+    prompt = base_prompt.replace(DISCOVERY_INSTRUCTIONS, SNAPSHOT_INSTRUCTIONS)
+    notes = [SCHEMA_QUALIFICATION_NOTE] + PROMPT_NOTES + extra_notes
+    return prompt + "".join(f"\n\n{note}" for note in notes) + f"\n\n{schema_text}"
+
+
+def _build_schema_snapshots(db):
+    from schema_snapshot import SchemaSnapshotManager
+
+    # Schema snapshot persisted at SCHEMA_SNAPSHOT_PATH; rebuilt every
+    # SCHEMA_REFRESH_SECONDS (0 = only on startup without a snapshot, or via POST /schema/refresh)
+    if os.getenv("SCHEMA_SNAPSHOT_ENABLED", "true").lower() != "true":
+        return None
+    manager = SchemaSnapshotManager(
+        db._engine,
+        INCLUDE_TABLES,
+        os.getenv("SCHEMA_SNAPSHOT_PATH", "schema_snapshot.json"),
+        schema="src",
+        sample_rows=int(os.getenv("SCHEMA_SNAPSHOT_SAMPLE_ROWS", "3")),
+        refresh_seconds=int(os.getenv("SCHEMA_REFRESH_SECONDS", "0")),
+        # Rows read per view for the known values of its low-cardinality text columns (schema_context)
+        value_rows=int(os.getenv("SCHEMA_SNAPSHOT_VALUE_ROWS", "1000"))
+    )
+    manager.load_or_build()
+    return manager
+
+
+def _build_schema_context(schema_snapshots):
+    from schema_context import SchemaContext
+
+    # Only the views and columns a question needs go in its prompts (see schema_context);
+    # SCHEMA_CONTEXT=full sends the whole snapshot every time
+    if schema_snapshots is None or os.getenv("SCHEMA_CONTEXT", "pruned").lower() != "pruned":
+        return None
+    return SchemaContext(
+        schema_snapshots,
+        max_term_share=float(os.getenv("SCHEMA_CONTEXT_MAX_TERM_SHARE", "0.2"))
+    )
+
+
+def _build_validator(schema_snapshots):
+    from sql_validator import SqlValidator
+
+    # Local replacement for the LLM-based sql_db_query_checker; SQL_VALIDATOR=llm restores the original
+    if os.getenv("SQL_VALIDATOR", "local").lower() != "local":
+        return None
+    snapshot_fn = (lambda: schema_snapshots.snapshot) if schema_snapshots is not None else None
+    return SqlValidator(snapshot_fn, schema="src", allowed_tables=INCLUDE_TABLES)
+
+
+def _build_rollup_store(db):
+    from rollup_store import RollupStore
+
+    # Local SQLite rollup of work order counts at ROLLUP_PATH. Off by default because the
+    # first refresh copies every work order's grouping columns; later refreshes only read
+    # rows at or after the statusdate high-water mark, every ROLLUP_REFRESH_SECONDS.
+    if os.getenv("ROLLUP_ENABLED", "false").lower() != "true":
+        return None
+    store = RollupStore(
+        os.getenv("ROLLUP_PATH", "rollup.sqlite3"),
+        db._engine,
+        source_schema="src",
+        refresh_seconds=int(os.getenv("ROLLUP_REFRESH_SECONDS", "900"))
+    )
+    store.start_refreshing()
+    return store
+
+
+def _build_example_bank():
+    from example_bank import ExampleBank
+
+    # Verified question -> SQL examples injected per question (see example_bank)
+    if os.getenv("EXAMPLE_BANK_ENABLED", "true").lower() != "true":
+        return None
+    return ExampleBank(
+        os.getenv("EXAMPLE_BANK_PATH", "example_bank.jsonl"),
+        top_k=int(os.getenv("EXAMPLE_BANK_TOP_K", "3")),
+        min_similarity=float(os.getenv("EXAMPLE_BANK_MIN_SIMILARITY", "0.2")),
+        learn=os.getenv("EXAMPLE_BANK_LEARN", "false").lower() == "true"
+    )
+
+
+def _build_query_executor(db):
+    from query_executor import QueryExecutor
+
+    # Streaming fetch for sql_db_query: the model sees at most SQL_PREVIEW_ROWS rows,
+    # the rest of the result is spilled to CSV under SQL_SPILL_DIR for download. The first
+    # SQL_ARTIFACT_MAX_ROWS rows are also kept as a typed columnar artifact for charting.
+    # SQL_EXECUTOR=unbounded restores SQLDatabase.run.
+    if os.getenv("SQL_EXECUTOR", "bounded").lower() != "bounded":
+        return None
+    return QueryExecutor(
+        db._engine,
+        preview_rows=int(os.getenv("SQL_PREVIEW_ROWS", "50")),
+        preview_bytes=int(os.getenv("SQL_PREVIEW_BYTES", "8000")),
+        max_rows=int(os.getenv("SQL_MAX_ROWS", "200000")),
+        max_bytes=int(os.getenv("SQL_MAX_BYTES", str(64 * 1024 * 1024))),
+        timeout_seconds=int(os.getenv("SQL_QUERY_TIMEOUT_SECONDS", "60")),
+        spill_dir=os.getenv("SQL_SPILL_DIR", "query_results"),
+        spill_max_age_seconds=int(os.getenv("SQL_SPILL_MAX_AGE_SECONDS", "3600")),
+        max_string_length=db._max_string_length,
+        artifact_max_rows=int(os.getenv("SQL_ARTIFACT_MAX_ROWS", "50000"))
+    )
+
+
+def _build_query_guard(db):
+    from query_guard import QueryGuard
+
+    # Plan-based cost check before sql_db_query runs anything (see query_guard).
+    if os.getenv("SQL_GUARD", "on").lower() != "on":
+        return None
+    return QueryGuard(
+        db._engine,
+        max_cost=float(os.getenv("SQL_GUARD_MAX_COST", "500")),
+        max_scan_rows=int(os.getenv("SQL_GUARD_MAX_SCAN_ROWS", "5000000")),
+        row_limit=int(os.getenv("SQL_GUARD_ROW_LIMIT", "10000"))
+    )
+
+
+def _build_sql_rewriter(schema_snapshots):
+    from sql_rewriter import SqlRewriter
+
+    # YEAR()/MONTH() filters -> date ranges and quoted string keys before sql_db_query runs (see sql_rewriter)
+    if os.getenv("SQL_REWRITE", "on").lower() != "on":
+        return None
+    snapshot_fn = (lambda: schema_snapshots.snapshot) if schema_snapshots is not None else None
+    return SqlRewriter(snapshot_fn)
+
+
+def _connection_string():
+    azServer = os.getenv("AZSERVER")
+    azDatabase = os.getenv("AZDATABASE")
+    sqlUser = os.getenv("AZSQLUSER")
+    sqlPass = os.getenv("AZSQLPASS")
+    return f"mssql+pyodbc://{sqlUser}:{sqlPass}@{azServer}/{azDatabase}?driver=ODBC+Driver+17+for+SQL+Server"
+
+
+def _build_sql_cache(db):
+    from sql_cache import SqlResultCache
+
+    # Cache of SQL results keyed by canonicalized query text.
+    # Entries expire after SQL_CACHE_MAX_AGE_SECONDS; if SQL_CACHE_WATERMARK_QUERY is set
+    # (e.g. "SELECT MAX(statusdate) FROM src.vw_Maximo_WorkOrders") a change in its result
+    # invalidates the whole cache.
+    if os.getenv("SQL_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    watermark_query = os.getenv("SQL_CACHE_WATERMARK_QUERY", "")
+    return SqlResultCache(
+        max_entries=int(os.getenv("SQL_CACHE_MAX_ENTRIES", "256")),
+        max_bytes=int(os.getenv("SQL_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        max_age_seconds=int(os.getenv("SQL_CACHE_MAX_AGE_SECONDS", "300")),
+        watermark_fn=(lambda: db.run(watermark_query)) if watermark_query else None,
+        watermark_check_seconds=int(os.getenv("SQL_CACHE_WATERMARK_CHECK_SECONDS", "60"))
+    )
+
+
+def build_runtime(llm=None, db=None):
+    """
+    Build the agent runtime, timing each phase.
+    An llm or db can be passed in to run against stand-ins (e.g. in benchmarks).
+    """
+    started = time.perf_counter()
+
+    with _phase("import_langchain"):
+        from langchain_openai import ChatOpenAI
+        from langchain_community.utilities import SQLDatabase
+        from langgraph.prebuilt import create_react_agent
+        from sql_tools import build_tools
+        from direct_pipeline import build_direct_pipeline
+        from db_pool import create_maximo_engine, start_keepalive, warm_pool
+        from instrumentation import instrument_engine
+
+    with _phase("load_prompt"):
+        base_prompt = load_system_prompt(dialect="mssql", top_k=5)
+
+    with _phase("create_llm"):
+        if llm is None:
+            # streaming: always stream, so a cancelled request can drop the response mid-generation
+            # (cancellation); stream_usage: report token counts on streamed responses too (instrumentation)
+            llm = ChatOpenAI(model="gpt-4o-mini", api_key=os.getenv("OPENAI_API_KEY"), streaming=True,
+                             stream_usage=True)
+
+    with _phase("connect_database"):
+        if db is None:
+            # Reflection is deferred until sql_db_schema actually needs it;
+            # the schema snapshot normally makes that unnecessary.
+            engine = create_maximo_engine(os.getenv("DATABASE_URL") or _connection_string())
+            db = SQLDatabase(
+                engine,
+                include_tables=INCLUDE_TABLES,
+                # The SQLite stand-in holds the views as tables and cannot list materialized views
+                view_support=engine.dialect.name != "sqlite",
+                schema="src",
+                lazy_table_reflection=True
+            )
+        # Time SQL statements per request for /metrics and the response timings
+        instrument_engine(db._engine)
+
+    with _phase("warm_pool"):
+        # Open the pool's first connections now rather than on the first question
+        warm_pool(db._engine)
+        start_keepalive(db._engine)
+
+    with _phase("load_schema_snapshot"):
+        schema_snapshots = _build_schema_snapshots(db)
+        schema_context = _build_schema_context(schema_snapshots)
+
+    with _phase("open_rollup_store"):
+        rollup_store = _build_rollup_store(db)
+
+    with _phase("build_tools"):
+        sql_cache = _build_sql_cache(db)
+        query_executor = _build_query_executor(db)
+        validator = _build_validator(schema_snapshots)
+        tools = build_tools(
+            db, llm,
+            sql_cache=sql_cache,
+            validator=validator,
+            validate_before_execute=os.getenv("SQL_VALIDATE_BEFORE_EXECUTE", "true").lower() == "true",
+            rollup_store=rollup_store,
+            query_executor=query_executor,
+            query_guard=_build_query_guard(db),
+            sql_rewriter=_build_sql_rewriter(schema_snapshots),
+            # Follow-up questions in a conversation thread re-slice its kept results (conversations)
+            previous_results=os.getenv("CONVERSATIONS_ENABLED", "true").lower() == "true"
+        )
+
+    with _phase("load_example_bank"):
+        example_bank = _build_example_bank()
+
+    with _phase("create_agent"):
+        runtime = AgentRuntime(llm, db, tools, sql_cache, base_prompt, schema_snapshots, rollup_store,
+                               query_executor, example_bank, schema_context)
+        runtime.agent_executor = create_react_agent(llm, tools, prompt=runtime.agent_prompt)
+        runtime.direct_pipeline = build_direct_pipeline(
+            llm,
+            next(tool for tool in tools if tool.name == "sql_db_query"),
+            read_vendored_prompt("sql_query_system_prompt"),
+            runtime.table_info,
+            dialect="mssql",
+            top_k=5,
+            examples=runtime.examples_for
+        )
+
+    record_timing("init_total", time.perf_counter() - started)
+    return runtime
+
+
+def get_runtime():
+    """
+    Return the agent runtime, building it (or waiting for the background build) if needed.
+    """
+    global _runtime, _init_error
+    if _runtime is not None:
+        return _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            try:
+                _runtime = build_runtime()
+                _init_error = None
+            except Exception as e:
+                _init_error = str(e)
+                raise
+    return _runtime
+
+
+def set_runtime(runtime):
+    """
+    Install an already built runtime (e.g. one built around stand-in llm/db objects).
+    """
+    global _runtime, _init_error
+    with _runtime_lock:
+        _runtime = runtime
+        _init_error = None
+
+
+def current_runtime():
+    """
+    Return the runtime if it has been built, without triggering a build.
+    """
+    return _runtime
+
+
+def start(mode=None):
+    """
+    Start initialization according to AGENT_INIT_MODE (or the given mode).
+    """
+    global _init_thread
+    mode = (mode or os.getenv("AGENT_INIT_MODE", "background")).lower()
+    if mode == "eager":
+        get_runtime()
+    elif mode == "background" and _init_thread is None:
+        def build_in_background():
+            try:
+                get_runtime()
+            except Exception:
+                # Recorded in _init_error and reported by readiness()
+                pass
+
+        _init_thread = threading.Thread(target=build_in_background, name="agent-init", daemon=True)
+        _init_thread.start()
+
+
+def readiness():
+    """
+    Report whether the agent is ready to serve, with the initialization timings.
+    """
+    return {
+        "ready": _runtime is not None,
+        "error": _init_error,
+        "timings": dict(startup_timings)
+    }
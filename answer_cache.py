@@ -0,0 +1,154 @@
+"""
+Persistent question-to-answer cache for the SQL question app.
+
+Answers are keyed on the normalized question plus the 'visualize' flag and stored
+in a SQLite database, so cached answers survive restarts and are shared by every
+worker process on the host. Entries expire after a configurable TTL and the least
+recently used entries are evicted once the cache grows past its size bound.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+def normalize_question(question):
+    """
+    Fold case, whitespace and punctuation so that trivially different phrasings
+    of the same question share a cache entry.
+    e.g. "Which location has the most work orders?" -> "which location has the most work orders"
+    """
+    text = question.casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def make_cache_key(question, visualize):
+    """
+    Build the cache key from the normalized question and the visualize flag.
+    """
+    return f"{int(bool(visualize))}:{normalize_question(question)}"
+
+
+class AnswerCache:
+    """
+    SQLite-backed answer cache with TTL expiry and LRU eviction.
+
+    get() returns a (status, payload) tuple where status is one of:
+      - 'hit':   a fresh entry was found and payload holds the cached answer
+      - 'stale': an entry was found but it is older than the TTL, payload is None
+      - 'miss':  no entry was found, payload is None
+    """
+
+    def __init__(self, path, ttl_seconds=86400, max_entries=1000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " cache_key TEXT PRIMARY KEY,"
+            " question TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_answers_last_access ON answers (last_access)")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache_stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, conn, name):
+        conn.execute(
+            "INSERT INTO cache_stats (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+
+    def get(self, question, visualize):
+        """
+        Look up the answer for a question.
+        """
+        key = make_cache_key(question, visualize)
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT payload, created_at FROM answers WHERE cache_key = ?", (key,)).fetchone()
+
+        if row is None:
+            self._count(conn, 'miss')
+            return 'miss', None
+
+        payload, created_at = row
+        if self.ttl_seconds and now - created_at > self.ttl_seconds:
+            self._count(conn, 'stale')
+            return 'stale', None
+
+        conn.execute(
+            "UPDATE answers SET last_access = ?, hits = hits + 1 WHERE cache_key = ?",
+            (now, key)
+        )
+        self._count(conn, 'hit')
+        return 'hit', json.loads(payload)
+
+    def set(self, question, visualize, payload):
+        """
+        Store the answer for a question, replacing any previous entry,
+        then evict the least recently used entries above max_entries.
+        """
+        key = make_cache_key(question, visualize)
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (cache_key, question, payload, created_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, question, json.dumps(payload, default=str), now, now)
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE cache_key IN ("
+                " SELECT cache_key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        """
+        Return hit/miss/stale counters, the number of entries and the hit rate.
+        """
+        conn = self._connection()
+        counters = dict(conn.execute("SELECT name, value FROM cache_stats").fetchall())
+        hits = counters.get('hit', 0)
+        lookups = hits + counters.get('miss', 0) + counters.get('stale', 0)
+        return {
+            "hit": hits,
+            "miss": counters.get('miss', 0),
+            "stale": counters.get('stale', 0),
+            "entries": conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0],
+            "hit_rate": hits / lookups if lookups else 0.0
+        }
+
+    def clear(self):
+        """
+        Remove every cached answer and reset the counters.
+        """
+        conn = self._connection()
+        conn.execute("DELETE FROM answers")
+        conn.execute("DELETE FROM cache_stats")
@@ -0,0 +1,478 @@
+"""
+Runs a question through the selected answering path and yields its output.
+
+Both the Flask and ASGI apps consume these generators. They yield
+('token', text) for incremental LLM output and ('message', message) for each
+complete LangGraph message, and fill in a metadata dict recording which path
+answered and how many LLM calls it used. Each run is traced (instrumentation):
+LLM, tool and SQL timings feed the /metrics histograms and, when requested,
+the 'timings' breakdown in the metadata. Each run can also be cancelled
+(cancellation): by the client going away, or through its request id.
+coalesced_stream_answer / acoalesced_stream_answer share one run between
+concurrent requests for the same question (singleflight). A run in a
+conversation thread gets the thread's history and records its turn
+(conversations).
+
+Modes:
+  - 'agent':  the ReAct agent (unbounded number of LLM calls)
+  - 'direct': the fixed write_query -> execute_query -> generate_answer pipeline,
+              falling back to the agent only if it fails; follow-up questions in a
+              thread take the agent path, as the pipeline only sees the question
+"""
+import asyncio
+import logging
+import time
+
+import cancellation
+from cancellation import CancelToken, RequestCancelled
+from conversations import activate, final_answer
+from instrumentation import TRACE_IN_RESPONSE, RequestTrace, callback_handler
+from singleflight import SharedRunFailed
+
+ANSWER_MODES = ('agent', 'direct')
+
+# Graph nodes whose LLM output is the user-facing answer and is worth streaming as tokens;
+# write_query's structured output is SQL in JSON form, so it is not streamed.
+TOKEN_NODES = ('agent', 'generate_answer')
+
+logger = logging.getLogger(__name__)
+
+
+def new_metadata(mode, include_trace=False, request_id=None, conversation=None, owner=None):
+    """
+    Per-request metadata; 'path' is one of 'agent', 'direct', 'agent_fallback', 'cache' or
+    'coalesced' (answered by an identical concurrent request's run).
+    With include_trace (or TRACE_IN_RESPONSE) the finished metadata carries the 'timings' breakdown.
+    The run can be cancelled by request_id (generated if not given) while it streams, by its
+    owner (the session that asked) only.
+    With a conversation the run continues that thread, whose id the finished metadata carries.
+    """
+    cancel_token = CancelToken(request_id, owner)
+    return {"mode": mode, "path": None, "llm_calls": 0, "elapsed_seconds": None, "started": time.perf_counter(),
+            "request_id": cancel_token.request_id, "request_trace": RequestTrace(),
+            "include_trace": include_trace or TRACE_IN_RESPONSE, "cancel_token": cancel_token,
+            "conversation": conversation}
+
+
+def finish_metadata(metadata):
+    """
+    Stamp the elapsed time, record the request's metrics and drop internal fields
+    before the metadata is returned to the client.
+    """
+    started = metadata.pop("started", None)
+    if started is not None:
+        metadata["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    trace = metadata.pop("request_trace", None)
+    include_trace = metadata.pop("include_trace", False)
+    metadata.pop("cancel_token", None)
+    conversation = metadata.pop("conversation", None)
+    if conversation is not None:
+        metadata["thread_id"] = conversation.thread_id
+    if trace is not None:
+        trace.finish(metadata["path"], metadata["llm_calls"], metadata["elapsed_seconds"] or 0.0)
+        if include_trace:
+            metadata["timings"] = trace.summary(metadata["llm_calls"])
+    return metadata
+
+
+def _token(chunk):
+    message_chunk, chunk_metadata = chunk
+    if message_chunk.type == 'AIMessageChunk' and message_chunk.content \
+            and chunk_metadata.get('langgraph_node') in TOKEN_NODES:
+        return message_chunk.content
+    return None
+
+
+def _agent_input(question, history=()):
+    return {"messages": [*history, {"role": "user", "content": question}]}
+
+
+def _stream_modes(stream_tokens):
+    return ["messages", "values"] if stream_tokens else ["values"]
+
+
+def _run_config(metadata):
+    return {"callbacks": [callback_handler(metadata["request_trace"]),
+                          cancellation.callback_handler(metadata["cancel_token"])]}
+
+
+def _finish_run(runtime, question, messages, conversation, history):
+    """
+    Record a finished run's turn in its conversation and offer a context-free run to the example bank.
+    """
+    if conversation is not None:
+        conversation.record_turn(question, final_answer(messages), messages)
+    # A follow-up question ("and by month?") is no example without the turns before it
+    if not history:
+        _learn_example(runtime, question, messages)
+
+
+def _start_conversation(metadata):
+    """
+    The history to replay for the run's conversation, and the function ending its activation.
+    """
+    conversation = metadata.get("conversation")
+    if conversation is None:
+        return [], None
+    return conversation.history(), activate(conversation)
+
+
+def _learn_example(runtime, question, messages):
+    """
+    Offer a finished run to the example bank (which only keeps it with EXAMPLE_BANK_LEARN on).
+    """
+    example_bank = getattr(runtime, "example_bank", None)
+    if example_bank is None:
+        return
+    try:
+        example_bank.learn_from_run(question, messages)
+    except Exception as e:
+        logger.warning("Could not add the run to the example bank: %s", e)
+
+
+def _check_direct_result(state):
+    from direct_pipeline import DirectPipelineError
+
+    if state is None or not state.get("answer"):
+        error = state.get("error") if state else None
+        raise DirectPipelineError(error or "direct pipeline produced no answer")
+
+
+def stream_answer(runtime, question, mode, metadata, stream_tokens=False):
+    """
+    Yield ('token', text) and ('message', message) tuples for a question.
+    Raises RequestCancelled once the run is cancelled; closing the generator cancels it.
+    """
+    # First: a request id already in use (RequestIdInUse) must leave nothing started
+    cancel_token = metadata["cancel_token"].start()
+    trace = metadata["request_trace"].start()
+    history, end_conversation = _start_conversation(metadata)
+    messages = []
+    try:
+        for item in _stream_answer(runtime, question, mode, metadata, stream_tokens, history):
+            cancel_token.raise_if_cancelled()
+            if item[0] == 'message':
+                messages.append(item[1])
+            yield item
+        _finish_run(runtime, question, messages, metadata.get("conversation"), history)
+    except GeneratorExit:
+        # The response was closed before the answer was complete: the client went away
+        cancel_token.cancel("client disconnected")
+        raise
+    finally:
+        if end_conversation is not None:
+            end_conversation()
+        cancel_token.stop()
+        trace.stop()
+
+
+def _stream_answer(runtime, question, mode, metadata, stream_tokens, history):
+    if mode == 'direct' and not history:
+        try:
+            yield from _stream_direct(runtime, question, metadata, stream_tokens)
+            metadata["path"] = 'direct'
+            return
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            metadata["direct_error"] = str(e)
+            metadata["path"] = 'agent_fallback'
+    else:
+        metadata["path"] = 'agent'
+
+    for stream_mode, chunk in runtime.agent_executor.stream(_agent_input(question, history), _run_config(metadata),
+                                                            stream_mode=_stream_modes(stream_tokens)):
+        if stream_mode == "messages":
+            token = _token(chunk)
+            if token:
+                yield 'token', token
+            continue
+        message = chunk["messages"][-1]
+        if message.type == 'ai':
+            metadata["llm_calls"] += 1
+        yield 'message', message
+
+
+def _stream_direct(runtime, question, metadata, stream_tokens):
+    from direct_pipeline import initial_state
+
+    seen = 0
+    state = None
+    try:
+        for stream_mode, chunk in runtime.direct_pipeline.stream(initial_state(question), _run_config(metadata),
+                                                                 stream_mode=_stream_modes(stream_tokens)):
+            if stream_mode == "messages":
+                token = _token(chunk)
+                if token:
+                    yield 'token', token
+                continue
+            state = chunk
+            for message in state["messages"][seen:]:
+                yield 'message', message
+            seen = len(state["messages"])
+    finally:
+        if state is not None:
+            metadata["llm_calls"] += state["llm_calls"]
+    _check_direct_result(state)
+
+
+async def astream_answer(runtime, question, mode, metadata, stream_tokens=False):
+    """
+    Async counterpart of stream_answer, driving the graphs through astream.
+    Cancelling the consuming task also cancels the run.
+    """
+    cancel_token = metadata["cancel_token"].start()
+    trace = metadata["request_trace"].start()
+    history, end_conversation = _start_conversation(metadata)
+    messages = []
+    try:
+        async for item in _astream_answer(runtime, question, mode, metadata, stream_tokens, history):
+            cancel_token.raise_if_cancelled()
+            if item[0] == 'message':
+                messages.append(item[1])
+            yield item
+        _finish_run(runtime, question, messages, metadata.get("conversation"), history)
+    except (GeneratorExit, asyncio.CancelledError):
+        # The server cancels the handler when the client disconnects; the pending
+        # LLM request is closed with the task, SQL running in a worker thread is cancelled here
+        cancel_token.cancel("client disconnected")
+        raise
+    finally:
+        if end_conversation is not None:
+            end_conversation()
+        cancel_token.stop()
+        trace.stop()
+
+
+async def _astream_answer(runtime, question, mode, metadata, stream_tokens, history):
+    if mode == 'direct' and not history:
+        try:
+            async for item in _astream_direct(runtime, question, metadata, stream_tokens):
+                yield item
+            metadata["path"] = 'direct'
+            return
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            metadata["direct_error"] = str(e)
+            metadata["path"] = 'agent_fallback'
+    else:
+        metadata["path"] = 'agent'
+
+    async for stream_mode, chunk in runtime.agent_executor.astream(_agent_input(question, history),
+                                                                   _run_config(metadata),
+                                                                   stream_mode=_stream_modes(stream_tokens)):
+        if stream_mode == "messages":
+            token = _token(chunk)
+            if token:
+                yield 'token', token
+            continue
+        message = chunk["messages"][-1]
+        if message.type == 'ai':
+            metadata["llm_calls"] += 1
+        yield 'message', message
+
+
+async def _astream_direct(runtime, question, metadata, stream_tokens):
+    from direct_pipeline import initial_state
+
+    seen = 0
+    state = None
+    try:
+        async for stream_mode, chunk in runtime.direct_pipeline.astream(initial_state(question), _run_config(metadata),
+                                                                        stream_mode=_stream_modes(stream_tokens)):
+            if stream_mode == "messages":
+                token = _token(chunk)
+                if token:
+                    yield 'token', token
+                continue
+            state = chunk
+            for message in state["messages"][seen:]:
+                yield 'message', message
+            seen = len(state["messages"])
+    finally:
+        if state is not None:
+            metadata["llm_calls"] += state["llm_calls"]
+    _check_direct_result(state)
+
+
+def _lead(flights, flight, items):
+    """
+    Publish a leader's items to its flight as they are yielded, and end the flight with the run.
+    """
+    status, error = 'abandoned', None
+    try:
+        for item in items:
+            flight.publish(item)
+            yield item
+        status = 'done'
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        status, error = 'error', str(e)
+        raise
+    finally:
+        flights.finish(flight, status, error)
+
+
+async def _alead(flights, flight, items):
+    status, error = 'abandoned', None
+    try:
+        async for item in items:
+            flight.publish(item)
+            yield item
+        status = 'done'
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        status, error = 'error', str(e)
+        raise
+    finally:
+        flights.finish(flight, status, error)
+
+
+def _following(metadata, flight):
+    metadata["path"] = 'coalesced'
+    metadata["coalesced_with"] = flight.leader_id
+
+
+def _followed(flights, metadata, status, error):
+    """
+    True once the followed run answered; raises if it failed. An abandoned run is started over.
+    """
+    if status == 'done':
+        flights.run_saved()
+        return True
+    if status == 'error':
+        raise SharedRunFailed(f"The run answering this question for request {metadata['coalesced_with']} "
+                              f"failed: {error}")
+    metadata.pop("coalesced_with", None)
+    flights.restarted()
+    return False
+
+
+def coalesced_stream_answer(runtime, question, mode, metadata, flights, key, lookup=None, stream_tokens=False):
+    """
+    stream_answer shared between concurrent requests for the same key (singleflight):
+    the first request runs the question, the others get its items. Also yields
+      - ('restart', None) when the run being followed was abandoned after some of its
+        items were yielded; the question starts over and the items so far are void
+      - ('cached', payload) when another worker answered the question; payload is
+        lookup()'s answer from the shared answer cache
+    Without flights this is stream_answer.
+    """
+    if flights is None:
+        yield from stream_answer(runtime, question, mode, metadata, stream_tokens)
+        return
+
+    cancel_token = metadata["cancel_token"].register()
+    followed = False
+    try:
+        while True:
+            role, flight = flights.join(key, metadata["request_id"])
+            if role == 'leader':
+                yield from _lead(flights, flight, stream_answer(runtime, question, mode, metadata, stream_tokens))
+                return
+
+            if role == 'follower':
+                _following(metadata, flight)
+                for item in flight.follow(cancel_token):
+                    if item[0] == 'end':
+                        status, error = item[1]
+                        break
+                    followed = True
+                    yield item
+                if _followed(flights, metadata, status, error):
+                    return
+                if followed:
+                    followed = False
+                    yield 'restart', None
+                continue
+
+            status = flights.wait_remote(key, cancel_token)
+            if status == 'done' and lookup is not None:
+                payload = _poll_lookup(lookup, flights.grace_seconds, flights.poll_seconds)
+                if payload is not None:
+                    metadata["path"] = 'coalesced'
+                    flights.run_saved()
+                    yield 'cached', payload
+                    return
+            if status == 'timeout':
+                # The other worker's run is taking too long to wait for; answer independently
+                yield from stream_answer(runtime, question, mode, metadata, stream_tokens)
+                return
+    except GeneratorExit:
+        cancel_token.cancel("client disconnected")
+        raise
+    finally:
+        cancel_token.stop()
+
+
+def _poll_lookup(lookup, grace_seconds, poll_seconds):
+    # The other worker stores its answer right after its run ends
+    deadline = time.monotonic() + grace_seconds
+    while True:
+        payload = lookup()
+        if payload is not None or time.monotonic() > deadline:
+            return payload
+        time.sleep(poll_seconds)
+
+
+async def acoalesced_stream_answer(runtime, question, mode, metadata, flights, key, lookup=None,
+                                   stream_tokens=False):
+    """
+    Async counterpart of coalesced_stream_answer; lookup is a blocking function run in a thread.
+    """
+    if flights is None:
+        async for item in astream_answer(runtime, question, mode, metadata, stream_tokens):
+            yield item
+        return
+
+    cancel_token = metadata["cancel_token"].register()
+    followed = False
+    try:
+        while True:
+            # May wait on the lock store's file lock
+            role, flight = await asyncio.to_thread(flights.join, key, metadata["request_id"])
+            if role == 'leader':
+                async for item in _alead(flights, flight,
+                                         astream_answer(runtime, question, mode, metadata, stream_tokens)):
+                    yield item
+                return
+
+            if role == 'follower':
+                _following(metadata, flight)
+                async for item in flight.afollow(cancel_token):
+                    if item[0] == 'end':
+                        status, error = item[1]
+                        break
+                    followed = True
+                    yield item
+                if _followed(flights, metadata, status, error):
+                    return
+                if followed:
+                    followed = False
+                    yield 'restart', None
+                continue
+
+            status = await flights.await_remote(key, cancel_token)
+            if status == 'done' and lookup is not None:
+                deadline = time.monotonic() + flights.grace_seconds
+                payload = await asyncio.to_thread(lookup)
+                while payload is None and time.monotonic() < deadline:
+                    await asyncio.sleep(flights.poll_seconds)
+                    payload = await asyncio.to_thread(lookup)
+                if payload is not None:
+                    metadata["path"] = 'coalesced'
+                    flights.run_saved()
+                    yield 'cached', payload
+                    return
+            if status == 'timeout':
+                async for item in astream_answer(runtime, question, mode, metadata, stream_tokens):
+                    yield item
+                return
+    except (GeneratorExit, asyncio.CancelledError):
+        cancel_token.cancel("client disconnected")
+        raise
+    finally:
+        cancel_token.stop()
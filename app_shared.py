@@ -0,0 +1,380 @@
+"""
+State and helpers shared by the Flask app (Sql_Question_App.py) and the ASGI app
+(Sql_Question_App_Async.py): the answer cache, single-flight and conversation
+stores configured from the environment, and the request parsing, answer
+assembly and event formatting both front ends use.
+
+Importing it builds no app and does not start agent_runtime; each front end
+does that itself.
+"""
+import ast
+import json
+import os
+import re
+import uuid
+
+from dotenv import load_dotenv
+
+import agent_runtime
+from answer_flow import ANSWER_MODES, new_metadata, finish_metadata
+from answer_cache import AnswerCache, make_cache_key
+from batch_answers import parse_batch
+from chart_inference import infer_chart
+from conversations import ConversationStore, extractive_summary, llm_summary
+from singleflight import SingleFlight
+
+load_dotenv(".env.prod")
+
+# Question-to-answer cache in front of the agent
+answer_cache = None
+if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true":
+    answer_cache = AnswerCache(
+        os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite3"),
+        ttl_seconds=int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400")),
+        max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    )
+
+# Concurrent identical questions share one run (see singleflight). Across the host's worker
+# processes the key is locked in SINGLEFLIGHT_LOCK_PATH and the answer is passed on through
+# the answer cache, so that part is only on with the answer cache.
+single_flight = None
+if os.getenv("SINGLEFLIGHT_ENABLED", "true").lower() == "true":
+    single_flight = SingleFlight(
+        (os.getenv("SINGLEFLIGHT_LOCK_PATH", "singleflight.sqlite3") or None) if answer_cache is not None else None,
+        stale_seconds=int(os.getenv("SINGLEFLIGHT_STALE_SECONDS", "15")),
+        wait_seconds=int(os.getenv("SINGLEFLIGHT_WAIT_SECONDS", "300"))
+    )
+
+# /ask/batch: questions per request, and questions of one batch answered at a time
+# (by default and at most; each running question holds a SQL connection while it queries)
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "100"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Conversation threads for follow-up questions (see conversations), in this process's memory
+conversations = None
+if os.getenv("CONVERSATIONS_ENABLED", "true").lower() == "true":
+    _summary_tokens = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "400"))
+    conversations = ConversationStore(
+        max_threads=int(os.getenv("CONVERSATION_MAX_THREADS", "500")),
+        max_thread_bytes=int(os.getenv("CONVERSATION_MAX_THREAD_BYTES", str(8 * 1024 * 1024))),
+        max_total_bytes=int(os.getenv("CONVERSATION_MAX_TOTAL_BYTES", str(256 * 1024 * 1024))),
+        ttl_seconds=int(os.getenv("CONVERSATION_TTL_SECONDS", str(4 * 3600))),
+        history_tokens=int(os.getenv("CONVERSATION_HISTORY_TOKENS", "2000")),
+        summary_tokens=_summary_tokens,
+        max_results=int(os.getenv("CONVERSATION_MAX_RESULTS", "5")),
+        max_result_rows=int(os.getenv("CONVERSATION_MAX_RESULT_ROWS", "20000")),
+        # previous_results_query reads and runs for as long as sql_db_query may
+        query_max_rows=int(os.getenv("SQL_MAX_ROWS", "200000")),
+        query_timeout_seconds=int(os.getenv("SQL_QUERY_TIMEOUT_SECONDS", "60")),
+        summarize=(llm_summary(lambda: agent_runtime.get_runtime().llm, _summary_tokens)
+                   if os.getenv("CONVERSATION_SUMMARY", "extractive") == "llm"
+                   else extractive_summary(_summary_tokens))
+    )
+
+# Answering path used when a request does not choose one: 'agent' or 'direct'
+DEFAULT_ANSWER_MODE = os.getenv("ANSWER_MODE", "agent")
+
+# Client-chosen request ids (for cancelling a question) must look like this
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# The browser session a run or conversation thread belongs to: only it can cancel the run or
+# read and continue the thread. Issued by the server on the first response without one.
+SESSION_COOKIE = "maximo_session"
+SESSION_COOKIE_SECURE = os.getenv("SESSION_COOKIE_SECURE", "false").lower() == "true"
+_SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def generate_dynamic_visualization_data(steps, visualize):
+    """
+    Dynamically parse the agent's output to create chart data.
+    
+    1. If 'visualize' is False, return None.
+    2. Otherwise, iterate over each step:
+       - Take the SQL result as typed columns: the tool message artifact when there is one,
+         otherwise the step content if it is a Python literal list of tuples.
+       - Let chart_inference pick the chart (time series, top-N categories or a
+         multi-series pivot) from the column types and cardinality.
+       - Finally, try parsing bullet-point text with a year header and month-value bullets.
+    3. Return the first successfully parsed data or None if nothing could be parsed.
+    """
+    if not visualize:
+        return None
+
+    for step in steps:
+        content = step.get('content', '').strip()
+
+        # 1) Typed columns from a SQL result
+        result = _result_columns(step)
+        if result is not None:
+            chart_data = infer_chart(result)
+            if chart_data is not None:
+                return chart_data
+
+        # 2) Otherwise, try parsing the bullet-point text format
+        if '###' in content:
+            chart_data = _parse_bullet_point_text(content)
+            if chart_data is not None and len(chart_data['labels']) > 0:
+                return chart_data
+
+    return None
+
+
+def _result_columns(step):
+    """
+    Return the step's SQL result as {'columns': [...], 'types': [...], 'data': [[...], ...]}
+    (one value list per column), or None if the step holds no tabular result.
+    Steps from sql_db_query carry this as their artifact; other list-literal
+    contents (e.g. from SQL_EXECUTOR=unbounded) are converted with ast.literal_eval.
+    """
+    artifact = step.get('artifact')
+    if artifact is not None:
+        return artifact
+    content = step.get('content', '').strip()
+    if not (content.startswith('[') and content.endswith(']')):
+        return None
+    try:
+        rows = ast.literal_eval(content)
+    except Exception:
+        return None
+    if not rows or not isinstance(rows, list) or not all(isinstance(row, tuple) for row in rows):
+        return None
+    width = len(rows[0])
+    if any(len(row) != width for row in rows):
+        return None
+    return {"columns": None, "types": None, "data": [list(column) for column in zip(*rows)]}
+
+def _parse_bullet_point_text(content):
+    """
+    Parse bullet-point text with a year heading and month-value bullets.
+    For example:
+      ### 2024
+      - **January**: 1160
+      - **February**: 1382
+      - **March**: 1509
+      - **April**: 1228
+    Returns a dict { 'labels': [...], 'values': [...] }.
+    """
+    lines = content.split('\n')
+    current_year = None
+    labels = []
+    values = []
+
+    # Regex to match a year heading, e.g. "### 2024"
+    year_pattern = re.compile(r'^###\s+(\d{4})$')
+    # Regex to match a bullet line, e.g. "- **January**: 1160"
+    month_pattern = re.compile(r'^-\s\*\*(\w+)\*\*:\s(\d+)')
+
+    for line in lines:
+        line = line.strip()
+        match_year = year_pattern.match(line)
+        if match_year:
+            current_year = match_year.group(1)
+            continue
+
+        match_month = month_pattern.match(line)
+        if match_month and current_year:
+            month_name = match_month.group(1)
+            value = int(match_month.group(2))
+            labels.append(f"{month_name} {current_year}")
+            values.append(value)
+    
+    return {"labels": labels, "values": values}
+
+
+def message_to_step(message):
+    """
+    Convert a LangGraph message into a step dict. SQL results keep the tool's
+    typed columnar artifact under 'artifact' for the visualization layer;
+    public_step drops it before the step is sent to the browser.
+    """
+    step_types = {'human': 'Human Message', 'ai': 'AI Message', 'tool': 'Tool Message'}
+    step = {
+        'type': step_types.get(message.type, 'Tool Message'),
+        'content': message.content
+    }
+    artifact = getattr(message, 'artifact', None)
+    if isinstance(artifact, dict) and 'data' in artifact:
+        step['artifact'] = artifact
+    return step
+
+
+def public_step(step):
+    """
+    The step as returned to the browser and stored in the answer cache.
+    """
+    return {key: value for key, value in step.items() if key != 'artifact'}
+
+
+def tool_call_events(message):
+    """
+    Extract the tool calls requested by an AI message.
+    For 'sql_db_query' calls the SQL statement is also exposed as 'sql'.
+    """
+    events = []
+    for tool_call in getattr(message, 'tool_calls', None) or []:
+        args = tool_call.get('args', {})
+        events.append({
+            'id': tool_call.get('id'),
+            'name': tool_call.get('name'),
+            'args': args,
+            'sql': args.get('query') if tool_call.get('name') == 'sql_db_query' else None
+        })
+    return events
+
+
+def sse(event, data):
+    """
+    Format a single Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def lookup_cached_answer(question, visualize_flag):
+    """
+    Return (cache_status, payload); the status is 'disabled' when no cache is configured.
+    """
+    if answer_cache is None:
+        return 'disabled', None
+    return answer_cache.get(question, visualize_flag)
+
+
+def cached_answer(question, visualize_flag):
+    """
+    The cached answer payload, or None; how followers in other workers pick up an answer.
+    """
+    cache_status, payload = lookup_cached_answer(question, visualize_flag)
+    return payload if cache_status == 'hit' else None
+
+
+def coalesce_args(question, visualize_flag, conversation=None):
+    """
+    The single-flight arguments of coalesced_stream_answer for a question.
+    A question in a conversation thread depends on the thread, so it is never shared.
+    """
+    if conversation is not None:
+        return None, None, None
+    return (single_flight, make_cache_key(question, visualize_flag),
+            lambda: cached_answer(question, visualize_flag))
+
+
+def store_answer(question, visualize_flag, answer, response_steps, metadata):
+    # A follower's answer is the one its leader stores
+    if answer_cache is not None and response_steps and metadata["path"] != 'coalesced':
+        answer_cache.set(question, visualize_flag, answer)
+
+
+def replay_cached_answer(cached, metadata):
+    """
+    SSE events for an answer taken from the answer cache: its steps, then 'final'.
+    """
+    for step in cached['steps']:
+        yield sse('step', step)
+    yield sse('final', {
+        "final_answer": cached['final_answer'],
+        "visualizationData": cached['visualizationData'],
+        "cache": 'hit',
+        "metadata": metadata
+    })
+
+
+def build_answer(response_steps, visualize_flag):
+    """
+    Assemble the answer payload from the agent's steps.
+    """
+    final_answer = response_steps[-1]['content'] if response_steps else "No answer generated."
+
+    # Generate dynamic visualization data from the response steps
+    visualization_data = generate_dynamic_visualization_data(response_steps, visualize_flag)
+
+    return {
+        "steps": [public_step(step) for step in response_steps],
+        "final_answer": final_answer,
+        "visualizationData": visualization_data
+    }
+
+
+def answer_mode(data):
+    """
+    The answering path requested by the client, or the default.
+    """
+    mode = data.get('mode') or DEFAULT_ANSWER_MODE
+    return mode if mode in ANSWER_MODES else DEFAULT_ANSWER_MODE
+
+
+def request_id_for(data):
+    """
+    The client's request id for /ask/<request_id>/cancel, or a new one.
+    """
+    request_id = data.get('request_id')
+    if isinstance(request_id, str) and REQUEST_ID_PATTERN.match(request_id):
+        return request_id
+    return uuid.uuid4().hex
+
+
+def session_for(cookies):
+    """
+    The session id from the request's cookies, or a new one.
+    """
+    session = cookies.get(SESSION_COOKIE)
+    if isinstance(session, str) and _SESSION_ID_PATTERN.match(session):
+        return session
+    return uuid.uuid4().hex
+
+
+def set_session_cookie(response, cookies, session):
+    """
+    Send the session cookie with the response if the request did not carry it.
+    """
+    if cookies.get(SESSION_COOKIE) != session:
+        response.set_cookie(SESSION_COOKIE, session, httponly=True, samesite='Lax', secure=SESSION_COOKIE_SECURE)
+    return response
+
+
+def cancelled_payload(metadata):
+    return {"cancelled": True, "request_id": metadata["request_id"],
+            "reason": metadata["cancel_token"].reason, "metadata": finish_metadata(metadata)}
+
+
+def cache_hit_metadata(mode, conversation=None):
+    metadata = new_metadata(mode, conversation=conversation)
+    metadata["path"] = 'cache'
+    return finish_metadata(metadata)
+
+
+def conversation_for(data, session):
+    """
+    The session's conversation thread named by the request's thread_id (created if new), or None.
+    """
+    thread_id = data.get('thread_id')
+    if conversations is None or not isinstance(thread_id, str) or not REQUEST_ID_PATTERN.match(thread_id):
+        return None
+    return conversations.get(thread_id, owner=session)
+
+
+def lookup_thread_answer(question, visualize_flag, conversation):
+    """
+    lookup_cached_answer for a question that may continue a thread: only a thread's first
+    question is answered without context, so only that one can be cached ('bypass' otherwise).
+    A cached answer is recorded as the thread's first turn.
+    """
+    if conversation is not None and not conversation.is_empty():
+        return 'bypass', None
+    cache_status, cached = lookup_cached_answer(question, visualize_flag)
+    if cache_status == 'hit' and conversation is not None:
+        conversation.record_turn(question, cached['final_answer'])
+    return cache_status, cached
+
+
+def ndjson(data):
+    return json.dumps(data, default=str) + "\n"
+
+
+def batch_items(data):
+    """
+    The items and concurrency of a /ask/batch body (see batch_answers.parse_batch).
+    """
+    items, concurrency = parse_batch(data, BATCH_MAX_QUESTIONS, BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    for item in items:
+        item["mode"] = answer_mode(item)
+    return items, concurrency
@@ -0,0 +1,207 @@
+"""
+Batch answering: many questions in one request, a bounded number at a time.
+
+Reporting jobs ask the same breakdown for dozens of assets at once. POST
+/ask/batch takes the list and streams one NDJSON line per question as each
+is answered (in completion order, with the question's index), then a
+'batch' summary line. Each question goes through the same path as /ask:
+answer cache, single-flight, agent or direct pipeline.
+
+What the batch shares:
+  - the runtime, as every request does: the compiled graphs, the schema
+    snapshot, the SQL connection pool and the SQL and answer caches
+  - a BatchContext made once per batch: the schema for every question,
+    pruned or not (all questions see the same snapshot, even across a
+    refresh), and the few-shot examples of every question, found with one
+    example bank search for the whole batch
+
+At most `concurrency` questions run at a time (a thread pool under Flask,
+tasks behind a semaphore under Quart), so a large batch neither opens more
+SQL connections than the pool has nor floods the LLM with requests. The
+batch has its own request id: cancelling it (or disconnecting) cancels every
+question still running and skips the ones not started.
+"""
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from instrumentation import copy_context_call, record_batch_question
+
+_current_batch = contextvars.ContextVar("maximo_batch_context", default=None)
+
+
+class BatchError(ValueError):
+    """
+    The batch request is malformed; reported to the client as a 400.
+    """
+
+
+def current_batch():
+    return _current_batch.get()
+
+
+class BatchContext:
+    """
+    Prompt inputs computed once for all the questions of a batch.
+    """
+
+    def __init__(self, runtime, questions):
+        questions = list(dict.fromkeys(questions))
+        self.schemas = {question: runtime.schema_for(question) for question in questions}
+        self.examples = {}
+        if runtime.example_bank is not None:
+            self.examples = runtime.example_bank.render_many(questions)
+        self._schema_for = runtime.schema_for
+        self._describe_tables = runtime.describe_tables
+        self._table_info = None
+        self._lock = threading.Lock()
+
+    def schema_for(self, question):
+        """
+        The runtime's schema_for(question), as it was when the batch started.
+        """
+        if question in self.schemas:
+            return self.schemas[question]
+        return self._schema_for(question)
+
+    def table_info(self):
+        # Without a snapshot the direct pipeline's schema description is a database round trip
+        with self._lock:
+            if self._table_info is None:
+                self._table_info = self._describe_tables()
+            return self._table_info
+
+    @contextlib.contextmanager
+    def use(self):
+        """
+        Make this the batch of the calling context, for the runtime's prompt callables.
+        """
+        context_token = _current_batch.set(self)
+        try:
+            yield self
+        finally:
+            _current_batch.reset(context_token)
+
+
+def parse_batch(data, max_questions, default_concurrency, max_concurrency):
+    """
+    The items of a /ask/batch body and the concurrency to run them with.
+
+    Body: {"questions": [...], "visualize": false, "mode": null, "concurrency": null}; each
+    question is a string or {"question": ..., "id": ..., "visualize": ..., "mode": ...}, the
+    per-question values overriding the batch's.
+    """
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions:
+        raise BatchError("'questions' must be a non-empty list")
+    if len(questions) > max_questions:
+        raise BatchError(f"at most {max_questions} questions per batch")
+    items = []
+    for index, entry in enumerate(questions):
+        if isinstance(entry, str):
+            entry = {"question": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get('question'), str) or not entry['question'].strip():
+            raise BatchError(f"question {index} has no question text")
+        items.append({
+            "index": index,
+            "id": entry.get('id'),
+            "question": entry['question'],
+            "visualize": entry.get('visualize', data.get('visualize', False)),
+            "mode": entry.get('mode') or data.get('mode'),
+        })
+    concurrency = data.get('concurrency') or default_concurrency
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise BatchError("'concurrency' must be a positive integer")
+    return items, min(concurrency, max_concurrency, len(items))
+
+
+def _outcome(payload):
+    if payload.get("cancelled"):
+        return 'cancelled'
+    if "error" in payload:
+        return 'error'
+    return 'cached' if payload.get("cache") == 'hit' else 'answered'
+
+
+def result_line(item, payload):
+    """
+    The NDJSON object for one finished item, with its outcome recorded.
+    """
+    record_batch_question(_outcome(payload))
+    return {"index": item["index"], "id": item["id"], "question": item["question"], **payload}
+
+
+def summary_line(request_id, lines, concurrency, started):
+    """
+    The closing NDJSON object of a batch.
+    """
+    outcomes = [_outcome(line) for line in lines]
+    return {"batch": {"request_id": request_id, "questions": len(lines), "concurrency": concurrency,
+                      **{outcome: outcomes.count(outcome) for outcome in ('answered', 'cached', 'error', 'cancelled')},
+                      "elapsed_seconds": round(time.perf_counter() - started, 3)}}
+
+
+def _skipped(batch_token):
+    return {"cancelled": True, "reason": batch_token.reason, "metadata": None}
+
+
+def run_batch(items, answer, concurrency, batch_token):
+    """
+    Yield the result line of every item as it completes, running answer(item) -> payload on
+    at most concurrency threads. Items not started when batch_token is cancelled are skipped;
+    closing the generator cancels the batch.
+    """
+    def run(item):
+        if batch_token.cancelled:
+            return result_line(item, _skipped(batch_token))
+        try:
+            return result_line(item, answer(item))
+        except Exception as e:
+            return result_line(item, {"error": str(e)})
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ask-batch")
+    try:
+        # Each question runs in a copy of the request's context (batch context, request trace)
+        pending = {executor.submit(copy_context_call(run, item)) for item in items}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    except GeneratorExit:
+        batch_token.cancel("client disconnected")
+        raise
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def arun_batch(items, answer, concurrency, batch_token):
+    """
+    Async counterpart of run_batch(): answer(item) is a coroutine function, at most
+    concurrency of them run at a time.
+    """
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with slots:
+            if batch_token.cancelled:
+                return result_line(item, _skipped(batch_token))
+            try:
+                return result_line(item, await answer(item))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                return result_line(item, {"error": str(e)})
+
+    tasks = [asyncio.ensure_future(run(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    except (GeneratorExit, asyncio.CancelledError):
+        batch_token.cancel("client disconnected")
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,128 @@
+"""
+Batch benchmark: a reporting job's questions through /ask one at a time vs /ask/batch.
+
+The job: the same work-type breakdown for each of --questions assets. Uses the
+replay benchmark's app (agent graph, query executor, SQLite fixture through
+the T-SQL shim, ReplayChatModel with --llm-latency-ms per call), with the
+answer cache off so every question runs:
+
+  - sequential: one POST /ask per question, each waiting for the previous
+  - batch:      one POST /ask/batch per --concurrency value, read as NDJSON
+
+and reports the wall time, questions per second, the speedup over sequential,
+the errors, and whether the batch answers match the sequential ones. With
+--async-app the batch is also sent to the Quart app (Sql_Question_App_Async).
+
+    python benchmarks/batch_benchmark.py --questions 40 --llm-latency-ms 300
+    python benchmarks/batch_benchmark.py --concurrency 1 4 8 --async-app
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from replay_benchmark import NAMED_ASSETS, setup_app  # noqa: E402
+
+QUESTION = "for Asset Number: {asset}, please provide a breakdown of the number of work orders by work type"
+SQL = ("SELECT workype_description, COUNT(*) AS WorkOrderCount FROM src.vw_Maximo_WorkOrders "
+       "WHERE asset_id = '{asset}' GROUP BY workype_description ORDER BY WorkOrderCount DESC, workype_description")
+
+
+def reporting_job(count):
+    """
+    {question: sql} for the breakdown of count assets (the fixture's named assets, then generated ones).
+    """
+    assets = [number for number, _description in NAMED_ASSETS] + [str(30000 + i) for i in range(290)]
+    return {QUESTION.format(asset=asset): SQL.format(asset=asset) for asset in assets[:count]}
+
+
+def sequential(app, questions):
+    client = app.test_client()
+    answers = {}
+    started = time.perf_counter()
+    for question in questions:
+        body = client.post("/ask", json={"question": question}).get_json()
+        answers[question] = body.get("final_answer", body.get("error"))
+    return answers, time.perf_counter() - started
+
+
+def parse_lines(text):
+    lines = [json.loads(line) for line in text.splitlines() if line.strip()]
+    results = [line for line in lines if "index" in line]
+    summary = next(line["batch"] for line in lines if "batch" in line)
+    return {line["question"]: line.get("final_answer", line.get("error")) for line in results}, summary
+
+
+def batch(app, questions, concurrency):
+    client = app.test_client()
+    started = time.perf_counter()
+    response = client.post("/ask/batch", json={"questions": questions, "concurrency": concurrency})
+    answers, summary = parse_lines(response.get_data(as_text=True))
+    return answers, summary, time.perf_counter() - started
+
+
+def async_batches(questions, concurrencies):
+    """
+    batch() against the Quart app for each concurrency, in one event loop: the app makes the
+    SQL executor the loop's default executor, which closing a loop would shut down.
+    """
+    import Sql_Question_App_Async
+
+    async def run():
+        results = []
+        async with Sql_Question_App_Async.app.test_app() as test_app:
+            client = test_app.test_client()
+            for concurrency in concurrencies:
+                started = time.perf_counter()
+                response = await client.post("/ask/batch", json={"questions": questions, "concurrency": concurrency})
+                answers, summary = parse_lines(await response.get_data(as_text=True))
+                results.append((answers, summary, time.perf_counter() - started))
+        return results
+
+    return asyncio.run(run())
+
+
+def report(label, count, seconds, baseline_seconds, errors, same):
+    print(f"{label:<26} {seconds * 1000:8.0f} ms  {count / seconds:7.2f} q/s  "
+          f"{baseline_seconds / seconds:5.1f}x  errors {errors}  "
+          f"same answers: {'-' if same is None else 'yes' if same else 'NO'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=40, help="assets in the reporting job")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="batch concurrency values")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="simulated time per LLM call")
+    parser.add_argument("--work-orders", type=int, default=20000, help="rows in the fixture work order view")
+    parser.add_argument("--fixture", help="SQLite fixture to use instead of a generated one")
+    parser.add_argument("--async-app", action="store_true", help="also send the batches to the Quart app")
+    args = parser.parse_args()
+    args.sql_cache = False
+    args.clients = max(args.concurrency)
+    os.environ["BATCH_MAX_CONCURRENCY"] = str(args.clients)
+    os.environ["BATCH_MAX_QUESTIONS"] = str(max(args.questions, 100))
+
+    script = reporting_job(args.questions)
+    questions = list(script)
+    with tempfile.TemporaryDirectory() as directory:
+        app = setup_app(directory, script, args)
+        expected, baseline = sequential(app, questions)
+        report("sequential /ask", len(questions), baseline, baseline, 0, None)
+        runs = [("/ask/batch", [batch(app, questions, concurrency) for concurrency in args.concurrency])]
+        if args.async_app:
+            runs.append(("/ask/batch (async)", async_batches(questions, args.concurrency)))
+        for label, results in runs:
+            for concurrency, (answers, summary, seconds) in zip(args.concurrency, results):
+                report(f"{label} x{concurrency}", len(questions), seconds, baseline, summary["error"],
+                       answers == expected)
+
+
+if __name__ == "__main__":
+    main()
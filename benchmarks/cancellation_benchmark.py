@@ -0,0 +1,250 @@
+"""
+Cancellation benchmark: how quickly an abandoned question releases its LLM and SQL work.
+
+Runs the replay benchmark's app (Flask routes, agent graph, query executor,
+SQLite fixture through the T-SQL shim) with two deliberately slow questions:
+  - slow SQL: the model asks for a self-join of the work order view that runs
+    for tens of seconds on the fixture
+  - slow LLM: the final answer streams at --token-ms per token
+
+and abandons each one --cancel-after-ms after the slow part started:
+  - sql-cancel:       POST /ask/<request_id>/cancel while /ask waits on the query
+  - sql-disconnect:   a client of /ask/stream (served by werkzeug on a local
+                      port) closes its socket after the 'tool_call' event
+  - sql-async-cancel: the task consuming astream_answer is cancelled (what
+                      Quart does when the client disconnects)
+  - llm-cancel:       POST /ask/<request_id>/cancel while the answer streams
+
+For each it reports the time from the cancel to the request returning and to
+the last Maximo connection being back in the pool (the statement aborted),
+and for llm-cancel how many tokens were still generated after the cancel.
+--baseline also times the slow query left to run to completion.
+
+    python benchmarks/cancellation_benchmark.py --cancel-after-ms 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from langchain_core.messages import AIMessageChunk  # noqa: E402
+from langchain_core.outputs import ChatGenerationChunk  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from replay_benchmark import ReplayChatModel, setup_app  # noqa: E402
+
+SLOW_SQL_QUESTION = "How many pairs of corrective work orders were reported after another closed?"
+SLOW_SQL = ("SELECT COUNT(*) AS pairs FROM src.vw_Maximo_WorkOrders a CROSS JOIN src.vw_Maximo_WorkOrders b "
+            "WHERE a.statusdate < b.reportdate AND a.workype_description = 'Corrective Maintenance'")
+SLOW_LLM_QUESTION = "How many work orders are there?"
+SLOW_LLM_SQL = "SELECT COUNT(*) AS work_orders FROM src.vw_Maximo_WorkOrders"
+
+# Tokens produced by the model, shared by the copies bind_tools makes
+STREAMED = {"tokens": 0}
+
+
+class StreamingReplayChatModel(ReplayChatModel):
+    """
+    ReplayChatModel that streams its answers word by word, token_seconds apart.
+    """
+
+    streaming: bool = False
+    token_seconds: float = 0.0
+    answer_words: int = 200
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._generate(messages).generations[0].message
+        if message.tool_calls:
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": 0}
+                for call in message.tool_calls]))
+            return
+        for word in (message.content.split() * self.answer_words)[:self.answer_words]:
+            time.sleep(self.token_seconds)
+            STREAMED["tokens"] += 1
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+def wait_for_release(engine, timeout_seconds=60):
+    """
+    Seconds until no Maximo connection is checked out, or None after timeout_seconds.
+    """
+    started = time.perf_counter()
+    while engine.pool.checkedout() > 0:
+        if time.perf_counter() - started > timeout_seconds:
+            return None
+        time.sleep(0.002)
+    return time.perf_counter() - started
+
+
+def wait_for_checkout(engine, timeout_seconds=30):
+    started = time.perf_counter()
+    while engine.pool.checkedout() == 0:
+        if time.perf_counter() - started > timeout_seconds:
+            raise RuntimeError("the slow query never started")
+        time.sleep(0.002)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def cancel_while_asking(app, engine, question, cancel_after_seconds, wait_for_sql):
+    """
+    /ask in a thread, cancelled through the endpoint; returns (status, ms to response, ms to release, body).
+    """
+    client = app.test_client()
+    # Request ids are scoped to the session: take the session cookie before asking
+    client.get("/ready")
+    request_id = uuid.uuid4().hex
+    outcome = {}
+
+    def ask():
+        response = client.post("/ask", json={"question": question, "request_id": request_id})
+        outcome["returned"] = time.perf_counter()
+        outcome["status"] = response.status_code
+        outcome["body"] = response.get_json()
+
+    thread = threading.Thread(target=ask)
+    thread.start()
+    if wait_for_sql:
+        wait_for_checkout(engine)
+    time.sleep(cancel_after_seconds)
+    cancelled = time.perf_counter()
+    client.post(f"/ask/{request_id}/cancel")
+    release = wait_for_release(engine)
+    thread.join()
+    return outcome["status"], _ms(outcome["returned"] - cancelled), _ms(release), outcome["body"]
+
+
+def sql_cancel(app, engine, args):
+    status, response_ms, release_ms, body = cancel_while_asking(
+        app, engine, SLOW_SQL_QUESTION, args.cancel_after_ms / 1000, wait_for_sql=True)
+    return {"status": status, "response_ms": response_ms, "release_ms": release_ms,
+            "cancelled": body.get("cancelled"), "llm_calls": body["metadata"]["llm_calls"]}
+
+
+def sql_disconnect(app, engine, args):
+    # A real server and socket: the test client has no connection to close
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        body = json.dumps({"question": SLOW_SQL_QUESTION}).encode()
+        client = socket.create_connection(("127.0.0.1", server.server_port))
+        client.sendall(b"POST /ask/stream HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                       + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        received = b""
+        while b"event: tool_call" not in received:
+            chunk = client.recv(65536)
+            if not chunk:
+                raise RuntimeError("stream ended before the tool call")
+            received += chunk
+        wait_for_checkout(engine)
+        time.sleep(args.cancel_after_ms / 1000)
+        client.close()
+        return {"events_read": received.count(b"event: "), "release_ms": _ms(wait_for_release(engine))}
+    finally:
+        server.shutdown()
+
+
+def sql_async_cancel(app, engine, args):
+    import agent_runtime
+    from answer_flow import astream_answer, new_metadata
+
+    async def run():
+        metadata = new_metadata("agent")
+
+        async def consume():
+            async for _item in astream_answer(agent_runtime.get_runtime(), SLOW_SQL_QUESTION, "agent", metadata):
+                pass
+
+        task = asyncio.create_task(consume())
+        await asyncio.to_thread(wait_for_checkout, engine)
+        await asyncio.sleep(args.cancel_after_ms / 1000)
+        cancelled = time.perf_counter()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return time.perf_counter() - cancelled
+
+    task_ms = _ms(asyncio.run(run()))
+    return {"task_ms": task_ms, "release_ms": _ms(wait_for_release(engine))}
+
+
+def llm_cancel(app, engine, args):
+    started_tokens = STREAMED["tokens"]
+    status, response_ms, _release_ms, body = cancel_while_asking(
+        app, engine, SLOW_LLM_QUESTION, args.cancel_after_ms / 1000, wait_for_sql=False)
+    streamed = STREAMED["tokens"] - started_tokens
+    time.sleep(args.token_ms / 1000 * 5)
+    after = STREAMED["tokens"] - started_tokens
+    return {"status": status, "response_ms": response_ms, "tokens_streamed": streamed,
+            "tokens_after_response": after - streamed, "tokens_if_not_cancelled": args.answer_words,
+            "cancelled": body.get("cancelled")}
+
+
+def baseline(app, engine, args):
+    client = app.test_client()
+    started = time.perf_counter()
+    response = client.post("/ask", json={"question": SLOW_SQL_QUESTION})
+    return {"status": response.status_code, "response_ms": _ms(time.perf_counter() - started)}
+
+
+SCENARIOS = {
+    "sql-cancel": sql_cancel,
+    "sql-disconnect": sql_disconnect,
+    "sql-async-cancel": sql_async_cancel,
+    "llm-cancel": llm_cancel,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cancel-after-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=20.0, help="simulated time per streamed answer token")
+    parser.add_argument("--answer-words", type=int, default=300, help="tokens in the slow streamed answer")
+    parser.add_argument("--work-orders", type=int, default=20000, help="rows in the fixture work order view")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="run only these scenarios (repeatable)")
+    parser.add_argument("--baseline", action="store_true", help="also time the slow query without cancelling")
+    args = parser.parse_args()
+    args.fixture = None
+    args.sql_cache = False
+    args.clients = 4
+    args.llm_latency_ms = 0.0
+
+    # The guard would reject the slow self-join before it ran; the statement timeout must outlast it
+    os.environ["SQL_GUARD"] = "off"
+    os.environ["SQL_QUERY_TIMEOUT_SECONDS"] = "600"
+
+    with tempfile.TemporaryDirectory() as directory:
+        llm = StreamingReplayChatModel(
+            script={SLOW_SQL_QUESTION: SLOW_SQL, SLOW_LLM_QUESTION: SLOW_LLM_SQL}, streaming=True,
+            token_seconds=args.token_ms / 1000, answer_words=args.answer_words)
+        app = setup_app(directory, llm.script, args, llm=llm)
+        import agent_runtime
+
+        engine = agent_runtime.get_runtime().db._engine
+        for name in args.scenario or SCENARIOS:
+            result = SCENARIOS[name](app, engine, args)
+            print(f"{name:<18} " + ", ".join(f"{key} {value}" for key, value in result.items()))
+        if args.baseline:
+            print(f"{'not cancelled':<18} " + ", ".join(
+                f"{key} {value}" for key, value in baseline(app, engine, args).items()))
+        print(f"checked-out connections at exit: {engine.pool.checkedout()}")
+
+
+if __name__ == "__main__":
+    main()
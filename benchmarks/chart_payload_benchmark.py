@@ -0,0 +1,133 @@
+"""
+Chart payload benchmark: a synthetic daily series of --points points.
+
+Compares the visualization payload before and after server-side downsampling:
+  - before:  every point, as app.run(debug=True) served it (pretty-printed JSON),
+             and the same as compact JSON
+  - after:   LTTB-downsampled to CHART_MAX_POINTS, compact JSON, then gzip
+             (and brotli when the 'brotli' package is installed)
+For each it reports the payload size, the server-side build + encode time and,
+when node is on PATH, the client-side cost of JSON.parse plus building the
+arrays renderChart hands to Chart.js (Chart.js drawing itself needs a browser;
+its cost grows with the number of points in the same way).
+
+    python benchmarks/chart_payload_benchmark.py --points 50000
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import chart_inference  # noqa: E402
+from compression import brotli, compress  # noqa: E402
+
+NODE_SCRIPT = """
+const fs = require('fs');
+const text = fs.readFileSync(process.argv[2], 'utf8');
+const runs = 5;
+let best = Infinity;
+for (let i = 0; i < runs; i++) {
+    const started = process.hrtime.bigint();
+    const data = JSON.parse(text);
+    const datasets = data.datasets || [{label: data.label || 'Work Orders', data: data.values}];
+    const chartData = {labels: data.labels, datasets: datasets.map(d => ({label: d.label, data: d.data.slice()}))};
+    const elapsed = Number(process.hrtime.bigint() - started) / 1e6;
+    if (chartData.labels.length && elapsed < best) best = elapsed;
+}
+console.log(best.toFixed(2));
+"""
+
+
+def synthetic_series(points, seed=7):
+    """
+    Daily work order counts: trend + weekly and yearly seasonality + noise + a few outages and spikes.
+    """
+    rng = np.random.default_rng(seed)
+    days = np.arange(points)
+    counts = (
+        200 + days * 0.002
+        + 40 * np.sin(2 * np.pi * days / 365.25)
+        + 25 * (days % 7 < 5)
+        + rng.normal(0, 12, points)
+    )
+    counts[rng.choice(points, 20, replace=False)] *= 3
+    counts[rng.choice(points, 20, replace=False)] = 0
+    start = datetime.date(1900, 1, 1)
+    dates = [start + datetime.timedelta(days=int(day)) for day in days]
+    return {
+        "columns": ["statusdate", "work_order_count"],
+        "types": ["date", "integer"],
+        "data": [dates, np.maximum(counts, 0).round().astype(int).tolist()],
+    }
+
+
+def client_decode_ms(payload):
+    node = shutil.which("node")
+    if node is None:
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        script = os.path.join(directory, "decode.js")
+        data = os.path.join(directory, "payload.json")
+        with open(script, "w") as script_file:
+            script_file.write(NODE_SCRIPT)
+        with open(data, "wb") as data_file:
+            data_file.write(payload)
+        output = subprocess.run([node, script, data], capture_output=True, text=True, check=True).stdout
+    return float(output.strip())
+
+
+def build(result, max_points, indent=None):
+    chart_inference.MAX_POINTS = max_points
+    started = time.perf_counter()
+    chart = chart_inference.infer_chart(result)
+    payload = json.dumps(chart, indent=indent, separators=None if indent else (",", ":")).encode("utf-8")
+    return chart, payload, time.perf_counter() - started
+
+
+def report(name, chart, payload, seconds):
+    client = client_decode_ms(payload)
+    client_text = f"{client:8.2f} ms" if client is not None else "     n/a"
+    print(f"  {name:<28} points {len(chart['labels']):>7,}  {len(payload) / 1024:9.1f} KiB  "
+          f"server {seconds * 1000:7.1f} ms  client decode {client_text}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=50000)
+    parser.add_argument("--max-points", type=int, default=chart_inference.MAX_POINTS)
+    args = parser.parse_args()
+
+    result = synthetic_series(args.points)
+    print(f"synthetic daily series: {args.points:,} points")
+
+    report("before (debug JSON)", *build(result, args.points + 1, indent=2))
+    report("before (compact JSON)", *build(result, args.points + 1))
+    chart, payload, seconds = build(result, args.max_points)
+    report("after (LTTB, compact JSON)", chart, payload, seconds)
+
+    for encoding in ["gzip"] + (["br"] if brotli is not None else []):
+        started = time.perf_counter()
+        encoded = compress(payload, encoding)
+        elapsed = time.perf_counter() - started
+        print(f"  after + {encoding:<20} {len(encoded) / 1024:31.1f} KiB  encode {elapsed * 1000:5.1f} ms")
+    if brotli is None:
+        print("  (install 'brotli' to include br)")
+
+    # The same series without downsampling, gzip-compressed, for scale
+    _chart, full, _seconds = build(result, args.points + 1)
+    print(f"  before + gzip (no LTTB)      {len(gzip.compress(full, compresslevel=6)) / 1024:31.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
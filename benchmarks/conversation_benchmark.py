@@ -0,0 +1,189 @@
+"""
+Conversation benchmark: follow-up questions in a thread vs. asked from scratch.
+
+A four-turn session (a breakdown, then "just Corrective Maintenance by month",
+"chart it", "which 3 months had the most?") against the replay benchmark's app
+(agent graph, query executor, SQLite fixture through the T-SQL shim), with a
+scripted model standing in for the LLM (--llm-latency-ms per call). The model
+answers a follow-up with previous_results_query over the earlier result when
+the system message lists one, and with a new sql_db_query otherwise, as the
+real model is prompted to. The session runs:
+
+  - stateless: no thread_id, every follow-up goes back to the database
+  - thread:    one thread_id, follow-ups re-slice the kept result sets
+
+and reports each turn's time, LLM calls, database round trips (sql_db_query
+calls) and whether both runs answered the same. The SQL result cache is off,
+so repeated statements reach the database.
+
+Then it fills a small ConversationStore with --threads threads holding a
+--result-rows row result set each and reports what the limits kept.
+
+    python benchmarks/conversation_benchmark.py --work-orders 200000
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+import uuid
+from types import SimpleNamespace
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from langchain_core.language_models.chat_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+
+from replay_benchmark import setup_app  # noqa: E402
+
+WORK_ORDERS = "src.vw_Maximo_WorkOrders"
+
+# (question, statement without a thread, statement over the thread's results or None)
+SESSION = [
+    ("How many work orders were there per work type and month in 2024?",
+     f"SELECT workype_description, MONTH(statusdate) AS month, COUNT(*) AS WorkOrderCount FROM {WORK_ORDERS} "
+     "WHERE YEAR(statusdate) = 2024 GROUP BY workype_description, MONTH(statusdate) "
+     "ORDER BY workype_description, month",
+     None),
+    ("Now just Corrective Maintenance, by month",
+     f"SELECT MONTH(statusdate) AS month, COUNT(*) AS WorkOrderCount FROM {WORK_ORDERS} "
+     "WHERE YEAR(statusdate) = 2024 AND workype_description = 'Corrective Maintenance' "
+     "GROUP BY MONTH(statusdate) ORDER BY month",
+     "SELECT month, WorkOrderCount FROM result_1 WHERE workype_description = 'Corrective Maintenance' "
+     "ORDER BY month"),
+    ("Chart it",
+     f"SELECT MONTH(statusdate) AS month, COUNT(*) AS WorkOrderCount FROM {WORK_ORDERS} "
+     "WHERE YEAR(statusdate) = 2024 AND workype_description = 'Corrective Maintenance' "
+     "GROUP BY MONTH(statusdate) ORDER BY month",
+     "SELECT month, WorkOrderCount FROM result_2 ORDER BY month"),
+    ("Which 3 months had the most?",
+     f"SELECT TOP 3 MONTH(statusdate) AS month, COUNT(*) AS WorkOrderCount FROM {WORK_ORDERS} "
+     "WHERE YEAR(statusdate) = 2024 AND workype_description = 'Corrective Maintenance' "
+     "GROUP BY MONTH(statusdate) ORDER BY WorkOrderCount DESC, month",
+     "SELECT month, WorkOrderCount FROM result_2 ORDER BY WorkOrderCount DESC, month LIMIT 3"),
+]
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Answers each question of SESSION with one tool call, then states the tool's result.
+    """
+
+    latency_seconds: float = 0.0
+
+    @property
+    def _llm_type(self):
+        return "scripted"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        last = messages[-1]
+        if last.type == "tool":
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=f"Result: {last.content}"))])
+        question, sql, thread_sql = next(turn for turn in SESSION if turn[0] == last.content)
+        offered = "previous_results_query (SQLite)" in messages[0].content
+        name, query = ("previous_results_query", thread_sql) if offered and thread_sql else ("sql_db_query", sql)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="", tool_calls=[
+            {"name": name, "args": {"query": query}, "id": f"call_{uuid.uuid4().hex[:12]}"}]))])
+
+
+def run_session(client, thread_id):
+    turns = []
+    for question, _sql, _thread_sql in SESSION:
+        body = {"question": question, "visualize": True, "trace": True}
+        if thread_id:
+            body["thread_id"] = thread_id
+        started = time.perf_counter()
+        response = client.post("/ask", json=body).get_json()
+        seconds = time.perf_counter() - started
+        tool_calls = response["metadata"]["timings"]["tool_calls"]
+        turns.append({
+            "seconds": seconds,
+            "llm_calls": response["metadata"]["llm_calls"],
+            "db": sum(1 for call in tool_calls if call["tool"] == "sql_db_query"),
+            # Results over 50 rows name their spill file, which differs per run
+            "answer": re.sub(r"/results/[0-9a-f]{32}", "/results/<spill>", response["final_answer"]),
+            "chart": response.get("visualizationData") is not None,
+        })
+    return turns
+
+
+def limits(args):
+    from conversations import ConversationStore
+
+    store = ConversationStore(max_threads=args.max_threads, max_total_bytes=args.max_total_mb * 1024 * 1024,
+                              max_thread_bytes=args.max_thread_mb * 1024 * 1024)
+    artifact = {"columns": ["wonum", "statusdate", "WorkOrderCount"], "types": ["string", "string", "integer"],
+                "data": [[f"WO{i}" for i in range(args.result_rows)],
+                         [f"2024-01-{i % 28 + 1:02d}" for i in range(args.result_rows)],
+                         list(range(args.result_rows))],
+                "row_count": args.result_rows, "complete": True}
+
+    message = SimpleNamespace(type="tool", name="sql_db_query", tool_call_id="call", artifact=artifact)
+    started = time.perf_counter()
+    for number in range(args.threads):
+        conversation = store.get(f"thread-{number:06d}")
+        for turn in range(3):
+            conversation.record_turn(f"question {turn}", "answer " * 50, [message])
+    seconds = time.perf_counter() - started
+    stats = store.stats()
+    print(f"\n{args.threads} threads x 3 turns, {args.result_rows:,}-row results, limits: {args.max_threads} threads, "
+          f"{args.max_total_mb} MiB total, {args.max_thread_mb} MiB per thread")
+    print(f"  kept {stats['threads']} threads, {stats['result_sets']} result sets, "
+          f"{stats['bytes'] / 1024 / 1024:.1f} MiB; {stats['evictions']} threads evicted; "
+          f"{seconds / (args.threads * 3) * 1000:.2f} ms per recorded turn")
+    conversation = store.get(f"thread-{args.threads - 1:06d}")
+    started = time.perf_counter()
+    columns, rows, _stop_reason = conversation.query(
+        "SELECT statusdate, SUM(WorkOrderCount) FROM result_3 GROUP BY statusdate")
+    print(f"  previous_results_query over {args.result_rows:,} rows: {(time.perf_counter() - started) * 1000:.1f} ms "
+          f"({len(rows)} rows)")
+    return stats["bytes"] <= store.max_total_bytes and stats["threads"] <= store.max_threads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="simulated time per LLM call")
+    parser.add_argument("--work-orders", type=int, default=200000, help="rows in the fixture work order view")
+    parser.add_argument("--fixture", help="SQLite fixture to use instead of a generated one")
+    parser.add_argument("--threads", type=int, default=300, help="threads created for the limits check")
+    parser.add_argument("--result-rows", type=int, default=5000, help="rows of each result set in the limits check")
+    parser.add_argument("--max-threads", type=int, default=200)
+    parser.add_argument("--max-total-mb", type=int, default=64)
+    parser.add_argument("--max-thread-mb", type=int, default=2)
+    args = parser.parse_args()
+    args.sql_cache = False
+    args.clients = 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = setup_app(directory, {}, args, llm=ScriptedChatModel(latency_seconds=args.llm_latency_ms / 1000))
+        client = app.test_client()
+        stateless = run_session(client, None)
+        threaded = run_session(client, uuid.uuid4().hex)
+
+    print(f"{'turn':<66} {'stateless':>20} {'thread':>20}  same answer")
+    for (question, _sql, _thread_sql), before, after in zip(SESSION, stateless, threaded):
+        print(f"{question:<66} {before['seconds'] * 1000:7.0f} ms {before['db']} db  "
+              f"{after['seconds'] * 1000:7.0f} ms {after['db']} db  "
+              f"{'yes' if before['answer'] == after['answer'] else 'NO'}")
+    for label, turns in (("stateless", stateless), ("thread", threaded)):
+        print(f"{label:<10} total {sum(turn['seconds'] for turn in turns) * 1000:7.0f} ms, "
+              f"LLM calls {sum(turn['llm_calls'] for turn in turns)}, "
+              f"database round trips {sum(turn['db'] for turn in turns)}, "
+              f"charts {sum(turn['chart'] for turn in turns)}")
+    within = limits(args)
+    same = all(before['answer'] == after['answer'] for before, after in zip(stateless, threaded))
+    if not (same and within):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Concurrency vs. latency load test for the /ask endpoint.
+
+Fires the same question at a running server with increasing numbers of
+concurrent clients and reports throughput and p50/p99 latency per level.
+Run it once against the Flask app and once against the ASGI app to compare:
+
+    python Sql_Question_App.py                                   # Flask, port 5000
+    hypercorn Sql_Question_App_Async:app --bind 127.0.0.1:8000   # ASGI, port 8000
+
+    python benchmarks/load_test.py --url http://127.0.0.1:5000/ask --label flask
+    python benchmarks/load_test.py --url http://127.0.0.1:8000/ask --label asgi
+
+Set ANSWER_CACHE_ENABLED=false on the server, otherwise every request after the
+first is a cache hit and the test measures the cache rather than the agent path.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_level(url, question, concurrency, requests_per_client, timeout):
+    latencies = []
+    errors = 0
+
+    async def client(http):
+        nonlocal errors
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            try:
+                response = await http.post(url, json={"question": question, "visualize": False})
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+            except httpx.HTTPError:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50) if latencies else float("nan"),
+        "p99": percentile(latencies, 0.99) if latencies else float("nan"),
+        "mean": statistics.mean(latencies) if latencies else float("nan"),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:5000/ask")
+    parser.add_argument("--label", default="server")
+    parser.add_argument("--question", default="How many Maximo WorkOrders were created in January 2025?")
+    parser.add_argument("--concurrency", default="1,10,50,100,200",
+                        help="comma-separated list of concurrent client counts")
+    parser.add_argument("--requests-per-client", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    print(f"{'label':<8} {'clients':>7} {'ok':>6} {'errors':>6} {'req/s':>8} {'p50 s':>8} {'p99 s':>8}")
+    for concurrency in [int(level) for level in args.concurrency.split(",")]:
+        result = await run_level(args.url, args.question, concurrency, args.requests_per_client, args.timeout)
+        print(f"{args.label:<8} {result['concurrency']:>7} {result['requests']:>6} {result['errors']:>6} "
+              f"{result['throughput']:>8.2f} {result['p50']:>8.3f} {result['p99']:>8.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
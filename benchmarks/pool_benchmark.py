@@ -0,0 +1,112 @@
+"""
+Connection pool benchmark: first-query latency on a cold vs a warmed pool.
+
+For each of --runs fresh engines (db_pool.create_maximo_engine) it times a
+burst of --concurrency simultaneous first queries:
+  - cold:  the pool is empty, so every query also pays for the connect
+  - warm:  warm_pool() opened the connections first (as the app does at startup
+           and every DB_POOL_KEEPALIVE_SECONDS)
+and reports the median and worst latency plus the pool's own statistics.
+
+Against the local SQLite stand-in a connect takes well under a millisecond, so
+--connect-delay-ms adds a simulated TCP + TLS + login cost to each new
+connection (Azure SQL is typically 100-500 ms). Set DATABASE_URL to measure a
+real server instead (the delay is then not added).
+
+    python benchmarks/pool_benchmark.py --connect-delay-ms 250 --concurrency 4
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from sqlalchemy import event, text  # noqa: E402
+
+from db_pool import create_maximo_engine, pool_status, warm_pool  # noqa: E402
+
+QUERY = "SELECT COUNT(*) FROM src.vw_Maximo_WorkOrders WHERE workype_description = 'Corrective Maintenance'"
+
+
+def make_stand_in(directory, rows=20000):
+    path = os.path.join(directory, "maximo.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE vw_Maximo_WorkOrders (wonum TEXT PRIMARY KEY, statusdate TEXT, workype_description TEXT)")
+        conn.executemany(
+            "INSERT INTO vw_Maximo_WorkOrders VALUES (?, ?, ?)",
+            ((f"WO{i}", f"20{10 + i % 15}-{1 + i % 12:02d}-01",
+              "Corrective Maintenance" if i % 3 else "Proactive Maintenance") for i in range(rows)))
+    return f"sqlite:///{path}"
+
+
+def first_queries(engine, concurrency):
+    latencies = []
+    lock = threading.Lock()
+
+    def one():
+        started = time.perf_counter()
+        with engine.connect() as conn:
+            conn.execute(text(QUERY)).fetchall()
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=one) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def run(url, warm, concurrency, connect_delay):
+    engine = create_maximo_engine(url)
+    if connect_delay:
+        @event.listens_for(engine, "do_connect")
+        def slow_connect(dialect, conn_rec, cargs, cparams):
+            time.sleep(connect_delay)
+    if warm:
+        warm_pool(engine, concurrency)
+    latencies = first_queries(engine, concurrency)
+    status = pool_status(engine)
+    engine.dispose()
+    return latencies, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--connect-delay-ms", type=float, default=250.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = os.getenv("DATABASE_URL")
+        connect_delay = 0.0
+        if not url:
+            url = make_stand_in(directory)
+            connect_delay = args.connect_delay_ms / 1000
+        print(f"database: {url.split('@')[-1]}  concurrency: {args.concurrency}  runs: {args.runs}"
+              + (f"  simulated connect: {args.connect_delay_ms:.0f} ms" if connect_delay else ""))
+
+        for name, warm in (("cold pool", False), ("warm pool", True)):
+            latencies = []
+            status = None
+            for _ in range(args.runs):
+                run_latencies, status = run(url, warm, args.concurrency, connect_delay)
+                latencies.extend(run_latencies)
+            print(f"  {name}: first-query median {statistics.median(latencies) * 1000:8.1f} ms  "
+                  f"worst {max(latencies) * 1000:8.1f} ms  "
+                  f"(last run: {status['connects']} connects, "
+                  f"avg connect {(status['connect_seconds_avg'] or 0) * 1000:.1f} ms, "
+                  f"max checkout wait {status['checkout_wait_seconds_max'] * 1000:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Offline replay benchmark: the recorded questions from LangChainTutorial.py,
+replayed through the /ask code path with no network.
+
+  - questions:  benchmarks/replay_questions.json, each with the SQL the agent produced for it
+  - LLM:        ReplayChatModel, a deterministic chat model that answers each question with
+                its recorded sql_db_query call (or, in --mode direct, the recorded query as
+                structured output) and then a short answer built from the tool result
+  - database:   a generated SQLite fixture shaped like the three src.vw_Maximo_* views (or, with
+                --fixture, a larger one from benchmarks/synthetic_maximo.py), served through
+                db_pool like the real database; the recorded T-SQL runs on it via
+                benchmarks/sqlite_tsql.py
+
+Everything else is the app as deployed: the Flask /ask route, the agent graph, the
+validator, the query executor, chart inference and the instrumentation. The answer
+cache and single-flight coalescing are disabled; the SQL result cache is off unless
+--sql-cache is given.
+
+Reports, per question: latency, LLM calls, sql_db_query calls, SQL statements and
+peak traced memory (a second sequential pass under tracemalloc); then throughput and
+p50/p95 latency with --clients concurrent clients each replaying every question
+--rounds times. --output writes the results as JSON; --compare reads a previous
+--output and flags questions or throughput that regressed by more than --tolerance.
+
+    python benchmarks/replay_benchmark.py --clients 8 --rounds 3
+    python benchmarks/replay_benchmark.py --output before.json
+    python benchmarks/replay_benchmark.py --compare before.json
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import re
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARK_DIR = os.path.join(REPO_DIR, "benchmarks")
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+QUESTIONS_PATH = os.path.join(BENCHMARK_DIR, "replay_questions.json")
+
+from langchain_core.language_models.chat_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+from langchain_core.utils.function_calling import convert_to_openai_tool  # noqa: E402
+
+import sqlite_tsql  # noqa: E402
+
+WORK_TYPES = [
+    ("Corrective Maintenance", "CM", 50),
+    ("Proactive Maintenance", "PM", 30),
+    ("Scheduled Preventive Maintenance", "SPM", 10),
+    ("Customer Faults", "CF", 7),
+    ("Capital Project", "CP", 3),
+]
+STATUSES = ["Closed"] * 12 + ["Completed"] * 4 + [
+    "Active", "Approved", "Assigned", "Cancelled", "Field Complete", "In progress", "On Hold", "Scheduled",
+    "Waiting on approval", "Waiting on material"]
+LOCATIONS = [
+    ("04.07.30.02.01", "Hamilton Township", "Township"),
+    ("04.18.09.03.01", "Portland Township", "Township"),
+    ("04.07.31.02.02", "Hamilton - Digby Rd SPS Catchment", "Catchment"),
+    ("007.018.006.007.002", "Warrnambool WRP", "Treatment Plant"),
+    ("04.17.12.02.01", "Port Fairy Township", "Township"),
+    ("004.001", "Corporate - Warrnambool Depot", "Depot"),
+    ("004.002", "Corporate - Portland Depot", "Depot"),
+    ("004.004", "Konongwootong Reservoir", "Reservoir"),
+    ("004.007", "South Otway Reservoir", "Reservoir"),
+    ("004.009", "Camperdown Township", "Township"),
+]
+NAMED_ASSETS = [
+    ("23230", "Corporate - Warrnambool Depot"),
+    ("23257", "Warrnambool - Pertobe Rd SPS"),
+    ("23254", "Warrnambool - Morriss Rd SPS"),
+    ("23242", "Warrnambool - Dickson St SPS"),
+    ("107024", "Corporate - Portland Depot - Wyatt St (at Storage)"),
+    ("92142", "Konongwootong Reservoir - Raw Water Storage (Emergency)"),
+    ("22948", "South Otway - Plantation Rd Reservoir - Raw Water Storage"),
+    ("92592", "Grampians - Cruckoor Reservoir - Raw Water Storage"),
+    ("22767", "Camperdown - Park Lane Service Basin - Potable Water Storage"),
+    ("344570", "Casterton - Arundel Rd Basin Square - Storage - Floating Cover"),
+]
+
+
+def build_fixture(path, work_orders=20000, seed=7):
+    """
+    SQLite tables named and shaped like the three views, with skewed assets and
+    locations, 2021-2025 dates and ~30% NULL asset_id.
+    """
+    rng = random.Random(seed)
+    assets = NAMED_ASSETS + [(str(30000 + i), f"Asset {i} - {rng.choice(['Pipe', 'Pump', 'Valve', 'Meter'])} Main")
+                             for i in range(290)]
+    with sqlite3.connect(path) as conn:
+        conn.executescript(
+            "CREATE TABLE vw_Maximo_Locations (location_id INTEGER, location_code TEXT, "
+            "location_description TEXT, locationclassification_desc TEXT);"
+            "CREATE TABLE vw_Maximo_Asset (assetnum TEXT, asset_description TEXT, location_code TEXT, "
+            "location_description TEXT);"
+            "CREATE TABLE vw_Maximo_WorkOrders (wonum TEXT, description TEXT, statusdate TEXT, reportdate TEXT, "
+            "workype_description TEXT, worktype_id TEXT, status_description TEXT, location_id TEXT, "
+            "location_description TEXT, asset_id TEXT);"
+        )
+        conn.executemany("INSERT INTO vw_Maximo_Locations VALUES (?, ?, ?, ?)",
+                         [(i + 1, *location) for i, location in enumerate(LOCATIONS)])
+        asset_locations = [rng.choice(LOCATIONS) for _ in assets]
+        conn.executemany("INSERT INTO vw_Maximo_Asset VALUES (?, ?, ?, ?)",
+                         [(num, desc, loc[0], loc[1]) for (num, desc), loc in zip(assets, asset_locations)])
+        asset_weights = [1 / (rank + 1) for rank in range(len(assets))]
+        location_weights = [1 / (rank + 1) for rank in range(len(LOCATIONS))]
+        start = datetime.date(2021, 1, 1)
+        span = (datetime.date(2025, 6, 30) - start).days
+        rows = []
+        for i in range(work_orders):
+            description, worktype_id, _weight = rng.choices(WORK_TYPES, [w[2] for w in WORK_TYPES])[0]
+            location = rng.choices(LOCATIONS, location_weights)[0]
+            asset = rng.choices(assets, asset_weights)[0][0] if rng.random() > 0.3 else None
+            reported = start + datetime.timedelta(days=rng.randrange(span))
+            status_date = reported + datetime.timedelta(days=rng.randrange(30))
+            rows.append((f"WO{100000 + i}", f"{description} work", f"{status_date} 08:00:00", f"{reported} 08:00:00",
+                         description, worktype_id, rng.choice(STATUSES), location[0], location[1], asset))
+        conn.executemany("INSERT INTO vw_Maximo_WorkOrders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    return path
+
+
+def _approximate_tokens(messages):
+    return sum(len(str(getattr(message, "content", message))) for message in messages) // 4
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    Chat model that replays the recorded SQL for each question.
+    """
+
+    script: dict
+    latency_seconds: float = 0.0
+    structured: bool = False
+
+    @property
+    def _llm_type(self):
+        return "replay"
+
+    def bind_tools(self, tools, **kwargs):
+        names = {convert_to_openai_tool(tool)["function"]["name"] for tool in tools}
+        return self.model_copy(update={"structured": "QueryOutput" in names})
+
+    def _question(self, messages):
+        for message in messages:
+            if message.type != "human":
+                continue
+            match = re.search(r"Question: (.*)", message.content)
+            return match.group(1).strip() if match else message.content
+        raise ValueError("no question in the conversation")
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        question = self._question(messages)
+        sql = self.script[question]
+        last = messages[-1]
+        if self.structured:
+            message = AIMessage(content="", tool_calls=[
+                {"name": "QueryOutput", "args": {"query": sql}, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+        elif last.type == "human" and "SQL Result:" not in last.content:
+            message = AIMessage(content="", tool_calls=[
+                {"name": "sql_db_query", "args": {"query": sql}, "id": f"call_{uuid.uuid4().hex[:12]}"}])
+        else:
+            result = last.content.split("SQL Result:")[-1].strip()
+            message = AIMessage(content=f"Here is what the work orders show:\n{result[:400]}")
+        prompt_tokens = _approximate_tokens(messages)
+        completion_tokens = _approximate_tokens([message]) + 10
+        message.usage_metadata = {"input_tokens": prompt_tokens, "output_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens}
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def setup_app(directory, script, args, llm=None):
+    """
+    Import the app configured for the replay and install a runtime built around the
+    stand-ins; llm replaces the default ReplayChatModel.
+    """
+    fixture = args.fixture or build_fixture(os.path.join(directory, "maximo.db"), args.work_orders)
+    os.environ.update({
+        "AGENT_INIT_MODE": "lazy",
+        "ANSWER_CACHE_ENABLED": "false",
+        "SINGLEFLIGHT_ENABLED": "false",
+        "SQL_CACHE_ENABLED": "true" if args.sql_cache else "false",
+        "SCHEMA_SNAPSHOT_PATH": os.path.join(directory, "schema_snapshot.json"),
+        "SQL_SPILL_DIR": os.path.join(directory, "query_results"),
+        "DB_POOL_KEEPALIVE_SECONDS": "0",
+        "DB_POOL_SIZE": str(max(5, args.clients)),
+    })
+
+    import agent_runtime
+    import Sql_Question_App
+    from db_pool import create_maximo_engine
+    from langchain_community.utilities import SQLDatabase
+
+    engine = sqlite_tsql.install(create_maximo_engine(f"sqlite:///{fixture}"))
+    db = SQLDatabase(engine, include_tables=agent_runtime.INCLUDE_TABLES, schema="src",
+                     lazy_table_reflection=True)
+    if llm is None:
+        llm = ReplayChatModel(script=script, latency_seconds=args.llm_latency_ms / 1000)
+    agent_runtime.set_runtime(agent_runtime.build_runtime(llm=llm, db=db))
+    return Sql_Question_App.app
+
+
+def ask(client, question, mode):
+    started = time.perf_counter()
+    response = client.post("/ask", json={"question": question, "visualize": True, "mode": mode, "trace": True})
+    latency = time.perf_counter() - started
+    body = response.get_json()
+    timings = body["metadata"]["timings"]
+    tool_errors = [call for call in timings["tool_calls"] if call.get("error")]
+    return {
+        "latency": latency,
+        "status": response.status_code,
+        "llm_calls": len(timings["llm_calls"]),
+        "sql_tool_calls": sum(1 for call in timings["tool_calls"] if call["tool"] == "sql_db_query"),
+        "sql_statements": len(timings["sql"]),
+        "path": body["metadata"]["path"],
+        "error": tool_errors[0]["error"] if tool_errors else None,
+    }
+
+
+def sequential_pass(app, questions, mode):
+    client = app.test_client()
+    # One untimed pass so imports, reflection and first connections are not charged to question 1
+    for item in questions:
+        ask(client, item["question"], mode)
+
+    results = []
+    for item in questions:
+        result = ask(client, item["question"], mode)
+        result["question"] = item["question"]
+        results.append(result)
+
+    # Peak memory in a separate pass: tracemalloc slows allocation-heavy code several-fold
+    tracemalloc.start()
+    for item, result in zip(questions, results):
+        tracemalloc.reset_peak()
+        ask(client, item["question"], mode)
+        result["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    return results
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))]
+
+
+def concurrent_pass(app, questions, mode, clients, rounds):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client_loop(seed):
+        client = app.test_client()
+        order = [item["question"] for item in questions] * rounds
+        random.Random(seed).shuffle(order)
+        for question in order:
+            result = ask(client, question, mode)
+            with lock:
+                latencies.append(result["latency"])
+                if result["status"] != 200 or result["error"]:
+                    errors.append(question)
+
+    threads = [threading.Thread(target=client_loop, args=(seed,)) for seed in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "clients": clients,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, tolerance):
+    """
+    Print regressions against a previous --output; returns the number found.
+    """
+    regressions = 0
+    before = {item["question"]: item for item in baseline["questions"]}
+    for item in current["questions"]:
+        old = before.get(item["question"])
+        if old is None:
+            continue
+        for key in ("latency_ms", "llm_calls", "sql_statements"):
+            if item[key] > old[key] * (1 + tolerance) and item[key] - old[key] > (1.0 if key == "latency_ms" else 0):
+                regressions += 1
+                print(f"  REGRESSION {key}: {old[key]} -> {item[key]}  {item['question'][:70]}")
+    old_throughput = baseline["concurrent"]["throughput_per_second"]
+    new_throughput = current["concurrent"]["throughput_per_second"]
+    if new_throughput < old_throughput * (1 - tolerance):
+        regressions += 1
+        print(f"  REGRESSION throughput: {old_throughput} -> {new_throughput} req/s")
+    print(f"compared with {baseline.get('commit')}: {regressions} regression(s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="agent", choices=["agent", "direct"])
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--work-orders", type=int, default=20000, help="rows in the fixture work order view")
+    parser.add_argument("--fixture", help="replay against this SQLite database instead "
+                                          "(e.g. one from benchmarks/synthetic_maximo.py)")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated time per LLM call")
+    parser.add_argument("--sql-cache", action="store_true", help="leave the SQL result cache on")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="a previous --output to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown for --compare")
+    args = parser.parse_args()
+
+    with open(QUESTIONS_PATH, encoding="utf-8") as questions_file:
+        questions = json.load(questions_file)
+    script = {item["question"]: item["sql"] for item in questions}
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = setup_app(directory, script, args)
+        sequential = sequential_pass(app, questions, args.mode)
+        concurrent = concurrent_pass(app, questions, args.mode, args.clients, args.rounds)
+
+    print(f"{'question':<62} {'ms':>8} {'llm':>4} {'sql':>4} {'stmts':>5} {'peak KiB':>9}")
+    for item in sequential:
+        flag = f"  ERROR: {item['error'][:60]}" if item["error"] else ""
+        print(f"{item['question'][:62]:<62} {item['latency'] * 1000:8.1f} {item['llm_calls']:>4} "
+              f"{item['sql_tool_calls']:>4} {item['sql_statements']:>5} {item['peak_kib']:9.0f}{flag}")
+    latencies = [item["latency"] for item in sequential]
+    print(f"sequential: median {statistics.median(latencies) * 1000:.1f} ms, "
+          f"max peak {max(item['peak_kib'] for item in sequential):.0f} KiB (tracemalloc), "
+          f"errors {sum(1 for item in sequential if item['error'])}")
+    print(f"concurrent: {concurrent['clients']} clients x {args.rounds} rounds, "
+          f"{concurrent['throughput_per_second']} req/s, p50 {concurrent['p50_ms']} ms, "
+          f"p95 {concurrent['p95_ms']} ms, errors {concurrent['errors']}")
+    max_rss_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"process max RSS: {max_rss_kib / 1024:.0f} MiB")
+
+    summary = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "mode": args.mode,
+        "questions": [{
+            "question": item["question"],
+            "latency_ms": round(item["latency"] * 1000, 2),
+            "llm_calls": item["llm_calls"],
+            "sql_tool_calls": item["sql_tool_calls"],
+            "sql_statements": item["sql_statements"],
+            "peak_kib": round(item["peak_kib"]),
+            "error": item["error"],
+        } for item in sequential],
+        "concurrent": concurrent,
+        "max_rss_mib": round(max_rss_kib / 1024),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(summary, output, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            if compare(json.load(baseline), summary, args.tolerance):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
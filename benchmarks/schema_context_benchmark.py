@@ -0,0 +1,218 @@
+"""
+Schema context benchmark: prompt tokens and column recall of the pruned schema.
+
+Builds the replay benchmark's SQLite fixture (with --extra-columns, widened by the
+standard Maximo attributes the production views carry besides the ones the
+questions use: siteid, wopriority, targstartdate, actlabhrs, failurecode, ...)
+and takes its schema snapshot. Then:
+
+  - offline: for every recorded question (benchmarks/replay_questions.json) and
+    every seed example (prompts/few_shot_examples.v1.json) it renders the pruned
+    schema and reports its approximate tokens next to the full schema's, and its
+    recall: the share of the (view, column) pairs the verified SQL uses that the
+    pruned schema lists. A column the model is not shown is one it has to find
+    with sql_db_schema, or gets wrong.
+  - end to end: replays the recorded questions through /ask (agent and direct
+    modes, ReplayChatModel) with SCHEMA_CONTEXT=full and then pruned, and reports
+    the prompt tokens per request from the trace, the errors, and whether both
+    runs answered the same.
+
+Exits 1 if recall on the recorded questions is below --min-recall, or if a pruned
+run errs or answers differently.
+
+    python benchmarks/schema_context_benchmark.py
+    python benchmarks/schema_context_benchmark.py --extra-columns
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import sqlglot  # noqa: E402
+from sqlglot import exp  # noqa: E402
+
+from replay_benchmark import QUESTIONS_PATH, build_fixture, setup_app  # noqa: E402
+
+# Standard Maximo attributes, as (column, SQLite expression over rowid)
+_TEXT = "printf('%s-%d', '{code}', rowid % {spread})"
+_DATE = "date('2021-01-01', '+' || (rowid % 1600) || ' days')"
+EXTRA_COLUMNS = {
+    "vw_Maximo_WorkOrders": [
+        ("siteid", _TEXT.format(code="SITE", spread=3)), ("orgid", _TEXT.format(code="ORG", spread=1)),
+        ("wopriority", "rowid % 5"), ("targstartdate", _DATE), ("targcompdate", _DATE), ("schedstart", _DATE),
+        ("schedfinish", _DATE), ("actstart", _DATE), ("actfinish", _DATE), ("estdur", "(rowid % 40) / 4.0"),
+        ("actlabhrs", "(rowid % 60) / 4.0"), ("actmatcost", "(rowid % 900) * 1.5"),
+        ("actlabcost", "(rowid % 700) * 2.5"), ("acttotalcost", "(rowid % 1600) * 2.0"),
+        ("supervisor", _TEXT.format(code="SUP", spread=40)), ("lead", _TEXT.format(code="LEAD", spread=60)),
+        ("crewid", _TEXT.format(code="CREW", spread=30)), ("persongroup", _TEXT.format(code="PG", spread=12)),
+        ("owner", _TEXT.format(code="OWN", spread=80)), ("failurecode", _TEXT.format(code="FC", spread=45)),
+        ("problemcode", _TEXT.format(code="PC", spread=70)), ("jpnum", _TEXT.format(code="JP", spread=300)),
+        ("pmnum", _TEXT.format(code="PM", spread=500)), ("parent", _TEXT.format(code="WO", spread=5000)),
+        ("glaccount", _TEXT.format(code="GL", spread=90)), ("reportedby", _TEXT.format(code="USER", spread=150)),
+        ("changeby", _TEXT.format(code="USER", spread=150)), ("changedate", _DATE),
+        ("woclass", _TEXT.format(code="CLASS", spread=2)), ("classstructureid", _TEXT.format(code="CS", spread=200)),
+        ("istask", "rowid % 2"), ("wogroup", _TEXT.format(code="WG", spread=4000)),
+    ],
+    "vw_Maximo_Asset": [
+        ("siteid", _TEXT.format(code="SITE", spread=3)), ("orgid", _TEXT.format(code="ORG", spread=1)),
+        ("assettype", _TEXT.format(code="TYPE", spread=14)), ("status", _TEXT.format(code="ST", spread=4)),
+        ("serialnum", _TEXT.format(code="SN", spread=100000)), ("manufacturer", _TEXT.format(code="MFR", spread=35)),
+        ("vendor", _TEXT.format(code="VEN", spread=50)), ("installdate", _DATE),
+        ("purchaseprice", "(rowid % 5000) * 10.0"), ("priority", "rowid % 5"),
+        ("parent", _TEXT.format(code="A", spread=200)), ("changedate", _DATE), ("isrunning", "rowid % 2"),
+    ],
+    "vw_Maximo_Locations": [
+        ("siteid", _TEXT.format(code="SITE", spread=3)), ("orgid", _TEXT.format(code="ORG", spread=1)),
+        ("type", _TEXT.format(code="TYPE", spread=6)), ("status", _TEXT.format(code="ST", spread=3)),
+        ("parent", _TEXT.format(code="L", spread=8)), ("changedate", _DATE),
+        ("glaccount", _TEXT.format(code="GL", spread=90)), ("disabled", "rowid % 2"),
+    ],
+}
+
+
+def widen(path):
+    with sqlite3.connect(path) as conn:
+        for table, columns in EXTRA_COLUMNS.items():
+            for column, expression in columns:
+                column_type = "TEXT" if expression.startswith(("printf", "date")) else "REAL"
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            conn.execute(f"UPDATE {table} SET " + ", ".join(f"{column} = {expression}"
+                                                            for column, expression in columns))
+
+
+def used_columns(sql, snapshot):
+    """
+    The (view, column) pairs of snapshot views that sql reads; columns of CTEs and
+    output aliases are not counted.
+    """
+    columns_of = {table["name"].lower(): {column["name"].lower() for column in table["columns"]}
+                  for table in snapshot["tables"]}
+    statement = sqlglot.parse_one(sql, read="tsql")
+    aliases = {}
+    for table in statement.find_all(exp.Table):
+        if table.name.lower() in columns_of:
+            aliases[table.alias_or_name.lower()] = table.name.lower()
+            aliases[table.name.lower()] = table.name.lower()
+    used = set()
+    for column in statement.find_all(exp.Column):
+        name = column.name.lower()
+        if column.table:
+            candidates = [aliases[column.table.lower()]] if column.table.lower() in aliases else []
+        else:
+            candidates = [table for table in set(aliases.values()) if name in columns_of[table]]
+        used.update((table, name) for table in candidates if name in columns_of[table])
+    return used
+
+
+def offline(context, items, snapshot):
+    rows = []
+    for item in items:
+        started = time.perf_counter()
+        _text, stats = context.render(item["question"])
+        seconds = time.perf_counter() - started
+        selection = context.select(item["question"])
+        shown = ({(table.lower(), name.lower()) for table, kept in selection.items() for name, _values in kept}
+                 if stats["context"] == "pruned" else None)
+        used = used_columns(item["sql"], snapshot)
+        missing = sorted(used - shown) if shown is not None else []
+        rows.append({"question": item["question"], "tokens": stats["tokens"], "full_tokens": stats["full_tokens"],
+                     "context": stats["context"], "used": len(used), "missing": missing, "seconds": seconds})
+    return rows
+
+
+def report_offline(label, rows):
+    print(f"\n{label}")
+    print(f"{'question':<72} {'full':>5} {'sent':>5}  missing columns")
+    for row in rows:
+        missing = ", ".join(f"{table}.{column}" for table, column in row["missing"])
+        print(f"{row['question'][:72]:<72} {row['full_tokens']:>5} {row['tokens']:>5}  "
+              f"{missing}{'  (full schema)' if row['context'] == 'full' else ''}")
+    used = sum(row["used"] for row in rows)
+    missing = sum(len(row["missing"]) for row in rows)
+    full = sum(row["full_tokens"] for row in rows)
+    sent = sum(row["tokens"] for row in rows)
+    recall = (used - missing) / used if used else 1.0
+    print(f"schema tokens {full} -> {sent} ({100 * (1 - sent / full):.0f}% fewer), "
+          f"column recall {recall:.1%} ({missing} of {used} columns missing), "
+          f"median render {statistics.median(row['seconds'] for row in rows) * 1e6:.0f} us")
+    return recall
+
+
+def replay(app, questions, mode):
+    client = app.test_client()
+    results = []
+    for item in questions:
+        body = client.post("/ask", json={"question": item["question"], "visualize": True, "mode": mode,
+                                         "trace": True}).get_json()
+        timings = body["metadata"]["timings"]
+        results.append({
+            "prompt_tokens": timings["prompt_tokens"],
+            "schema": timings["schema_context"],
+            "error": next((call["error"] for call in timings["tool_calls"] if call.get("error")), None),
+            "answer": json.dumps([re.sub(r"/results/[0-9a-f]{32}", "/results/<spill>", body["final_answer"]),
+                                  body.get("visualizationData")], sort_keys=True, default=str),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--work-orders", type=int, default=20000, help="rows in the fixture work order view")
+    parser.add_argument("--extra-columns", action="store_true", help="add the standard Maximo attributes")
+    parser.add_argument("--min-recall", type=float, default=0.9, help="recall on the recorded questions to pass")
+    args = parser.parse_args()
+    args.sql_cache = False
+    args.clients = 1
+    args.llm_latency_ms = 0.0
+
+    with open(QUESTIONS_PATH, encoding="utf-8") as questions_file:
+        questions = json.load(questions_file)
+    from example_bank import SEED_PATH
+
+    with open(SEED_PATH, encoding="utf-8") as seed_file:
+        examples = json.load(seed_file)
+
+    with tempfile.TemporaryDirectory() as directory:
+        args.fixture = build_fixture(os.path.join(directory, "maximo.db"), args.work_orders)
+        if args.extra_columns:
+            widen(args.fixture)
+        app = setup_app(directory, {item["question"]: item["sql"] for item in questions}, args)
+        import agent_runtime
+
+        runtime = agent_runtime.current_runtime()
+        context = runtime.schema_context
+        snapshot = runtime.schema_snapshots.snapshot
+        print(f"schema: {sum(len(table['columns']) for table in snapshot['tables'])} columns in "
+              f"{len(snapshot['tables'])} views")
+        recall = report_offline("recorded questions", offline(context, questions, snapshot))
+        report_offline("seed examples", offline(context, examples, snapshot))
+
+        print(f"\n{'replay through /ask':<28} {'prompt tokens/request':>22} {'schema tokens':>14}  errors  same answers")
+        failed = recall < args.min_recall
+        for mode in ("agent", "direct"):
+            runtime.schema_context = None
+            full = replay(app, questions, mode)
+            runtime.schema_context = context
+            pruned = replay(app, questions, mode)
+            for label, results in (("full", full), ("pruned", pruned)):
+                errors = sum(1 for result in results if result["error"])
+                same = all(before["answer"] == after["answer"] for before, after in zip(full, results))
+                print(f"{mode + ', ' + label:<28} {statistics.mean(r['prompt_tokens'] for r in results):22.0f} "
+                      f"{statistics.mean(r['schema']['tokens'] for r in results):14.0f}  {errors:>6}  "
+                      f"{'yes' if same else 'NO'}")
+                failed = failed or errors > 0 or not same
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Single-flight benchmark: a burst of identical questions, with and without coalescing.
+
+Uses the replay benchmark's app (Flask routes, agent graph, query executor,
+SQLite fixture through the T-SQL shim, ReplayChatModel with --llm-latency-ms per
+call) and sends --clients identical questions at once:
+
+  - in-process: --clients threads against one app, first with single_flight off
+    and then on; each client alternates between /ask and /ask/stream
+  - cross-process (--workers N > 1): N worker processes, each with its own app,
+    sharing one answer cache and one single-flight lock file as gunicorn workers
+    on a host would, each sending --clients requests at the same moment
+
+For each it reports the agent runs started (LLM calls / 2, the recorded
+questions take two), the requests answered by another request's run, the wall
+time of the burst and whether every client got the same answer.
+
+    python benchmarks/singleflight_benchmark.py --clients 12 --llm-latency-ms 300
+    python benchmarks/singleflight_benchmark.py --clients 6 --workers 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from replay_benchmark import QUESTIONS_PATH, build_fixture, setup_app  # noqa: E402
+
+QUESTION_INDEX = 4
+
+
+def load_question():
+    with open(QUESTIONS_PATH, encoding="utf-8") as questions_file:
+        questions = json.load(questions_file)
+    return questions[QUESTION_INDEX]["question"], {item["question"]: item["sql"] for item in questions}
+
+
+def _final_from_stream(body):
+    events = [block for block in body.split("\n\n") if block.startswith("event: ")]
+    for block in events:
+        event, data = block.split("\n", 1)
+        if event == "event: final":
+            return json.loads(data[len("data: "):])
+        if event in ("event: error", "event: cancelled"):
+            return {"error": data}
+    return {"error": "no final event"}
+
+
+def burst(app, question, clients):
+    """
+    clients identical questions at once; returns each client's final answer JSON.
+    """
+    results = [None] * clients
+    start = threading.Barrier(clients)
+
+    def ask(number):
+        client = app.test_client()
+        start.wait()
+        body = {"question": question, "visualize": True}
+        if number % 2:
+            response = client.post("/ask/stream", json=body)
+            final = _final_from_stream(response.get_data(as_text=True))
+        else:
+            final = client.post("/ask", json=body).get_json()
+        results[number] = final
+
+    threads = [threading.Thread(target=ask, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, seconds):
+    answers = {json.dumps([result.get("final_answer"), result.get("visualizationData")], sort_keys=True, default=str)
+               for result in results}
+    metadata = [result.get("metadata") or {} for result in results]
+    return {
+        "requests": len(results),
+        "errors": sum(1 for result in results if "error" in result),
+        "llm_calls": sum(item.get("llm_calls") or 0 for item in metadata),
+        "coalesced": sum(1 for item in metadata if item.get("path") == "coalesced"),
+        "seconds": round(seconds, 3),
+        "same_answer": len(answers) == 1,
+    }
+
+
+def report(label, summary):
+    print(f"{label:<28} requests {summary['requests']:>3}  agent runs {summary['llm_calls'] // 2:>3}  "
+          f"llm calls {summary['llm_calls']:>3}  coalesced {summary['coalesced']:>3}  "
+          f"errors {summary['errors']}  wall {summary['seconds'] * 1000:7.0f} ms  "
+          f"same answer: {'yes' if summary['same_answer'] else 'NO'}")
+
+
+def in_process(args):
+    question, script = load_question()
+    with tempfile.TemporaryDirectory() as directory:
+        app = setup_app(directory, script, args)
+        import app_shared
+        from singleflight import SingleFlight
+
+        for label, flights in (("in-process, coalescing off", None), ("in-process, coalescing on", SingleFlight())):
+            app_shared.single_flight = flights
+            started = time.perf_counter()
+            results = burst(app, question, args.clients)
+            report(label, summarize(results, time.perf_counter() - started))
+            if flights is not None:
+                print(f"  {flights.stats()}")
+
+
+def worker(args):
+    """
+    One worker process of the cross-process run: set up, report ready, wait for 'go', burst.
+    """
+    question, script = load_question()
+    with tempfile.TemporaryDirectory() as directory:
+        app = setup_app(directory, script, args)
+        import app_shared
+        from answer_cache import AnswerCache
+        from singleflight import SingleFlight
+
+        app_shared.answer_cache = AnswerCache(args.answer_cache)
+        app_shared.single_flight = SingleFlight(args.lock_path)
+        print("ready", flush=True)
+        sys.stdin.readline()
+        started = time.perf_counter()
+        results = burst(app, question, args.clients)
+        print(json.dumps({"results": results, "seconds": time.perf_counter() - started,
+                          "stats": app_shared.single_flight.stats()}, default=str), flush=True)
+
+
+def cross_process(args):
+    with tempfile.TemporaryDirectory() as directory:
+        fixture = args.fixture or build_fixture(os.path.join(directory, "maximo.db"), args.work_orders)
+        command = [sys.executable, os.path.abspath(__file__), "--worker", "--fixture", fixture,
+                   "--answer-cache", os.path.join(directory, "answer_cache.sqlite3"),
+                   "--lock-path", os.path.join(directory, "singleflight.sqlite3"),
+                   "--clients", str(args.clients), "--llm-latency-ms", str(args.llm_latency_ms)]
+        workers = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                   for _worker in range(args.workers)]
+        for process in workers:
+            if process.stdout.readline().strip() != "ready":
+                raise RuntimeError("a worker failed to start")
+        started = time.perf_counter()
+        for process in workers:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        outputs = [json.loads(process.communicate()[0].strip().splitlines()[-1]) for process in workers]
+        seconds = time.perf_counter() - started
+        results = [result for output in outputs for result in output["results"]]
+        report(f"{args.workers} workers, coalescing on", summarize(results, seconds))
+        for number, output in enumerate(outputs):
+            print(f"  worker {number}: {output['stats']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=12, help="identical questions sent at once (per worker)")
+    parser.add_argument("--workers", type=int, default=3, help="worker processes for the cross-process run")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="simulated time per LLM call")
+    parser.add_argument("--work-orders", type=int, default=20000, help="rows in the fixture work order view")
+    parser.add_argument("--fixture", help="SQLite fixture to use instead of a generated one")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--answer-cache", help=argparse.SUPPRESS)
+    parser.add_argument("--lock-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.sql_cache = False
+
+    if args.worker:
+        worker(args)
+        return
+    in_process(args)
+    if args.workers > 1:
+        cross_process(args)
+
+
+if __name__ == "__main__":
+    main()
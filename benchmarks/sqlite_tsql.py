@@ -0,0 +1,84 @@
+"""
+Run the agent's T-SQL against a SQLite stand-in of the Maximo views.
+
+install(engine) makes a SQLite engine (e.g. one from db_pool.create_maximo_engine
+with a sqlite:/// DATABASE_URL) accept the SQL Server dialect the prompts ask for:
+  - text() statements (sql_db_query, SQLDatabase.run) are transpiled from T-SQL
+    to SQLite with sqlglot: TOP / OFFSET FETCH -> LIMIT, DATEADD, GETDATE, ...
+  - YEAR(), MONTH() and DAY(), which sqlglot leaves as they are, are registered
+    as SQLite functions on every connection
+  - 'YYYYMMDD' literals compared with a date column (sql_rewriter's ranges) become
+    'YYYY-MM-DD': SQL Server converts the literal to the column's type, SQLite
+    compares it as text with the fixture's 'YYYY-MM-DD HH:MM:SS' dates
+Statements SQLAlchemy compiles itself (reflection, schema snapshot sampling) are
+already SQLite and pass through untouched. Used by the benchmarks only.
+"""
+import functools
+import re
+
+import sqlglot
+from sqlglot import exp
+from sqlalchemy import event
+from sqlalchemy.sql.elements import TextClause
+
+
+def _date_part(start, end):
+    def part(value):
+        if value is None:
+            return None
+        text = str(value)
+        try:
+            return int(text[start:end])
+        except ValueError:
+            return None
+    return part
+
+
+EXPLAIN_PREFIX = "EXPLAIN QUERY PLAN "
+
+_COMPACT_DATE = re.compile(r"([0-9]{4})([0-9]{2})([0-9]{2})")
+
+
+def _iso_dates(tree):
+    for comparison in tree.find_all(exp.EQ, exp.NEQ, exp.GT, exp.GTE, exp.LT, exp.LTE):
+        column, literal = comparison.left, comparison.right
+        if not isinstance(column, exp.Column):
+            column, literal = literal, column
+        if isinstance(column, exp.Column) and column.name.lower().endswith("date") \
+                and isinstance(literal, exp.Literal) and literal.is_string:
+            match = _COMPACT_DATE.fullmatch(literal.this)
+            if match:
+                literal.replace(exp.Literal.string("-".join(match.groups())))
+    return tree
+
+
+@functools.lru_cache(maxsize=1024)
+def to_sqlite(statement):
+    """
+    The SQLite form of a T-SQL statement; statements sqlglot cannot parse are returned unchanged.
+    """
+    if statement.upper().startswith(EXPLAIN_PREFIX):
+        # The query guard's plan request wraps the agent's T-SQL
+        return EXPLAIN_PREFIX + to_sqlite(statement[len(EXPLAIN_PREFIX):])
+    try:
+        trees = sqlglot.parse(statement, read="tsql")
+        return ";\n".join(_iso_dates(tree).sql(dialect="sqlite") for tree in trees if tree is not None)
+    except sqlglot.errors.SqlglotError:
+        return statement
+
+
+def install(engine):
+    @event.listens_for(engine, "connect")
+    def register_functions(dbapi_connection, connection_record):
+        dbapi_connection.create_function("YEAR", 1, _date_part(0, 4), deterministic=True)
+        dbapi_connection.create_function("MONTH", 1, _date_part(5, 7), deterministic=True)
+        dbapi_connection.create_function("DAY", 1, _date_part(8, 10), deterministic=True)
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def transpile(conn, cursor, statement, parameters, context, executemany):
+        compiled = getattr(context, "compiled", None)
+        if compiled is not None and isinstance(compiled.statement, TextClause):
+            statement = to_sqlite(statement)
+        return statement, parameters
+
+    return engine
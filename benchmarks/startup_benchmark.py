@@ -0,0 +1,96 @@
+"""
+Time-to-ready benchmark for the SQL question app.
+
+Starts a fresh interpreter for each run, imports Sql_Question_App, waits until
+the agent runtime reports ready and records:
+  - import:         seconds until the app module is imported (time-to-first-request)
+  - ready:          seconds until /ready would return 200
+  - phase timings:  per-phase breakdown from agent_runtime.startup_timings
+
+Each invocation appends one summary line to benchmarks/startup_history.jsonl
+(with the current git commit) so time-to-ready can be tracked across changes.
+
+    python benchmarks/startup_benchmark.py --runs 5
+    python benchmarks/startup_benchmark.py --mode eager
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_PATH = os.path.join(REPO_DIR, "benchmarks", "startup_history.jsonl")
+
+CHILD_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import Sql_Question_App
+import agent_runtime
+imported = time.perf_counter() - started
+while True:
+    status = agent_runtime.readiness()
+    if status["ready"]:
+        break
+    if status["error"]:
+        raise SystemExit("initialization failed: " + status["error"])
+    time.sleep(0.005)
+ready = time.perf_counter() - started
+print(json.dumps({"import": imported, "ready": ready, "timings": status["timings"]}))
+"""
+
+
+def run_once(mode):
+    env = dict(os.environ, AGENT_INIT_MODE=mode)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--mode", default="background", choices=["background", "eager"])
+    parser.add_argument("--no-history", action="store_true", help="do not append to startup_history.jsonl")
+    args = parser.parse_args()
+
+    runs = [run_once(args.mode) for _ in range(args.runs)]
+    phases = sorted({phase for run in runs for phase in run["timings"]})
+
+    print(f"{'phase':<20} {'median s':>10}")
+    for phase in phases:
+        print(f"{phase:<20} {statistics.median(run['timings'].get(phase, 0.0) for run in runs):>10.4f}")
+    summary = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "mode": args.mode,
+        "runs": args.runs,
+        "import_s": round(statistics.median(run["import"] for run in runs), 4),
+        "ready_s": round(statistics.median(run["ready"] for run in runs), 4),
+        "phases_s": {phase: round(statistics.median(run["timings"].get(phase, 0.0) for run in runs), 4)
+                     for phase in phases},
+    }
+    print(f"{'time to import':<20} {summary['import_s']:>10.4f}")
+    print(f"{'time to ready':<20} {summary['ready_s']:>10.4f}")
+
+    if not args.no_history:
+        with open(HISTORY_PATH, "a", encoding="utf-8") as history:
+            history.write(json.dumps(summary) + "\n")
+
+
+if __name__ == "__main__":
+    main()
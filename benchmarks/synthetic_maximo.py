@@ -0,0 +1,369 @@
+"""
+Synthetic Maximo dataset generator for load and query-plan testing.
+
+Writes vw_Maximo_Asset, vw_Maximo_Locations and vw_Maximo_WorkOrders with the
+column names the prompts, join hints, rollup store and replay questions use
+(assetnum, asset_id, location_code, location_description, statusdate,
+reportdate, workype_description, worktype_id, status_description, ...) at any
+scale from thousands to tens of millions of work orders:
+
+  - skew:         assets and locations are drawn from Zipf-like distributions, so a
+                  few hot assets (23230, 23257, ...) and locations (04.07.30.02.01
+                  Hamilton Township, ...) dominate, as in production
+  - seasonality:  monthly and weekday weights plus a slow upward trend
+  - NULL asset_id at --null-asset-rate (work raised against a location only)
+  - status:       old work orders are mostly Closed/Completed, recent ones open
+
+Work orders are generated and written in chunks of --chunk-size rows with
+NumPy, so memory stays flat at 50M rows. Output formats:
+
+  sqlite   one database file; use it as DATABASE_URL=sqlite:///<file> or as the
+           replay benchmark's --fixture
+  duckdb   one database file (needs the optional 'duckdb' package); chunks are
+           loaded through read_csv, so pandas/pyarrow are not required
+  csv      three CSV files in a directory, e.g. for bcp into a SQL Server test database
+
+    python benchmarks/synthetic_maximo.py --rows 1000000 --output maximo_1m.db
+    python benchmarks/synthetic_maximo.py --rows 50000000 --format duckdb --output maximo_50m.duckdb --indexes
+"""
+import argparse
+import csv
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+WORK_TYPES = [
+    # (workype_description, worktype_id, share)
+    ("Corrective Maintenance", "CM", 0.48),
+    ("Proactive Maintenance", "PM", 0.27),
+    ("Scheduled Preventive Maintenance", "SPM", 0.14),
+    ("Customer Faults", "CF", 0.08),
+    ("Capital Project", "CP", 0.03),
+]
+CLOSED_STATUSES = [("Closed", 0.78), ("Completed", 0.15), ("Cancelled", 0.05), ("Cancelled (Closed)", 0.02)]
+OPEN_STATUSES = [
+    ("Approved", 0.2), ("Assigned", 0.15), ("In progress", 0.2), ("Scheduled", 0.1), ("Field Complete", 0.1),
+    ("Waiting on approval", 0.08), ("Waiting on material", 0.07), ("On Hold", 0.05), ("Not Ready", 0.05),
+]
+# Work orders reported within this many days of --end are mostly still open
+OPEN_WINDOW_DAYS = 60
+
+# Relative work order volume by month (Jan..Dec) and weekday (Mon..Sun)
+MONTH_WEIGHTS = [1.05, 0.85, 0.9, 0.6, 1.6, 1.0, 1.15, 1.2, 1.0, 1.0, 1.3, 1.1]
+WEEKDAY_WEIGHTS = [1.2, 1.2, 1.15, 1.1, 1.0, 0.25, 0.15]
+
+# The hottest locations and assets carry the names seen in production and in the recorded questions
+NAMED_LOCATIONS = [
+    ("04.07.30.02.01", "Hamilton Township", "Township"),
+    ("04.18.09.03.01", "Portland Township", "Township"),
+    ("04.07.31.02.02", "Hamilton - Digby Rd SPS Catchment", "Catchment"),
+    ("007.018.006.007.002", "Warrnambool WRP", "Treatment Plant"),
+    ("04.17.12.02.01", "Port Fairy Township", "Township"),
+    ("004.001", "Corporate - Warrnambool Depot", "Depot"),
+    ("004.002", "Corporate - Portland Depot", "Depot"),
+]
+NAMED_ASSETS = [
+    ("23230", "Corporate - Warrnambool Depot"),
+    ("23257", "Warrnambool - Pertobe Rd SPS"),
+    ("23254", "Warrnambool - Morriss Rd SPS"),
+    ("23242", "Warrnambool - Dickson St SPS"),
+    ("107024", "Corporate - Portland Depot - Wyatt St (at Storage)"),
+    ("92142", "Konongwootong Reservoir - Raw Water Storage (Emergency)"),
+    ("22948", "South Otway - Plantation Rd Reservoir - Raw Water Storage"),
+    ("92592", "Grampians - Cruckoor Reservoir - Raw Water Storage"),
+    ("22767", "Camperdown - Park Lane Service Basin - Potable Water Storage"),
+    ("344570", "Casterton - Arundel Rd Basin Square - Storage - Floating Cover"),
+]
+TOWNS = ["Hamilton", "Portland", "Warrnambool", "Port Fairy", "Camperdown", "Casterton", "Koroit", "Terang",
+         "Mortlake", "Cobden", "Timboon", "Coleraine", "Heywood", "Macarthur", "Penshurst", "Dunkeld"]
+LOCATION_KINDS = ["Township", "SPS Catchment", "Reservoir", "Water Treatment Plant", "Basin", "Depot", "Pipeline"]
+ASSET_KINDS = ["SPS", "Water Main", "Sewer Pipe", "Pump", "Valve", "Flow Meter", "Reservoir - Raw Water Storage",
+               "Service Basin - Potable Water Storage", "Switchboard", "Chlorinator"]
+DESCRIPTION_TEMPLATES = ["Inspect and repair", "Scheduled service", "Customer reported fault", "Replace component",
+                         "Clear blockage", "Leak repair", "Condition assessment", "Calibrate instrument"]
+
+WORK_ORDER_COLUMNS = [
+    ("wonum", "TEXT"), ("description", "TEXT"), ("statusdate", "TIMESTAMP"), ("reportdate", "TIMESTAMP"),
+    ("workype_description", "TEXT"), ("worktype_id", "TEXT"), ("status_description", "TEXT"),
+    ("location_id", "TEXT"), ("location_description", "TEXT"), ("asset_id", "TEXT"),
+]
+ASSET_COLUMNS = [("assetnum", "TEXT"), ("asset_description", "TEXT"), ("location_code", "TEXT"),
+                 ("location_description", "TEXT")]
+LOCATION_COLUMNS = [("location_id", "INTEGER"), ("location_code", "TEXT"), ("location_description", "TEXT"),
+                    ("locationclassification_desc", "TEXT")]
+INDEXES = [
+    ("vw_Maximo_WorkOrders", "statusdate"),
+    ("vw_Maximo_WorkOrders", "asset_id"),
+    ("vw_Maximo_WorkOrders", "location_id"),
+    ("vw_Maximo_WorkOrders", "location_description"),
+    ("vw_Maximo_WorkOrders", "workype_description"),
+    ("vw_Maximo_Asset", "assetnum"),
+    ("vw_Maximo_Locations", "location_description"),
+]
+
+
+def zipf_weights(count, exponent):
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+
+def build_locations(count, rng):
+    locations = list(NAMED_LOCATIONS)
+    seen = {code for code, _, _ in locations}
+    while len(locations) < count:
+        code = f"0{rng.integers(4, 8)}.{rng.integers(1, 40):02d}.{rng.integers(1, 40):02d}.{rng.integers(1, 10):02d}.0{rng.integers(1, 4)}"
+        if code in seen:
+            continue
+        seen.add(code)
+        town = TOWNS[rng.integers(len(TOWNS))]
+        kind = LOCATION_KINDS[rng.integers(len(LOCATION_KINDS))]
+        classification = "Depot" if kind == "Depot" else kind.split()[-1]
+        locations.append((code, f"{town} {kind} {len(locations)}", classification))
+    return [(i + 1, code, description, classification)
+            for i, (code, description, classification) in enumerate(locations[:count])]
+
+
+def build_assets(count, locations, rng):
+    """
+    Assets with a home location; named assets sit at the hottest locations.
+    """
+    location_index = rng.choice(len(locations), size=count, p=zipf_weights(len(locations), 0.8))
+    assets = []
+    for i in range(count):
+        if i < len(NAMED_ASSETS):
+            assetnum, description = NAMED_ASSETS[i]
+        else:
+            town = TOWNS[rng.integers(len(TOWNS))]
+            assetnum = str(400000 + i)
+            description = f"{town} - {ASSET_KINDS[rng.integers(len(ASSET_KINDS))]} {i}"
+        location = locations[location_index[i]]
+        assets.append((assetnum, description, location[1], location[2]))
+    return assets, location_index
+
+
+def day_weights(start, end):
+    """
+    Probability of a work order being reported on each day in [start, end].
+    """
+    days = (end - start).days + 1
+    dates = [start + datetime.timedelta(days=day) for day in range(days)]
+    weights = np.array([MONTH_WEIGHTS[date.month - 1] * WEEKDAY_WEIGHTS[date.weekday()] for date in dates])
+    weights *= np.linspace(0.6, 1.4, days)
+    return weights / weights.sum()
+
+
+def _choose(rng, choices, size):
+    values = np.array([choice[0] for choice in choices], dtype=object)
+    shares = np.array([choice[-1] for choice in choices], dtype=float)
+    return values[rng.choice(len(choices), size=size, p=shares / shares.sum())]
+
+
+def generate_work_orders(rows, chunk_size, locations, assets, asset_locations, start, end, null_asset_rate,
+                         seed):
+    """
+    Yield dicts of column name -> NumPy array, chunk_size rows at a time.
+    """
+    rng = np.random.default_rng(seed)
+    asset_p = zipf_weights(len(assets), 1.05)
+    location_p = zipf_weights(len(locations), 1.0)
+    day_p = day_weights(start, end)
+    epoch = np.datetime64(start.isoformat(), "s")
+    open_after = np.datetime64((end - datetime.timedelta(days=OPEN_WINDOW_DAYS)).isoformat(), "s")
+    location_codes = np.array([location[1] for location in locations], dtype=object)
+    location_descriptions = np.array([location[2] for location in locations], dtype=object)
+    assetnums = np.array([asset[0] for asset in assets], dtype=object)
+    asset_location_index = np.asarray(asset_locations)
+    work_type_ids = {description: worktype_id for description, worktype_id, _share in WORK_TYPES}
+    templates = np.array(DESCRIPTION_TEMPLATES, dtype=object)
+
+    for offset in range(0, rows, chunk_size):
+        size = min(chunk_size, rows - offset)
+        reported = epoch + (rng.choice(len(day_p), size=size, p=day_p) * 86400
+                            + rng.integers(6 * 3600, 18 * 3600, size=size)).astype("timedelta64[s]")
+        # Status changes follow the report by an exponentially distributed delay (mean 9 days)
+        status_date = reported + (rng.exponential(9 * 86400, size=size)).astype("timedelta64[s]")
+        status_date = np.minimum(status_date, np.datetime64(end.isoformat(), "s") + np.timedelta64(86399, "s"))
+
+        asset_index = rng.choice(len(assets), size=size, p=asset_p)
+        has_asset = rng.random(size) >= null_asset_rate
+        # Work on an asset happens at the asset's location; the rest is spread over all locations
+        location_index = np.where(has_asset, asset_location_index[asset_index],
+                                  rng.choice(len(locations), size=size, p=location_p))
+
+        worktype = _choose(rng, WORK_TYPES, size)
+        status = np.where(reported >= open_after, _choose(rng, OPEN_STATUSES, size),
+                          _choose(rng, CLOSED_STATUSES, size))
+        yield {
+            "wonum": np.array([f"WO{number}" for number in range(1000000 + offset, 1000000 + offset + size)],
+                              dtype=object),
+            "description": templates[rng.integers(len(templates), size=size)],
+            "statusdate": np.datetime_as_string(status_date, unit="s"),
+            "reportdate": np.datetime_as_string(reported, unit="s"),
+            "workype_description": worktype,
+            "worktype_id": np.array([work_type_ids[value] for value in worktype], dtype=object),
+            "status_description": status,
+            "location_id": location_codes[location_index],
+            "location_description": location_descriptions[location_index],
+            "asset_id": np.where(has_asset, assetnums[asset_index], None),
+        }
+
+
+def _rows(chunk):
+    columns = [chunk[name] for name, _type in WORK_ORDER_COLUMNS]
+    # ISO 'T' separator -> the 'YYYY-MM-DD HH:MM:SS' form SQL Server exports and SQLite compares as text
+    columns[2] = np.char.replace(columns[2], "T", " ")
+    columns[3] = np.char.replace(columns[3], "T", " ")
+    return zip(*(column.tolist() for column in columns))
+
+
+class SqliteWriter:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+
+    def create(self, table, columns):
+        definition = ", ".join(f"{name} {'TEXT' if kind == 'TIMESTAMP' else kind}" for name, kind in columns)
+        self.conn.execute(f"CREATE TABLE {table} ({definition})")
+
+    def insert(self, table, columns, rows):
+        placeholders = ", ".join("?" for _ in columns)
+        self.conn.executemany(f"INSERT INTO {table} VALUES ({placeholders})", rows)
+        self.conn.commit()
+
+    def index(self, table, column):
+        self.conn.execute(f"CREATE INDEX ix_{table}_{column} ON {table} ({column})")
+
+    def close(self):
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+        self.conn.close()
+
+
+class CsvWriter:
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def create(self, table, columns):
+        with open(os.path.join(self.directory, f"{table}.csv"), "w", newline="", encoding="utf-8") as out:
+            csv.writer(out).writerow(name for name, _kind in columns)
+
+    def insert(self, table, columns, rows):
+        with open(os.path.join(self.directory, f"{table}.csv"), "a", newline="", encoding="utf-8") as out:
+            csv.writer(out).writerows(rows)
+
+    def index(self, table, column):
+        pass
+
+    def close(self):
+        pass
+
+
+class DuckDBWriter:
+    """
+    Loads each chunk through a temporary CSV file and read_csv, which DuckDB
+    parses in parallel and needs neither pandas nor pyarrow for.
+    """
+
+    def __init__(self, path):
+        try:
+            import duckdb
+        except ImportError:
+            raise SystemExit("--format duckdb needs the 'duckdb' package: pip install duckdb") from None
+        self.conn = duckdb.connect(path)
+        self.scratch = tempfile.TemporaryDirectory()
+
+    def create(self, table, columns):
+        definition = ", ".join(f"{name} {'VARCHAR' if kind == 'TEXT' else kind}" for name, kind in columns)
+        self.conn.execute(f"CREATE TABLE {table} ({definition})")
+
+    def insert(self, table, columns, rows):
+        path = os.path.join(self.scratch.name, "chunk.csv")
+        with open(path, "w", newline="", encoding="utf-8") as out:
+            csv.writer(out).writerows(rows)
+        types = ", ".join(f"'{name}': '{'VARCHAR' if kind == 'TEXT' else kind}'" for name, kind in columns)
+        self.conn.execute(f"INSERT INTO {table} SELECT * FROM read_csv('{path}', header=false, "
+                          f"columns={{{types}}}, nullstr='')")
+
+    def index(self, table, column):
+        self.conn.execute(f"CREATE INDEX ix_{table}_{column} ON {table} ({column})")
+
+    def close(self):
+        self.conn.close()
+        self.scratch.cleanup()
+
+
+WRITERS = {"sqlite": SqliteWriter, "duckdb": DuckDBWriter, "csv": CsvWriter}
+
+
+def generate(output, rows, output_format="sqlite", chunk_size=200000, seed=7, assets=None, locations=None,
+             null_asset_rate=0.35, start=datetime.date(2016, 1, 1), end=datetime.date(2025, 12, 31),
+             indexes=False, progress=True):
+    """
+    Write a synthetic dataset of `rows` work orders to output; returns the seconds taken.
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    # Scale the reference tables with the data, as a larger estate has more assets and sites
+    location_count = locations or max(len(NAMED_LOCATIONS), min(20000, rows // 2000))
+    asset_count = assets or max(len(NAMED_ASSETS) * 10, min(500000, rows // 40))
+    location_rows = build_locations(location_count, rng)
+    asset_rows, asset_locations = build_assets(asset_count, location_rows, rng)
+
+    writer = WRITERS[output_format](output)
+    writer.create("vw_Maximo_Locations", LOCATION_COLUMNS)
+    writer.insert("vw_Maximo_Locations", LOCATION_COLUMNS, location_rows)
+    writer.create("vw_Maximo_Asset", ASSET_COLUMNS)
+    writer.insert("vw_Maximo_Asset", ASSET_COLUMNS, asset_rows)
+    writer.create("vw_Maximo_WorkOrders", WORK_ORDER_COLUMNS)
+
+    written = 0
+    for chunk in generate_work_orders(rows, chunk_size, location_rows, asset_rows, asset_locations, start, end,
+                                      null_asset_rate, seed + 1):
+        writer.insert("vw_Maximo_WorkOrders", WORK_ORDER_COLUMNS, _rows(chunk))
+        written += len(chunk["wonum"])
+        if progress:
+            elapsed = time.perf_counter() - started
+            print(f"\r  {written:,} / {rows:,} work orders  ({written / elapsed:,.0f} rows/s)", end="",
+                  file=sys.stderr, flush=True)
+    if progress:
+        print(file=sys.stderr)
+
+    if indexes:
+        for table, column in INDEXES:
+            writer.index(table, column)
+    writer.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="work orders to generate")
+    parser.add_argument("--output", required=True, help="database file, or directory for --format csv")
+    parser.add_argument("--format", default="sqlite", choices=sorted(WRITERS))
+    parser.add_argument("--chunk-size", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--assets", type=int, help="asset count (default scales with --rows)")
+    parser.add_argument("--locations", type=int, help="location count (default scales with --rows)")
+    parser.add_argument("--null-asset-rate", type=float, default=0.35)
+    parser.add_argument("--start", type=datetime.date.fromisoformat, default=datetime.date(2016, 1, 1))
+    parser.add_argument("--end", type=datetime.date.fromisoformat, default=datetime.date(2025, 12, 31))
+    parser.add_argument("--indexes", action="store_true",
+                        help="index the date, asset and location columns (for query-plan testing)")
+    args = parser.parse_args()
+
+    if args.format != "csv" and os.path.exists(args.output):
+        raise SystemExit(f"{args.output} already exists")
+    seconds = generate(args.output, args.rows, args.format, args.chunk_size, args.seed, args.assets,
+                       args.locations, args.null_asset_rate, args.start, args.end, args.indexes)
+    print(f"wrote {args.rows:,} work orders to {args.output} in {seconds:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
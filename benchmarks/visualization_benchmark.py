@@ -0,0 +1,94 @@
+"""
+Chart-data parse benchmark: string round trip vs typed columnar artifact.
+
+Builds a (work_order_count, month, year) result of --rows rows and times
+generate_dynamic_visualization_data on:
+  - string:   the tool output as text (str(list_of_tuples)), re-parsed with ast.literal_eval,
+              which is what the app did before sql_db_query returned an artifact
+  - artifact: the same result as the typed, column-oriented artifact from query_executor
+It also times producing the text itself, and shows that the string path cannot
+parse Decimal values at all.
+
+    python benchmarks/visualization_benchmark.py --rows 100000
+"""
+import argparse
+import decimal
+import os
+import statistics
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# Import the app without building the agent or opening the answer cache
+os.environ.setdefault("AGENT_INIT_MODE", "lazy")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+from app_shared import generate_dynamic_visualization_data  # noqa: E402
+
+
+def make_rows(count, value_type):
+    rows = []
+    for i in range(count):
+        value = 1000 + i % 997
+        rows.append((value_type(value), 1 + i % 12, 1950 + (i // 12) % 100))
+    return rows
+
+
+def to_artifact(rows):
+    return {
+        "columns": ["work_order_count", "month", "year"],
+        "types": ["integer", "integer", "integer"],
+        "data": [list(column) for column in zip(*rows)],
+        "row_count": len(rows),
+        "complete": True,
+        "spill_id": None,
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, int)
+    artifact = to_artifact(rows)
+
+    stringify, content = timed(lambda: str(rows), args.repeat)
+    string_parse, string_chart = timed(
+        lambda: generate_dynamic_visualization_data([{"type": "Tool Message", "content": content}], True), args.repeat)
+    artifact_parse, artifact_chart = timed(
+        lambda: generate_dynamic_visualization_data(
+            [{"type": "Tool Message", "content": "", "artifact": artifact}], True), args.repeat)
+    assert string_chart["labels"] == artifact_chart["labels"]
+    assert string_chart["values"] == artifact_chart["values"]
+
+    decimal_rows = make_rows(args.rows, decimal.Decimal)
+    decimal_string_chart = generate_dynamic_visualization_data(
+        [{"type": "Tool Message", "content": str(decimal_rows)}], True)
+    decimal_artifact_chart = generate_dynamic_visualization_data(
+        [{"type": "Tool Message", "content": "", "artifact": to_artifact(decimal_rows)}], True)
+
+    print(f"rows: {args.rows:,}  (median of {args.repeat})")
+    print(f"  str(rows):                 {stringify * 1000:9.1f} ms")
+    print(f"  string + ast.literal_eval: {string_parse * 1000:9.1f} ms")
+    print(f"  typed columnar artifact:   {artifact_parse * 1000:9.1f} ms  "
+          f"({string_parse / artifact_parse:.0f}x faster)")
+    print(f"  Decimal values - string path: {'chart' if decimal_string_chart else 'no chart'}, "
+          f"artifact path: {'chart' if decimal_artifact_chart else 'no chart'}")
+
+
+if __name__ == "__main__":
+    main()
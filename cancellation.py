@@ -0,0 +1,248 @@
+"""
+Cooperative cancellation of in-flight questions.
+
+A question the client no longer waits for (tab closed, question resubmitted)
+would otherwise keep the graph running to the end: more LLM calls, more SQL.
+Each run gets a CancelToken, registered under its request id while the run
+is active. The token is cancelled when:
+  - the client disconnects: the Quart handler task is cancelled by the server;
+    under Flask, watch_disconnect() notices the closed socket, and a response
+    closed on a failed write closes the answer generator
+  - the client calls POST /ask/<request_id>/cancel (the request id is sent
+    in the SSE 'start' event and the response metadata, or chosen by the
+    client with "request_id" in the request body)
+
+Runs are registered under their session (the owner, app_shared's session
+cookie) and request id: only the session that started a run can cancel it, and
+the same id in two sessions names two different runs. A session starting a run
+under an id it already has running gets RequestIdInUse instead of taking the
+id over.
+
+Cancelling a token:
+  - stops the graph at the next step (answer_flow checks after every chunk)
+  - aborts the pending LLM call: the callback handler raises on the next
+    streamed token and before any new LLM or tool call starts; on the async
+    path the cancelled task also closes the HTTP request right away
+  - cancels the SQL statement running for the request (QueryExecutor
+    registers its cursor cancel with the token while it executes)
+
+The registry is per process: with several workers, the cancel request has to
+reach the worker running the question (sticky sessions), otherwise it is a 404.
+"""
+import contextvars
+import functools
+import logging
+import select
+import socket
+import threading
+import uuid
+
+_current_token = contextvars.ContextVar("maximo_cancel_token", default=None)
+
+_active = {}
+_active_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """
+    Raised inside a run whose token was cancelled.
+    """
+
+
+class RequestIdInUse(Exception):
+    """
+    Raised when a run is registered under a request id its session already has running.
+    """
+
+
+class CancelToken:
+    """
+    Cancellation state of one run, plus the callbacks that abort its blocking work.
+    """
+
+    def __init__(self, request_id=None, owner=None):
+        self.request_id = request_id or uuid.uuid4().hex
+        self.owner = owner
+        self.reason = None
+        self._event = threading.Event()
+        self._finished = threading.Event()
+        self._callbacks = {}
+        self._lock = threading.Lock()
+        self._context_token = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    @property
+    def finished(self):
+        return self._finished.is_set()
+
+    def start(self):
+        """
+        Register the token under its request id and make it current for the calling context.
+        """
+        self.register()
+        self._context_token = _current_token.set(self)
+        return self
+
+    def register(self):
+        """
+        Make the run cancellable through its request id without making the token current,
+        for a request that waits on another run's result (singleflight) instead of running.
+        Raises RequestIdInUse if another run holds the owner's request id.
+        """
+        key = (self.owner, self.request_id)
+        with _active_lock:
+            if _active.get(key, self) is not self:
+                raise RequestIdInUse(f"Request id {self.request_id} is already in use by a running question")
+            _active[key] = self
+        return self
+
+    def stop(self):
+        self._finished.set()
+        key = (self.owner, self.request_id)
+        with _active_lock:
+            if _active.get(key) is self:
+                del _active[key]
+        if self._context_token is not None:
+            try:
+                _current_token.reset(self._context_token)
+            except ValueError:
+                # Reset from a different context than start(); that context is discarded anyway
+                pass
+            self._context_token = None
+
+    def cancel(self, reason="cancelled"):
+        """
+        Cancel the run and abort whatever it is blocked on. Returns False if it was already cancelled.
+        """
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Cancel callback failed for request %s: %s", self.request_id, e)
+        from instrumentation import record_cancellation
+
+        record_cancellation(reason)
+        return True
+
+    def on_cancel(self, callback):
+        """
+        Call callback() if the run is cancelled; returns a function that unregisters it.
+        Runs callback at once if the run has already been cancelled.
+        """
+        key = object()
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks[key] = callback
+                return functools.partial(self._callbacks.pop, key, None)
+        callback()
+        return lambda: None
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RequestCancelled(f"Request {self.request_id} was cancelled ({self.reason})")
+
+
+def watch_disconnect(environ, token, interval_seconds=0.25):
+    """
+    Cancel token if the client closes its connection before the run finishes.
+    A WSGI app otherwise only notices on its next write, which can be a whole
+    SQL statement or LLM call later.
+    Needs the server's client socket in the WSGI environ (werkzeug, gunicorn sync
+    workers); does nothing under servers that don't expose it.
+    """
+    client_socket = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if client_socket is None:
+        return None
+
+    def watch():
+        while not token.finished and not token.cancelled:
+            try:
+                readable, _, _ = select.select([client_socket], [], [], interval_seconds)
+                if not readable:
+                    continue
+                # The request body has been read, so a readable socket is either closed
+                # (b"") or carrying the next pipelined request, which we leave alone
+                if client_socket.recv(1, socket.MSG_PEEK) == b"":
+                    token.cancel("client disconnected")
+                return
+            except (OSError, ValueError):
+                # Reset or closed under us: the client is gone either way
+                if not token.finished:
+                    token.cancel("client disconnected")
+                return
+
+    watcher = threading.Thread(target=watch, name=f"disconnect-watch-{token.request_id[:8]}", daemon=True)
+    watcher.start()
+    return watcher
+
+
+def current_token():
+    return _current_token.get()
+
+
+def cancel_request(request_id, owner=None, reason="cancel endpoint"):
+    """
+    Cancel owner's active run registered under request_id; False if there is none.
+    """
+    with _active_lock:
+        token = _active.get((owner, request_id))
+    if token is None:
+        return False
+    token.cancel(reason)
+    return True
+
+
+def active_requests():
+    with _active_lock:
+        return sorted(request_id for _owner, request_id in _active)
+
+
+@functools.lru_cache(maxsize=None)
+def _handler_class():
+    # Built on first use so importing this module does not import LangChain
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class CancellationCallbackHandler(BaseCallbackHandler):
+        """
+        Raises RequestCancelled from inside the run once its token is cancelled.
+        """
+
+        # Exceptions from this handler must reach the caller instead of being logged
+        raise_error = True
+        run_inline = True
+
+        def __init__(self, token):
+            self.token = token
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.token.raise_if_cancelled()
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self.token.raise_if_cancelled()
+
+        def on_llm_new_token(self, token, **kwargs):
+            # Leaving the stream closes the HTTP response, so OpenAI stops generating
+            self.token.raise_if_cancelled()
+
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.token.raise_if_cancelled()
+
+    return CancellationCallbackHandler
+
+
+def callback_handler(token):
+    """
+    A LangChain callback handler that aborts the run once token is cancelled.
+    """
+    return _handler_class()(token)
@@ -0,0 +1,382 @@
+"""
+Chart inference for typed SQL results.
+
+Picks the chart shape from the column types, names and cardinality of a result
+(the columnar artifact from query_executor) instead of assuming a fixed tuple
+layout:
+  - time series:      a time axis (datetime/date column, 'YYYY-MM[-DD]' text, or
+                      year and/or month columns) with one dataset per measure
+  - categorical top-N: one category column, sorted by value, with the tail
+                      beyond CHART_TOP_N folded into an 'Other' bar
+  - multi-series:     a time or category axis pivoted by a second category,
+                      keeping the CHART_MAX_SERIES largest series plus 'Other'
+Grouping and pivoting are done with NumPy (np.unique + np.bincount), so results
+with thousands of categories or many years of monthly rows cost a few array
+passes rather than a Python loop per row.
+
+Time series with more than CHART_MAX_POINTS points are downsampled with LTTB
+(largest-triangle-three-buckets), which keeps the peaks and troughs a chart
+needs while sending a bounded number of points to the browser.
+
+The output is the structure renderChart in static/js/script.js understands:
+{'labels': [...], 'values': [...]} for one series or
+{'labels': [...], 'datasets': [{'label': ..., 'data': [...]}, ...]} for several,
+plus 'type' ('bar' or 'line'), for one series its 'label', and for a
+downsampled series 'downsampled_from' (the original number of points).
+"""
+import calendar
+import datetime
+import decimal
+import os
+import re
+
+import numpy as np
+
+TOP_N = int(os.getenv("CHART_TOP_N", "25"))
+MAX_SERIES = int(os.getenv("CHART_MAX_SERIES", "8"))
+# Time series longer than this are downsampled with LTTB
+MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "1000"))
+# Time series with more points than this are drawn as lines instead of bars
+LINE_CHART_MIN_POINTS = 36
+
+OTHER_LABEL = "Other"
+BLANK_LABEL = "(blank)"
+
+NUMERIC_TYPES = ("integer", "float", "decimal")
+TIME_TYPES = ("datetime", "date")
+
+# Numeric columns that identify things rather than measure them (asset_id, wonum, location_code, ...)
+_IDENTIFIER_NAME = re.compile(r"(^|_)(id|num|number|code|key)$|^(wonum|assetnum|siteid)$", re.IGNORECASE)
+# Words of a column name: 'WorkOrderYear' -> Work, Order, Year; 'monthly_avg' -> monthly, avg
+_NAME_WORD = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+_TIME_WORDS = {"year": ("year", "yr"), "month": ("month", "mon")}
+# Values a year or month column can hold; 'avg_per_month' = 37.5 is a measure
+_TIME_RANGES = {"year": (1900, 2100), "month": (1, 12)}
+_DATE_TEXT = re.compile(r"^\d{4}-\d{2}(-\d{2})?")
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+class _Column:
+    def __init__(self, name, role, values):
+        self.name = name
+        self.role = role
+        self.values = values
+
+
+def _value_type(values):
+    value = next((value for value in values if value is not None), None)
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, (float, decimal.Decimal)):
+        return "float"
+    if isinstance(value, datetime.date):
+        return "datetime"
+    return "string"
+
+
+def _role(name, column_type, values):
+    lowered = (name or "").lower()
+    if column_type in TIME_TYPES:
+        return "time"
+    if column_type == "string":
+        first = next((value for value in values if value is not None), None)
+        if isinstance(first, str) and _DATE_TEXT.match(first):
+            return "time"
+        # e.g. YEAR() rendered as text: '2023'
+        if isinstance(first, str) and first.isdigit() and lowered in ("year", "month"):
+            return lowered
+        return "category"
+    if column_type in NUMERIC_TYPES:
+        role = _time_part(name, values)
+        if role is not None:
+            return role
+        if _IDENTIFIER_NAME.search(lowered):
+            return "category"
+        return "measure"
+    return "category"
+
+
+def _time_part(name, values):
+    """
+    'year' or 'month' for a numeric column named by that word ('Year', 'report_month',
+    'WorkOrderYear', not 'monthly_avg' or 'total_years') whose values are whole years or months.
+    """
+    words = {word.lower() for word in _NAME_WORD.findall(name or "")}
+    for role, names in _TIME_WORDS.items():
+        if words.isdisjoint(names):
+            continue
+        low, high = _TIME_RANGES[role]
+        if all(value is None or (float(value).is_integer() and low <= value <= high) for value in values):
+            return role
+    return None
+
+
+def _guess_year_month(columns):
+    """
+    Without column names (results re-parsed from text), find an integer column
+    within 1..12 and one within 1900..2100 to use as month and year.
+    """
+    integers = [
+        column for column in columns
+        if column.role == "measure" and all(isinstance(value, int) for value in column.values)
+    ]
+    if len(integers) < 3:
+        return
+    # Search from the right: the app's date-based results are (work_order_count, month, year)
+    year = next((column for column in reversed(integers) if all(1900 <= value <= 2100 for value in column.values)), None)
+    month = next((column for column in reversed(integers)
+                  if column is not year and all(1 <= value <= 12 for value in column.values)), None)
+    if month is not None and year is not None:
+        month.role = "month"
+        year.role = "year"
+
+
+def _as_float(values):
+    # None becomes NaN and Decimal becomes float; missing measures count as 0
+    array = np.array(values, dtype=float)
+    return np.nan_to_num(array, nan=0.0)
+
+
+def _as_labels(values):
+    return np.array([BLANK_LABEL if value is None else str(value) for value in values])
+
+
+def _time_axis(time_columns, row_count):
+    """
+    Return (sort_keys, labels_for_keys, valid_mask) for the time columns, or None.
+    """
+    by_role = {column.role: column for column in time_columns}
+    month_names = list(calendar.month_name)
+
+    if "time" in by_role:
+        values = by_role["time"].values
+        first = next((value for value in values if value is not None), None)
+        if isinstance(first, datetime.date):
+            # Day numbers via toordinal(): far cheaper than numpy's datetime object conversion
+            ordinals = np.fromiter((0 if value is None else value.toordinal() for value in values),
+                                   dtype=np.int64, count=len(values))
+            unit = "D"
+            valid = ordinals > 0
+            keys = ordinals - _EPOCH_ORDINAL
+        else:
+            unit = "M" if isinstance(first, str) and len(first) == 7 else "D"
+            try:
+                times = np.array([None if value is None else str(value)[:10] for value in values],
+                                 dtype=f"datetime64[{unit}]")
+            except ValueError:
+                return None
+            valid = ~np.isnat(times)
+            keys = times.astype(np.int64)
+
+        def label(key):
+            return str(np.datetime64(int(key), unit))
+        return keys, label, valid
+
+    year = _as_float(by_role["year"].values) if "year" in by_role else None
+    month = _as_float(by_role["month"].values) if "month" in by_role else None
+    if year is not None and month is not None:
+        valid = (month >= 1) & (month <= 12) & (year > 0)
+        keys = year.astype(np.int64) * 12 + (month.astype(np.int64) - 1)
+
+        def label(key):
+            return f"{month_names[int(key) % 12 + 1]} {int(key) // 12}"
+        return keys, label, valid
+    if year is not None:
+        return year.astype(np.int64), lambda key: str(int(key)), np.ones(row_count, dtype=bool)
+    valid = (month >= 1) & (month <= 12)
+    return month.astype(np.int64), lambda key: month_names[int(key)], valid
+
+
+def _numbers(array):
+    """
+    JSON-ready numbers: ints when every value is integral.
+    """
+    if np.all(np.mod(array, 1) == 0):
+        return array.astype(np.int64).tolist()
+    return np.round(array, 6).tolist()
+
+
+def _group_sum(keys, weights):
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return unique_keys, inverse, np.bincount(inverse, weights=weights, minlength=len(unique_keys))
+
+
+def _pivot(x_inverse, x_count, series_keys, weights):
+    """
+    Sum weights into a (series, x) matrix.
+    """
+    series_labels, series_inverse = np.unique(series_keys, return_inverse=True)
+    flat = series_inverse * x_count + x_inverse
+    matrix = np.bincount(flat, weights=weights, minlength=len(series_labels) * x_count)
+    return series_labels, matrix.reshape(len(series_labels), x_count)
+
+
+def _top_series(series_labels, matrix):
+    """
+    Keep the MAX_SERIES largest series and fold the rest into 'Other'.
+    Returns (names, matrix) with one matrix row per kept series.
+    """
+    order = np.argsort(-matrix.sum(axis=1), kind="stable")
+    names = [str(series_labels[i]) for i in order[:MAX_SERIES]]
+    rows = matrix[order[:MAX_SERIES]]
+    if len(order) > MAX_SERIES:
+        names.append(OTHER_LABEL)
+        rows = np.vstack([rows, matrix[order[MAX_SERIES:]].sum(axis=0)])
+    return names, rows
+
+
+def _datasets(names, matrix):
+    return [{"label": name, "data": _numbers(row)} for name, row in zip(names, matrix)]
+
+
+def lttb_indices(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: pick `threshold` indices of (x, y) that keep
+    the visual shape of the series (peaks and troughs survive, flat runs collapse).
+    The first and last points are always kept.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # threshold - 2 buckets between the fixed first and last points
+    every = (n - 2) / (threshold - 2)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    # Average point of every bucket's right-hand neighbour (the last bucket's neighbour is the last point)
+    neighbour_starts = edges[1:]
+    neighbour_sizes = np.diff(np.append(neighbour_starts, n))
+    average_x = np.add.reduceat(x, neighbour_starts) / neighbour_sizes
+    average_y = np.add.reduceat(y, neighbour_starts) / neighbour_sizes
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Twice the triangle area between the previous pick, each candidate and the neighbour's average
+        areas = np.abs(
+            (x[previous] - average_x[bucket]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (average_y[bucket] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def _top_categories(totals):
+    """
+    Indices of the TOP_N largest categories, and of the ones folded into 'Other'.
+    """
+    order = np.argsort(-totals, kind="stable")
+    return order[:TOP_N], order[TOP_N:]
+
+
+def _time_series_chart(time, measures, categories, weights):
+    keys, label, valid = time
+    if not valid.any():
+        return None
+    keys = keys[valid]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+    if categories:
+        series_labels, matrix = _pivot(inverse, len(unique_keys), categories[0].values[valid], weights[0][valid])
+        names, matrix = _top_series(series_labels, matrix)
+    else:
+        names = measures[:MAX_SERIES]
+        matrix = np.vstack([np.bincount(inverse, weights=weight[valid], minlength=len(unique_keys))
+                            for weight in weights[:MAX_SERIES]])
+
+    point_count = len(unique_keys)
+    if point_count > MAX_POINTS:
+        # One set of indices for all series, chosen on their total, so the datasets stay aligned
+        selected = lttb_indices(unique_keys, matrix.sum(axis=0), MAX_POINTS)
+        unique_keys = unique_keys[selected]
+        matrix = matrix[:, selected]
+
+    labels = [label(key) for key in unique_keys]
+    chart = {"type": "line" if len(labels) > LINE_CHART_MIN_POINTS else "bar", "labels": labels}
+    if point_count > MAX_POINTS:
+        chart["downsampled_from"] = point_count
+    if len(names) == 1 and not categories:
+        chart["label"] = names[0]
+        chart["values"] = _numbers(matrix[0])
+    else:
+        chart["datasets"] = _datasets(names, matrix)
+    return chart
+
+
+def _categorical_chart(measures, categories, weights):
+    # The axis is the category with more distinct values; a second category becomes the series
+    if len(categories) > 1:
+        categories = sorted(categories[:2], key=lambda column: -len(np.unique(column.values)))
+    x_labels, inverse, totals = _group_sum(categories[0].values, weights[0])
+    keep, rest = _top_categories(totals)
+    labels = [str(x_labels[i]) for i in keep] + ([OTHER_LABEL] if len(rest) else [])
+
+    def fold(row):
+        folded = row[keep]
+        return np.append(folded, row[rest].sum()) if len(rest) else folded
+
+    if len(categories) > 1:
+        series_labels, matrix = _pivot(inverse, len(x_labels), categories[1].values, weights[0])
+        matrix = np.array([fold(row) for row in matrix])
+        return {"type": "bar", "labels": labels, "datasets": _datasets(*_top_series(series_labels, matrix))}
+
+    if len(weights) == 1:
+        return {"type": "bar", "label": measures[0], "labels": labels, "values": _numbers(fold(totals))}
+    datasets = []
+    for name, weight in list(zip(measures, weights))[:MAX_SERIES]:
+        datasets.append({"label": name, "data": _numbers(fold(np.bincount(inverse, weights=weight,
+                                                                          minlength=len(x_labels))))})
+    return {"type": "bar", "labels": labels, "datasets": datasets}
+
+
+def infer_chart(result):
+    """
+    Build chart data from a columnar result {'columns', 'types', 'data'}
+    (columns and types may be None). Returns None if the result has no chartable shape.
+    """
+    data = result.get("data") or []
+    if not data or not len(data[0]):
+        return None
+    row_count = len(data[0])
+    names = result.get("columns") or [None] * len(data)
+    types = result.get("types") or [_value_type(values) for values in data]
+
+    columns = [_Column(name, _role(name, column_type, values), values)
+               for name, column_type, values in zip(names, types, data)]
+    if result.get("columns") is None:
+        _guess_year_month(columns)
+
+    time_columns = [column for column in columns if column.role in ("time", "year", "month")]
+    categories = [column for column in columns if column.role == "category"]
+    measure_columns = [column for column in columns if column.role == "measure"]
+
+    for column in categories:
+        column.values = _as_labels(column.values)
+    if measure_columns:
+        measures = [column.name or "Value" for column in measure_columns]
+        weights = [_as_float(column.values) for column in measure_columns]
+    else:
+        # No numeric column: chart how many rows fall in each group
+        measures = ["Rows"]
+        weights = [np.ones(row_count)]
+
+    if time_columns:
+        time = _time_axis(time_columns, row_count)
+        chart = _time_series_chart(time, measures, categories, weights) if time is not None else None
+        if chart is not None:
+            return chart
+    if categories:
+        return _categorical_chart(measures, categories, weights)
+    if measure_columns and row_count == 1:
+        # A single row of aggregates, e.g. (open_count, closed_count)
+        return {"type": "bar", "label": "Value", "labels": measures,
+                "values": _numbers(np.array([weight[0] for weight in weights]))}
+    return None
@@ -0,0 +1,114 @@
+"""
+gzip / brotli compression of the app's larger responses.
+
+/ask answers carry every step's text and the chart payload, which compress
+well (JSON of repeated keys, labels and numbers). Responses of at least
+COMPRESS_MIN_BYTES with a compressible content type are encoded with the best
+encoding the client lists in Accept-Encoding: brotli when the optional 'brotli'
+package is installed, otherwise gzip. Server-Sent Event streams and file
+downloads are left alone: they are streamed, not buffered.
+"""
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+
+COMPRESSIBLE_MIMETYPES = (
+    "application/json",
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+)
+
+
+def choose_encoding(accept_encoding):
+    """
+    Return 'br', 'gzip' or None for an Accept-Encoding header value.
+    """
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+
+    def allowed(name):
+        return accepted.get(name, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        # Quality 5 compresses JSON close to the maximum at a fraction of the CPU cost
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _should_compress(status_code, mimetype, headers):
+    return (
+        COMPRESS_ENABLED
+        and 200 <= status_code < 300
+        and mimetype in COMPRESSIBLE_MIMETYPES
+        and "Content-Encoding" not in headers
+    )
+
+
+def _mark_encoded(headers, encoding):
+    headers["Content-Encoding"] = encoding
+    vary = headers.get("Vary")
+    headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+
+
+def compress_response(response, accept_encoding):
+    """
+    Flask after_request hook body: compress a buffered response in place.
+    """
+    if response.direct_passthrough or response.is_streamed \
+            or not _should_compress(response.status_code, response.mimetype, response.headers):
+        return response
+    data = response.get_data()
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    _mark_encoded(response.headers, encoding)
+    return response
+
+
+async def compress_async_response(response, accept_encoding):
+    """
+    Quart after_request hook body: compress a buffered (DataBody) response in place.
+    """
+    from quart.wrappers.response import DataBody
+
+    if not isinstance(response.response, DataBody) \
+            or not _should_compress(response.status_code, response.mimetype, response.headers):
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    data = await response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    _mark_encoded(response.headers, encoding)
+    return response
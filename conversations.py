@@ -0,0 +1,472 @@
+"""
+Conversation threads: follow-up questions with bounded history and reusable results.
+
+A request that carries a thread_id continues that thread. The agent gets:
+  - the thread's recent turns (question and final answer, no tool output) as
+    prior messages, newest first until CONVERSATION_HISTORY_TOKENS is used up
+  - a summary of the older turns (CONVERSATION_SUMMARY_TOKENS at most), and
+    the thread's kept result sets, at the end of the system message
+  - the 'previous_results_query' tool, which runs SQLite SELECTs over those
+    result sets (tables result_1, result_2, ...) in memory, so "now by month",
+    "only the top 3" or "chart it" re-slice an earlier result without another
+    SQL Server round trip; bounded like sql_db_query, by SQL_MAX_ROWS rows
+    read and SQL_QUERY_TIMEOUT_SECONDS
+
+Result sets come from the ToolMessage artifacts of sql_db_query (and of
+previous_results_query itself); only complete results of at most
+CONVERSATION_MAX_RESULT_ROWS rows are kept, since re-slicing part of a result
+would give wrong answers.
+
+Threads live in the memory of the worker process (like the cancel registry),
+so with several workers a thread needs sticky sessions. Like request ids, a
+thread_id belongs to the session (owner) that started the thread: another session
+sending the same id gets a thread of its own, and cannot read or delete this one.
+They are bounded:
+  - per thread, CONVERSATION_MAX_RESULTS result sets and
+    CONVERSATION_MAX_THREAD_BYTES; over it, the oldest result sets are
+    dropped, then the oldest turns are folded into the summary
+  - per process, CONVERSATION_MAX_THREADS threads and
+    CONVERSATION_MAX_TOTAL_BYTES; over either, the least recently used
+    threads are dropped, as are threads idle for CONVERSATION_TTL_SECONDS
+
+LangChainTutorial.py tried LangGraph's MemorySaver for this; it keeps every
+checkpoint of every thread (tool output included) with no bound or eviction.
+
+Settings (app_shared):
+  CONVERSATIONS_ENABLED          'true' (default) or 'false'
+  CONVERSATION_SUMMARY           'extractive' (default; no LLM call) or 'llm'
+"""
+import contextvars
+import datetime
+import decimal
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+_current_conversation = contextvars.ContextVar("maximo_conversation", default=None)
+
+# Tools whose artifacts are kept as result sets
+RESULT_TOOLS = ("sql_db_query", "previous_results_query")
+
+_SQLITE_TYPES = {"integer": "INTEGER", "boolean": "INTEGER", "float": "REAL", "decimal": "REAL"}
+
+_ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION}
+
+logger = logging.getLogger(__name__)
+
+
+class ResultQueryError(Exception):
+    """
+    A previous_results_query statement that is not a SELECT over the thread's result sets.
+    """
+
+
+def current_conversation():
+    return _current_conversation.get()
+
+
+def activate(conversation):
+    """
+    Make conversation the current thread of the calling context, for the prompt and the
+    previous_results_query tool; returns a function that restores the previous one.
+    """
+    context_token = _current_conversation.set(conversation)
+
+    def restore():
+        try:
+            _current_conversation.reset(context_token)
+        except ValueError:
+            # Restored from a different context than activate(); that context is discarded anyway
+            pass
+
+    return restore
+
+
+def approximate_tokens(text):
+    # About 4 characters per token for English and SQL; close enough for a budget
+    return len(text) // 4 + 1 if text else 0
+
+
+def final_answer(messages):
+    """
+    The content of the run's last AI message without tool calls, or None.
+    """
+    for message in reversed(messages):
+        if message.type == 'ai' and not getattr(message, 'tool_calls', None):
+            return message.content
+    return None
+
+
+def _sqlite_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _unique_columns(columns):
+    # SQL Server leaves COUNT(*) without an alias unnamed, and joins can repeat a name
+    names = []
+    for number, column in enumerate(columns, 1):
+        name = column or f"column_{number}"
+        candidate, suffix = name, 2
+        while candidate.lower() in (existing.lower() for existing in names):
+            candidate, suffix = f"{name}_{suffix}", suffix + 1
+        names.append(candidate)
+    return names
+
+
+def check_results_query(sql, tables):
+    """
+    Return an error message unless sql is a single SELECT over the given tables only.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read="sqlite") if statement is not None]
+    except ParseError as e:
+        error = e.errors[0] if e.errors else {}
+        return (f"Syntax error at line {error.get('line')}, column {error.get('col')}: "
+                f"{error.get('description', str(e))} near '{error.get('highlight', '')}'.")
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.Union)):
+        return "Only a single SELECT statement over the earlier result sets is allowed."
+    cte_names = {cte.alias_or_name.lower() for cte in statements[0].find_all(exp.CTE)}
+    for table in statements[0].find_all(exp.Table):
+        if table.name.lower() not in tables and table.name.lower() not in cte_names:
+            return (f"Unknown table '{table.name}'. The tables available to this tool are "
+                    f"{', '.join(sorted(tables)) or 'none'}.")
+    return None
+
+
+def _read_only(action, *_args):
+    return sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+
+class ResultSet:
+    """
+    One kept query result, column-oriented as in the sql_db_query artifact.
+    """
+
+    def __init__(self, name, question, sql, columns, types, data):
+        self.name = name
+        self.question = question
+        self.sql = sql
+        self.columns = _unique_columns(columns)
+        self.types = list(types or ["string"] * len(self.columns))
+        self.data = data
+        self.row_count = len(data[0]) if data else 0
+        # Value objects plus the list slots holding them
+        self.size = sum(sys.getsizeof(value) + 8 for values in data for value in values) + 200
+
+    def prompt_line(self):
+        columns = ", ".join(f"{column} {kind}" for column, kind in zip(self.columns, self.types))
+        return f"- {self.name}({columns}): {self.row_count} rows, for \"{self.question}\""
+
+    def load(self, conn):
+        definitions = ", ".join(f'"{column.replace(chr(34), chr(34) * 2)}" {_SQLITE_TYPES.get(kind, "TEXT")}'
+                                for column, kind in zip(self.columns, self.types))
+        conn.execute(f'CREATE TABLE "{self.name}" ({definitions})')
+        placeholders = ", ".join("?" for _column in self.columns)
+        conn.executemany(f'INSERT INTO "{self.name}" VALUES ({placeholders})',
+                         ([_sqlite_value(value) for value in row] for row in zip(*self.data)))
+
+    def describe(self):
+        return {"name": self.name, "question": self.question, "sql": self.sql, "columns": self.columns,
+                "types": self.types, "rows": self.row_count, "bytes": self.size}
+
+
+class Conversation:
+    """
+    The turns, summary and result sets of one thread. Thread-safe.
+    """
+
+    def __init__(self, thread_id, store, owner=None):
+        self.thread_id = thread_id
+        self.owner = owner
+        self.store = store
+        self.turns = []
+        self.summary = None
+        self.results = OrderedDict()
+        self.created = self.last_used = time.time()
+        self._next_result = 1
+        self._lock = threading.RLock()
+
+    @property
+    def size(self):
+        with self._lock:
+            turns = sum(len(turn["question"]) + len(turn["answer"]) + 100 for turn in self.turns)
+            return turns + len(self.summary or "") + sum(result.size for result in self.results.values())
+
+    def is_empty(self):
+        with self._lock:
+            return not self.turns and self.summary is None
+
+    def history(self):
+        """
+        The recent turns as chat messages, oldest first, within the history token budget.
+        """
+        with self._lock:
+            turns = list(self.turns)
+        messages = []
+        budget = self.store.history_tokens
+        for turn in reversed(turns):
+            budget -= turn["tokens"]
+            if budget < 0 and messages:
+                break
+            messages[:0] = [{"role": "user", "content": turn["question"]},
+                            {"role": "assistant", "content": turn["answer"]}]
+        return messages
+
+    def context_note(self):
+        """
+        System prompt text with the summary of older turns and the kept result sets, or None.
+        """
+        with self._lock:
+            summary = self.summary
+            results = list(self.results.values())
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier part of this conversation:\n{summary}")
+        if results:
+            parts.append("Results of earlier questions in this conversation. For follow-ups that filter, "
+                         "re-group, re-sort or chart them, query these with previous_results_query (SQLite) "
+                         "instead of going back to the database:\n"
+                         + "\n".join(result.prompt_line() for result in results))
+        return "\n\n".join(parts) or None
+
+    def record_turn(self, question, answer, messages=()):
+        """
+        Add an answered question and keep the result sets of its run.
+        """
+        budget_chars = self.store.history_tokens * 4
+        answer = answer or ""
+        if len(answer) > budget_chars:
+            answer = answer[:budget_chars] + " ..."
+        with self._lock:
+            names = [self._keep_result(question, *result) for result in _run_results(messages, self.store)]
+            self.turns.append({"question": question, "answer": answer, "results": names,
+                               "tokens": approximate_tokens(question) + approximate_tokens(answer)})
+            while len(self.turns) > 1 and sum(turn["tokens"] for turn in self.turns) > self.store.history_tokens:
+                self._fold_oldest_turn()
+            self._enforce_limits()
+            self.last_used = time.time()
+        self.store.enforce_limits(self)
+
+    def _keep_result(self, question, sql, artifact):
+        name = f"result_{self._next_result}"
+        self._next_result += 1
+        self.results[name] = ResultSet(name, question, sql, artifact["columns"], artifact.get("types"),
+                                       artifact["data"])
+        while len(self.results) > self.store.max_results:
+            self.results.popitem(last=False)
+        return name
+
+    def _fold_oldest_turn(self):
+        turn = self.turns.pop(0)
+        self.summary = self.store.summarize(self.summary, turn)
+
+    def _enforce_limits(self):
+        while self.size > self.store.max_thread_bytes:
+            if self.results:
+                self.results.popitem(last=False)
+            elif len(self.turns) > 1:
+                self._fold_oldest_turn()
+            else:
+                break
+
+    def query(self, sql):
+        """
+        Run a SELECT over the thread's result sets in an in-memory SQLite database;
+        returns (columns, rows, stop_reason). Like the query executor, reading stops
+        after the store's query_max_rows rows, with stop_reason saying so (None when
+        rows is the whole result). Raises ResultQueryError (also after
+        query_timeout_seconds), RequestCancelled or sqlite3.Error.
+        """
+        from cancellation import current_token
+
+        with self._lock:
+            results = {name.lower(): result for name, result in self.results.items()}
+            self.last_used = time.time()
+        error = check_results_query(sql, set(results))
+        if error:
+            raise ResultQueryError(error)
+        referenced = {table.name.lower() for table in sqlglot.parse_one(sql, read="sqlite").find_all(exp.Table)}
+        max_rows, timeout_seconds = self.store.query_max_rows, self.store.query_timeout_seconds
+        deadline = time.monotonic() + timeout_seconds if timeout_seconds else None
+        cancel_token = current_token()
+
+        def interrupt():
+            # A join of result sets can be far larger than any of them: stop at the deadline or a cancel
+            return (deadline is not None and time.monotonic() > deadline) \
+                or (cancel_token is not None and cancel_token.cancelled)
+
+        conn = sqlite3.connect(":memory:")
+        try:
+            for name in referenced & set(results):
+                results[name].load(conn)
+            conn.set_authorizer(_read_only)
+            conn.set_progress_handler(interrupt, 10000)
+            try:
+                cursor = conn.execute(sql)
+                rows = cursor.fetchmany(max_rows + 1) if max_rows else cursor.fetchall()
+            except sqlite3.OperationalError:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if deadline is not None and time.monotonic() > deadline:
+                    raise ResultQueryError(f"Query cancelled after {timeout_seconds} seconds. "
+                                           "Simplify it or add filters.") from None
+                raise
+            stop_reason = None
+            if max_rows and len(rows) > max_rows:
+                rows, stop_reason = rows[:max_rows], f"{max_rows:,} row limit"
+            return [column[0] for column in cursor.description], rows, stop_reason
+        finally:
+            conn.close()
+
+    def describe(self):
+        with self._lock:
+            return {"thread_id": self.thread_id, "summary": self.summary,
+                    "turns": [{"question": turn["question"], "answer": turn["answer"], "results": turn["results"]}
+                              for turn in self.turns],
+                    "results": [result.describe() for result in self.results.values()],
+                    "bytes": self.size, "created": self.created, "last_used": self.last_used}
+
+
+def _run_results(messages, store):
+    """
+    (sql, artifact) of each complete, small enough result in a run's tool messages.
+    """
+    queries = {}
+    for message in messages:
+        for tool_call in getattr(message, 'tool_calls', None) or []:
+            queries[tool_call["id"]] = tool_call["args"].get("query")
+    for message in messages:
+        artifact = getattr(message, 'artifact', None)
+        if message.type != 'tool' or getattr(message, 'name', None) not in RESULT_TOOLS \
+                or not isinstance(artifact, dict) or not artifact.get("data"):
+            continue
+        if artifact.get("complete") and artifact["row_count"] <= store.max_result_rows:
+            yield queries.get(message.tool_call_id), artifact
+
+
+def extractive_summary(max_tokens):
+    """
+    Summarizer keeping one line per folded turn (question and the start of the answer),
+    dropping the oldest lines beyond max_tokens.
+    """
+    def summarize(summary, turn):
+        answer = " ".join(turn["answer"].split())
+        line = f"- Asked: {turn['question']} Answered: {answer[:200]}{'...' if len(answer) > 200 else ''}"
+        lines = (summary.split("\n") if summary else []) + [line]
+        while len(lines) > 1 and approximate_tokens("\n".join(lines)) > max_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    return summarize
+
+
+def llm_summary(get_llm, max_tokens):
+    """
+    Summarizer asking the LLM to fold a turn into the running summary; falls back to the
+    extractive summary if the call fails.
+    """
+    fallback = extractive_summary(max_tokens)
+
+    def summarize(summary, turn):
+        prompt = (f"Update the summary of a conversation about Maximo work order data with one more "
+                  f"question and answer. Keep the facts, numbers, filters and assets a follow-up question "
+                  f"could refer to. At most {max_tokens * 3 // 4} words.\n\n"
+                  f"Summary so far:\n{summary or '(none)'}\n\n"
+                  f"Question: {turn['question']}\nAnswer: {turn['answer']}")
+        try:
+            text = get_llm().invoke(prompt).content.strip()
+        except Exception as e:
+            logger.warning("Conversation summary failed, keeping an extractive one: %s", e)
+            return fallback(summary, turn)
+        return text if approximate_tokens(text) <= max_tokens * 2 else fallback(summary, turn)
+
+    return summarize
+
+
+class ConversationStore:
+    """
+    The threads of this process, least recently used first.
+    """
+
+    def __init__(self, max_threads=500, max_thread_bytes=8 * 1024 * 1024, max_total_bytes=256 * 1024 * 1024,
+                 ttl_seconds=4 * 3600, history_tokens=2000, summary_tokens=400, max_results=5,
+                 max_result_rows=20000, summarize=None, query_max_rows=200000, query_timeout_seconds=60):
+        self.max_threads = max_threads
+        self.max_thread_bytes = max_thread_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl_seconds = ttl_seconds
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.max_results = max_results
+        self.max_result_rows = max_result_rows
+        self.summarize = summarize or extractive_summary(summary_tokens)
+        self.query_max_rows = query_max_rows
+        self.query_timeout_seconds = query_timeout_seconds
+        self._threads = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, thread_id, create=True, owner=None):
+        """
+        owner's thread with thread_id, marked most recently used; created if missing and create is set.
+        """
+        key = (owner, thread_id)
+        with self._lock:
+            self._remove_expired()
+            conversation = self._threads.get(key)
+            if conversation is None:
+                if not create:
+                    return None
+                conversation = self._threads[key] = Conversation(thread_id, self, owner)
+            self._threads.move_to_end(key)
+            conversation.last_used = time.time()
+        self.enforce_limits(conversation)
+        return conversation
+
+    def delete(self, thread_id, owner=None):
+        with self._lock:
+            return self._threads.pop((owner, thread_id), None) is not None
+
+    def enforce_limits(self, keep=None):
+        """
+        Drop least recently used threads (other than keep) until the process limits hold.
+        """
+        with self._lock:
+            total = sum(conversation.size for conversation in self._threads.values())
+            for key in list(self._threads):
+                if len(self._threads) <= self.max_threads and total <= self.max_total_bytes:
+                    break
+                if self._threads[key] is keep:
+                    continue
+                total -= self._threads.pop(key).size
+                self.evictions += 1
+
+    def _remove_expired(self):
+        # Called with self._lock held; the least recently used come first
+        cutoff = time.time() - self.ttl_seconds
+        while self._threads:
+            key, conversation = next(iter(self._threads.items()))
+            if conversation.last_used >= cutoff:
+                break
+            del self._threads[key]
+
+    def stats(self):
+        with self._lock:
+            threads = list(self._threads.values())
+            evictions = self.evictions
+        return {"threads": len(threads), "bytes": sum(conversation.size for conversation in threads),
+                "result_sets": sum(len(conversation.results) for conversation in threads),
+                "evictions": evictions, "max_threads": self.max_threads, "max_total_bytes": self.max_total_bytes}
@@ -0,0 +1,267 @@
+"""
+Managed SQLAlchemy engine and connection pool for the Maximo database.
+
+SQLDatabase.from_uri left pooling at SQLAlchemy's defaults, so after an idle
+period the first questions paid for TCP, TLS and the SQL Server login on top of
+their own queries, and a connection dropped by the Azure gateway surfaced as a
+failed query. The engine built here has an explicit pool:
+
+  DB_POOL_SIZE              connections kept open (default 5)
+  DB_MAX_OVERFLOW           extra connections allowed under load (default 10)
+  DB_POOL_TIMEOUT_SECONDS   how long a request waits for a free connection (default 30)
+  DB_POOL_RECYCLE_SECONDS   reconnect connections older than this (default 1800)
+  DB_POOL_PRE_PING          test each connection on checkout and reconnect if dead (default true)
+  DB_POOL_WARM_CONNECTIONS  connections opened at startup (default 2)
+  DB_POOL_KEEPALIVE_SECONDS re-warm the pool this often, 0 to disable (default 240)
+
+Connect latency, checkout wait time and invalidations are recorded per engine
+and reported by pool_status() (the apps' /pool/stats endpoint).
+
+DATABASE_URL overrides the SQL Server connection string. A sqlite:/// URL is
+accepted as a local stand-in: the file is attached as schema 'src' so the
+src.vw_Maximo_* names used by the prompts resolve unchanged.
+"""
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+WARM_CONNECTIONS = int(os.getenv("DB_POOL_WARM_CONNECTIONS", "2"))
+KEEPALIVE_SECONDS = int(os.getenv("DB_POOL_KEEPALIVE_SECONDS", "240"))
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class PoolStats:
+    """
+    Counters for one engine's pool; updated from pool events, read by pool_status().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.connect_seconds_total = 0.0
+        self.connect_seconds_max = 0.0
+        self.last_connect_seconds = None
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.invalidations = 0
+        self.warmups = 0
+        self.last_warmup_seconds = None
+        self.last_warmup_at = None
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self.connects += 1
+            self.connect_seconds_total += seconds
+            self.connect_seconds_max = max(self.connect_seconds_max, seconds)
+            self.last_connect_seconds = seconds
+
+    def record_checkout(self, wait_seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait_seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+
+    def record_invalidation(self):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_warmup(self, seconds):
+        with self._lock:
+            self.warmups += 1
+            self.last_warmup_seconds = seconds
+            self.last_warmup_at = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "connects": self.connects,
+                "connect_seconds_avg": round(self.connect_seconds_total / self.connects, 4) if self.connects else None,
+                "connect_seconds_max": round(self.connect_seconds_max, 4),
+                "last_connect_seconds": round(self.last_connect_seconds, 4)
+                if self.last_connect_seconds is not None else None,
+                "checkouts": self.checkouts,
+                "checkout_wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6)
+                if self.checkouts else None,
+                "checkout_wait_seconds_max": round(self.wait_seconds_max, 4),
+                "invalidations": self.invalidations,
+                "warmups": self.warmups,
+                "last_warmup_seconds": round(self.last_warmup_seconds, 4)
+                if self.last_warmup_seconds is not None else None,
+                "last_warmup_at": self.last_warmup_at,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a connection.
+    Time spent opening a new connection is reported as connect latency, not wait.
+    """
+
+    stats = None
+
+    def _do_get(self):
+        _local.connect_seconds = 0.0
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if self.stats is not None:
+                waited = time.perf_counter() - started - _local.connect_seconds
+                self.stats.record_checkout(max(waited, 0.0))
+
+    def recreate(self):
+        # engine.dispose() replaces the pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def create_maximo_engine(url):
+    """
+    Create the engine for url with the configured pool and metrics listeners.
+    """
+    connect_args = {}
+    sqlite_path = None
+    if url.startswith("sqlite"):
+        sqlite_path = url.split(":///", 1)[1] if ":///" in url else ""
+        if not sqlite_path or sqlite_path == ":memory:":
+            raise ValueError("DATABASE_URL must name a SQLite file to use it as the Maximo stand-in")
+        # Pooled connections are shared between request threads
+        connect_args["check_same_thread"] = False
+
+    engine = create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT_SECONDS,
+        pool_recycle=POOL_RECYCLE_SECONDS,
+        pool_pre_ping=POOL_PRE_PING,
+        connect_args=connect_args,
+    )
+    stats = PoolStats()
+    engine.pool.stats = stats
+    engine.pool_stats = stats
+
+    @event.listens_for(engine, "do_connect")
+    def start_connect(dialect, conn_rec, cargs, cparams):
+        _local.connect_started = time.perf_counter()
+
+    @event.listens_for(engine, "connect")
+    def finish_connect(dbapi_connection, connection_record):
+        if sqlite_path:
+            dbapi_connection.execute(f"ATTACH DATABASE '{sqlite_path}' AS src")
+        started = getattr(_local, "connect_started", None)
+        if started is not None:
+            seconds = time.perf_counter() - started
+            _local.connect_started = None
+            _local.connect_seconds = getattr(_local, "connect_seconds", 0.0) + seconds
+            stats.record_connect(seconds)
+
+    @event.listens_for(engine, "invalidate")
+    def count_invalidation(dbapi_connection, connection_record, exception):
+        stats.record_invalidation()
+
+    return engine
+
+
+def warm_pool(engine, connections=None):
+    """
+    Open (or pre-ping) up to `connections` pooled connections in parallel and
+    return them to the pool, so the next requests skip the connect.
+    Returns the seconds taken.
+    """
+    connections = WARM_CONNECTIONS if connections is None else connections
+    if isinstance(engine.pool, QueuePool):
+        connections = min(connections, engine.pool.size())
+    started = time.perf_counter()
+    if connections <= 0:
+        return 0.0
+    barrier = threading.Barrier(connections)
+    errors = []
+
+    def hold_one():
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                # Hold the connection until every thread has one, so each opens its own
+                barrier.wait(timeout=POOL_TIMEOUT_SECONDS)
+        except threading.BrokenBarrierError:
+            pass
+        except Exception as e:
+            errors.append(e)
+            barrier.abort()
+
+    threads = [threading.Thread(target=hold_one, name=f"pool-warm-{i}", daemon=True) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    seconds = time.perf_counter() - started
+    stats = getattr(engine, "pool_stats", None)
+    if stats is not None:
+        stats.record_warmup(seconds)
+    return seconds
+
+
+def start_keepalive(engine, seconds=None, connections=None):
+    """
+    Re-warm the pool every `seconds` in a daemon thread: idle connections are
+    pinged (and replaced if the server dropped them) before a request needs them.
+    Returns a threading.Event that stops the loop when set.
+    """
+    seconds = KEEPALIVE_SECONDS if seconds is None else seconds
+    stop = threading.Event()
+    if seconds <= 0:
+        return stop
+
+    def keepalive():
+        while not stop.wait(seconds):
+            try:
+                warm_pool(engine, connections)
+            except Exception as e:
+                logger.warning("Connection pool keepalive failed: %s", e)
+
+    threading.Thread(target=keepalive, name="pool-keepalive", daemon=True).start()
+    return stop
+
+
+def pool_status(engine):
+    """
+    Pool occupancy plus the engine's connect / checkout / warm-up statistics.
+    """
+    pool = engine.pool
+    status = {
+        "url": engine.url.render_as_string(hide_password=True),
+        "pool_class": type(pool).__name__,
+    }
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout_seconds": pool.timeout(),
+            "recycle_seconds": pool._recycle,
+            "pre_ping": pool._pre_ping,
+        })
+    stats = getattr(engine, "pool_stats", None)
+    if stats is not None:
+        status.update(stats.snapshot())
+    return status
@@ -0,0 +1,144 @@
+"""
+Deterministic "direct" pipeline: write_query -> execute_query -> generate_answer.
+
+A productionized version of the StateGraph prototyped in LangChainTutorial.py.
+It answers with exactly two LLM calls (one structured-output call for the SQL,
+one for the answer), plus one more if the first query fails and is rewritten
+once. Unlike the ReAct agent it never loops, so latency and token use are
+bounded. If the pipeline cannot produce an answer the app falls back to the agent.
+"""
+import operator
+import uuid
+
+from typing_extensions import Annotated, TypedDict
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langgraph.graph import END, START, StateGraph
+from langgraph.graph.message import add_messages
+
+# One rewrite after a failed execution, then the pipeline gives up
+MAX_QUERY_ATTEMPTS = 2
+
+
+class State(TypedDict):
+    question: str
+    query: str
+    result: str
+    error: str
+    answer: str
+    attempts: int
+    llm_calls: Annotated[int, operator.add]
+    messages: Annotated[list, add_messages]
+
+
+class QueryOutput(TypedDict):
+    """Generated SQL query."""
+
+    query: Annotated[str, ..., "Syntactically valid SQL query."]
+
+
+class DirectPipelineError(Exception):
+    """
+    Raised when the direct pipeline cannot answer, so the caller can fall back to the agent.
+    """
+
+
+def _is_error(result):
+    return isinstance(result, str) and result.startswith("Error:")
+
+
+def build_direct_pipeline(llm, query_tool, query_prompt, table_info, dialect="mssql", top_k=5, examples=None):
+    """
+    Compile the direct pipeline graph.
+
+    query_tool:   the 'sql_db_query' tool, so the direct path shares its cache and safeguards
+    query_prompt: the vendored query-writing prompt with {dialect}, {top_k} and {table_info} placeholders
+    table_info:   callable returning the schema description to put in the prompt for a question
+    examples:     optional callable returning few-shot examples for a question (or None)
+    """
+    structured_llm = llm.with_structured_output(QueryOutput)
+
+    def write_query(state: State):
+        """Generate SQL query to fetch information."""
+        system_message = query_prompt.format(dialect=dialect, top_k=top_k, table_info=table_info(state["question"]))
+        example_text = examples(state["question"]) if examples is not None else None
+        if example_text:
+            system_message += f"\n\n{example_text}"
+        messages = [
+            SystemMessage(content=system_message),
+            HumanMessage(content=f"Question: {state['question']}"),
+        ]
+        if state.get("error"):
+            messages.append(HumanMessage(content=(
+                f"The previous query failed.\nQuery: {state['query']}\n{state['error']}\n"
+                "Write a corrected query."
+            )))
+        result = structured_llm.invoke(messages)
+        query = result["query"]
+        attempts = state.get("attempts", 0) + 1
+        tool_call_id = f"direct-{uuid.uuid4().hex[:12]}"
+        return {
+            "query": query,
+            "attempts": attempts,
+            "llm_calls": 1,
+            "messages": [AIMessage(
+                content="",
+                tool_calls=[{"name": query_tool.name, "args": {"query": query}, "id": tool_call_id}]
+            )],
+        }
+
+    def execute_query(state: State):
+        """Execute SQL query."""
+        tool_call = state["messages"][-1].tool_calls[0]
+        # Invoking with the tool call returns a ToolMessage that keeps the tool's artifact
+        tool_message = query_tool.invoke({**tool_call, "type": "tool_call"})
+        result = tool_message.content
+        return {
+            "result": result,
+            "error": result if _is_error(result) else "",
+            "messages": [tool_message],
+        }
+
+    def generate_answer(state: State):
+        """Answer question using retrieved information as context."""
+        prompt = (
+            "Given the following user question, corresponding SQL query, "
+            "and SQL result, answer the user question.\n\n"
+            f'Question: {state["question"]}\n'
+            f'SQL Query: {state["query"]}\n'
+            f'SQL Result: {state["result"]}'
+        )
+        response = llm.invoke(prompt)
+        return {"answer": response.content, "llm_calls": 1, "messages": [response]}
+
+    def route_after_execution(state: State):
+        if not state["error"]:
+            return "generate_answer"
+        if state["attempts"] < MAX_QUERY_ATTEMPTS:
+            return "write_query"
+        return END
+
+    graph_builder = StateGraph(State)
+    graph_builder.add_node("write_query", write_query)
+    graph_builder.add_node("execute_query", execute_query)
+    graph_builder.add_node("generate_answer", generate_answer)
+    graph_builder.add_edge(START, "write_query")
+    graph_builder.add_edge("write_query", "execute_query")
+    graph_builder.add_conditional_edges("execute_query", route_after_execution)
+    graph_builder.add_edge("generate_answer", END)
+    return graph_builder.compile()
+
+
+def initial_state(question):
+    """
+    Input for the direct pipeline graph.
+    """
+    return {
+        "question": question,
+        "query": "",
+        "result": "",
+        "error": "",
+        "answer": "",
+        "attempts": 0,
+        "llm_calls": 0,
+        "messages": [HumanMessage(content=question)],
+    }
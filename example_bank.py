@@ -0,0 +1,209 @@
+"""
+Few-shot example bank: verified question -> SQL pairs retrieved per question.
+
+The runs recorded in LangChainTutorial.py are a curated set of questions with
+the SQL that answered them, including the mistakes made on the way (joining
+the location views on location_id). The bank puts that knowledge in front of
+the model: for each question the top-k most similar examples are appended to
+the system prompt (agent) or the query-writing prompt (direct pipeline).
+
+  - seed:      prompts/few_shot_examples.v1.json (vendored, read-only)
+  - additions: EXAMPLE_BANK_PATH, one JSON object per line; POST /examples and,
+               with EXAMPLE_BANK_LEARN=true, every answered question whose SQL ran
+               without an error append to it
+  - index:     TF-IDF over word unigrams and bigrams, kept as an L2-normalised
+               NumPy matrix; a search is one matrix-vector product (a batch of
+               questions, one matrix product), so it costs microseconds next to an LLM call
+
+The examples go at the end of the system message, after the schema, so the
+static prefix of the prompt stays the same across questions for OpenAI's prompt caching.
+
+Settings (agent_runtime._build_example_bank):
+  EXAMPLE_BANK_ENABLED         'true' (default) or 'false'
+  EXAMPLE_BANK_PATH            appended examples (default example_bank.jsonl)
+  EXAMPLE_BANK_TOP_K           examples per question (default 3)
+  EXAMPLE_BANK_MIN_SIMILARITY  cosine similarity below which an example is not used (default 0.2)
+  EXAMPLE_BANK_LEARN           append successful production runs (default false)
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+SEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts", "few_shot_examples.v1.json")
+
+# Words that say nothing about which SQL a question needs
+STOP_WORDS = frozenset(
+    "a an and are as at be by can do does for from give has have how i in is it me of on or please "
+    "provide show tell that the their there these this to was were what which who with you".split())
+
+# Location codes (04.07.30.02.01) and asset numbers stay single tokens
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[._][a-z0-9]+)*")
+
+
+def _fold_plural(word):
+    # "assets" and "asset" should match; a crude rule, applied alike to questions and examples
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss") and not word[0].isdigit():
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """
+    Lower-cased words without stop words and plural 's', followed by their bigrams.
+    """
+    words = [_fold_plural(word) for word in _TOKEN_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+def _normalise_question(question):
+    return " ".join(question.lower().split()).rstrip(" ?")
+
+
+class ExampleBank:
+    """
+    The examples and their TF-IDF index. Searches and additions are thread-safe.
+    """
+
+    def __init__(self, path=None, seed_path=SEED_PATH, top_k=3, min_similarity=0.2, learn=False):
+        self.path = path
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.learn = learn
+        self._lock = threading.Lock()
+        self.examples = []
+        if seed_path and os.path.exists(seed_path):
+            with open(seed_path, encoding="utf-8") as seed_file:
+                self.examples.extend(json.load(seed_file))
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as bank_file:
+                self.examples.extend(json.loads(line) for line in bank_file if line.strip())
+        self._build_index()
+
+    def _build_index(self):
+        documents = [Counter(tokenize(example["question"])) for example in self.examples]
+        document_frequency = Counter(term for document in documents for term in document)
+        vocabulary = {term: column for column, term in enumerate(sorted(document_frequency))}
+        count = len(documents)
+        idf = np.array([math.log((1 + count) / (1 + document_frequency[term])) + 1 for term in vocabulary])
+        matrix = np.zeros((count, len(vocabulary)), dtype=np.float32)
+        for row, document in enumerate(documents):
+            for term, frequency in document.items():
+                matrix[row, vocabulary[term]] = (1 + math.log(frequency)) * idf[vocabulary[term]]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        self._vocabulary = vocabulary
+        self._idf = idf
+        self._matrix = matrix
+        self._questions = {_normalise_question(example["question"]): example for example in self.examples}
+
+    def _vectors(self, questions):
+        vectors = np.zeros((len(questions), len(self._vocabulary)), dtype=np.float32)
+        for row, question in enumerate(questions):
+            for term, frequency in Counter(tokenize(question)).items():
+                column = self._vocabulary.get(term)
+                if column is not None:
+                    vectors[row, column] = (1 + math.log(frequency)) * self._idf[column]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def search_many(self, questions, top_k=None):
+        """
+        For each question, the [(similarity, example), ...] of its most similar examples, best first.
+        """
+        top_k = self.top_k if top_k is None else top_k
+        with self._lock:
+            if not self.examples or not questions:
+                return [[] for _question in questions]
+            # One (questions x examples) product for the whole batch
+            similarities = self._vectors(questions) @ self._matrix.T
+            examples = list(self.examples)
+        results = []
+        for row in similarities:
+            best = np.argsort(-row, kind="stable")[:top_k]
+            results.append([(float(row[index]), examples[index]) for index in best
+                            if row[index] >= self.min_similarity])
+        return results
+
+    def search(self, question, top_k=None):
+        return self.search_many([question], top_k)[0]
+
+    def add(self, question, sql, note=None, source="production"):
+        """
+        Append an example to the bank file and the index. Returns False, adding nothing, if the
+        bank already has this question with the same SQL or, for a learned example, at all.
+        """
+        example = {"question": question.strip(), "sql": sql.strip(), "source": source, "added": int(time.time())}
+        if note:
+            example["note"] = note
+        with self._lock:
+            existing = self._questions.get(_normalise_question(question))
+            if existing is not None and (source == "production" or
+                                         " ".join(existing["sql"].split()) == " ".join(example["sql"].split())):
+                return False
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as bank_file:
+                    bank_file.write(json.dumps(example) + "\n")
+            self.examples.append(example)
+            self._build_index()
+        return True
+
+    def learn_from_run(self, question, messages):
+        """
+        With learning on, add the question and the SQL that answered it after a successful run.
+        """
+        if not self.learn:
+            return False
+        sql = successful_sql(messages)
+        return bool(sql) and self.add(question, sql)
+
+    def render(self, question):
+        """
+        Prompt text with the examples most similar to question, or None if none are similar enough.
+        """
+        return self._render(self.search(question))
+
+    def render_many(self, questions):
+        """
+        render() for a batch of questions, from a single search: {question: text or None}.
+        """
+        return {question: self._render(matches) for question, matches in zip(questions, self.search_many(questions))}
+
+    def _render(self, matches):
+        if not matches:
+            return None
+        lines = ["Examples of verified questions and the SQL that answered them on this database "
+                 "(adapt them; do not copy values that the question does not mention):"]
+        for _similarity, example in matches:
+            block = f"Question: {example['question']}\nSQL: {example['sql']}"
+            if example.get("note"):
+                block += f"\nNote: {example['note']}"
+            lines.append(block)
+        return "\n\n".join(lines)
+
+    def stats(self):
+        with self._lock:
+            sources = Counter(example.get("source", "unknown") for example in self.examples)
+            return {"examples": len(self.examples), "by_source": dict(sources), "terms": len(self._vocabulary)}
+
+
+def successful_sql(messages):
+    """
+    The statement of the last sql_db_query call in a run, if that call returned rows
+    rather than an error; None otherwise.
+    """
+    results = {message.tool_call_id: message for message in messages if message.type == "tool"}
+    for message in reversed(messages):
+        for tool_call in reversed(getattr(message, "tool_calls", None) or []):
+            if tool_call["name"] != "sql_db_query":
+                continue
+            result = results.get(tool_call["id"])
+            if result is None or str(result.content).startswith("Error:"):
+                return None
+            return tool_call["args"].get("query")
+    return None
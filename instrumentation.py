@@ -0,0 +1,359 @@
+"""
+Per-request tracing and Prometheus metrics for the answering paths.
+
+Each /ask run gets a RequestTrace that records, while the graph runs:
+  - every LLM call: model, latency, prompt and completion tokens
+  - every tool call: tool name, duration, whether it failed
+  - every SQL statement sent to the Maximo engine: execute time and, for
+    queries read by the QueryExecutor, the row count and total fetch time
+  - the number of agent iterations (LLM turns)
+  - the schema context its prompts were given: pruned or full, and its approximate
+    tokens next to the full schema's (schema_context)
+
+LLM and tool calls come from a LangChain callback handler passed to
+stream/astream. SQL statements come from SQLAlchemy cursor events on the
+engine and are attributed to the request through a context variable, which
+LangGraph and the SQL executor carry into their worker threads.
+
+Everything is observed into prometheus_client histograms in this process and
+exposed by the apps' /metrics endpoint; no tracing service is needed. With
+"trace": true in the request body (or TRACE_IN_RESPONSE=true) the breakdown is
+also returned in the response metadata.
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+import uuid
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+
+TRACE_IN_RESPONSE = os.getenv("TRACE_IN_RESPONSE", "false").lower() == "true"
+
+# Longest SQL statement kept in a trace; the metrics never carry statement text
+TRACE_STATEMENT_CHARS = 500
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+ITERATION_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30)
+
+REQUEST_SECONDS = Histogram(
+    "maximo_request_seconds", "Time to answer a question", ["path"], buckets=SECONDS_BUCKETS)
+AGENT_ITERATIONS = Histogram(
+    "maximo_agent_iterations", "LLM turns per answered question", ["path"], buckets=ITERATION_BUCKETS)
+LLM_SECONDS = Histogram(
+    "maximo_llm_call_seconds", "LLM call latency", ["model"], buckets=SECONDS_BUCKETS)
+LLM_PROMPT_TOKENS = Histogram(
+    "maximo_llm_prompt_tokens", "Prompt tokens per LLM call", ["model"], buckets=TOKEN_BUCKETS)
+LLM_COMPLETION_TOKENS = Histogram(
+    "maximo_llm_completion_tokens", "Completion tokens per LLM call", ["model"], buckets=TOKEN_BUCKETS)
+LLM_ERRORS = Counter(
+    "maximo_llm_errors", "LLM calls that raised", ["model"])
+TOOL_SECONDS = Histogram(
+    "maximo_tool_call_seconds", "Tool call duration", ["tool", "status"], buckets=SECONDS_BUCKETS)
+SQL_EXECUTE_SECONDS = Histogram(
+    "maximo_sql_execute_seconds", "Time for the database to execute a statement (to the first row)",
+    buckets=SECONDS_BUCKETS)
+SQL_FETCH_SECONDS = Histogram(
+    "maximo_sql_fetch_seconds", "Execute plus fetch time of sql_db_query statements", buckets=SECONDS_BUCKETS)
+SQL_ROWS = Histogram(
+    "maximo_sql_rows", "Rows read per sql_db_query statement", buckets=ROW_BUCKETS)
+QUERY_GUARD_DECISIONS = Counter(
+    "maximo_query_guard_decisions", "sql_db_query statements allowed, limited or rejected by the cost guard",
+    ["action"])
+SQL_REWRITES = Counter(
+    "maximo_sql_rewrites", "Predicates of sql_db_query statements rewritten to be index-friendly", ["rule"])
+
+REQUESTS_CANCELLED = Counter(
+    "maximo_requests_cancelled", "Questions abandoned before their answer was complete", ["reason"])
+SINGLEFLIGHT_REQUESTS = Counter(
+    "maximo_singleflight_requests", "Questions that ran (leader) or waited on an identical question's run "
+    "in this process (follower) or another worker (remote)", ["role"])
+SINGLEFLIGHT_RUNS_SAVED = Counter(
+    "maximo_singleflight_runs_saved", "Questions answered from an identical concurrent question's run")
+BATCH_QUESTIONS = Counter(
+    "maximo_batch_questions", "Questions of /ask/batch requests by outcome", ["outcome"])
+SCHEMA_CONTEXT_TOKENS = Histogram(
+    "maximo_schema_context_tokens", "Approximate tokens of the schema sent with a question",
+    ["context"], buckets=TOKEN_BUCKETS)
+
+_current_trace = contextvars.ContextVar("maximo_request_trace", default=None)
+
+
+class RequestTrace:
+    """
+    Timings collected for one request. Appended to from the request's worker
+    threads, so every mutation takes the lock.
+    """
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.llm_calls = []
+        self.tool_calls = []
+        self.sql = []
+        self.schema_context = None
+        self._lock = threading.Lock()
+        self._token = None
+
+    def start(self):
+        """
+        Make this the current trace for the calling context.
+        """
+        self._token = _current_trace.set(self)
+        return self
+
+    def stop(self):
+        if self._token is not None:
+            try:
+                _current_trace.reset(self._token)
+            except ValueError:
+                # Reset from a different context than start(); that context is discarded anyway
+                pass
+            self._token = None
+
+    def _offset(self):
+        return round(time.perf_counter() - self.started, 4)
+
+    def add_llm_call(self, model, seconds, prompt_tokens, completion_tokens, error=None):
+        entry = {"model": model, "at": self._offset(), "seconds": round(seconds, 4),
+                 "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        if error:
+            entry["error"] = error
+        with self._lock:
+            self.llm_calls.append(entry)
+
+    def add_tool_call(self, name, seconds, error=None):
+        entry = {"tool": name, "at": self._offset(), "seconds": round(seconds, 4)}
+        if error:
+            entry["error"] = error
+        with self._lock:
+            self.tool_calls.append(entry)
+
+    def add_statement(self, statement, seconds):
+        entry = {"statement": statement[:TRACE_STATEMENT_CHARS], "at": self._offset(),
+                 "execute_seconds": round(seconds, 4), "rows": None}
+        with self._lock:
+            self.sql.append(entry)
+        return entry
+
+    def set_schema_context(self, stats):
+        """
+        Keep the first schema context of the request; returns False if it already has one.
+        """
+        with self._lock:
+            if self.schema_context is not None:
+                return False
+            self.schema_context = dict(stats)
+            return True
+
+    def summary(self, iterations):
+        """
+        The per-request breakdown returned in the response metadata.
+        """
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "iterations": iterations,
+                "llm_seconds": round(sum(call["seconds"] for call in self.llm_calls), 4),
+                "prompt_tokens": sum(call["prompt_tokens"] or 0 for call in self.llm_calls),
+                "completion_tokens": sum(call["completion_tokens"] or 0 for call in self.llm_calls),
+                "schema_context": self.schema_context,
+                "tool_seconds": round(sum(call["seconds"] for call in self.tool_calls), 4),
+                "sql_seconds": round(sum(s["fetch_seconds"] if "fetch_seconds" in s else s["execute_seconds"]
+                                         for s in self.sql), 4),
+                "llm_calls": list(self.llm_calls),
+                "tool_calls": list(self.tool_calls),
+                "sql": list(self.sql),
+            }
+
+    def finish(self, path, iterations, elapsed_seconds):
+        """
+        Observe the request-level histograms.
+        """
+        REQUEST_SECONDS.labels(path or "unknown").observe(elapsed_seconds)
+        AGENT_ITERATIONS.labels(path or "unknown").observe(iterations)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def copy_context_call(fn, *args):
+    """
+    Wrap fn(*args) to run in a copy of the caller's context, so work handed to
+    a thread pool (e.g. the SQL executor) stays attributed to the request.
+    """
+    return functools.partial(contextvars.copy_context().run, fn, *args)
+
+
+def record_sql_result(rows, seconds):
+    """
+    Called by the QueryExecutor once a statement's rows have been read.
+    """
+    SQL_ROWS.observe(rows)
+    SQL_FETCH_SECONDS.observe(seconds)
+    trace = _current_trace.get()
+    if trace is not None and trace.sql:
+        with trace._lock:
+            trace.sql[-1]["rows"] = rows
+            trace.sql[-1]["fetch_seconds"] = round(seconds, 4)
+
+
+def record_guard_decision(action):
+    QUERY_GUARD_DECISIONS.labels(action).inc()
+
+
+def record_sql_rewrite(rule):
+    SQL_REWRITES.labels(rule).inc()
+
+
+def record_cancellation(reason):
+    REQUESTS_CANCELLED.labels(reason).inc()
+
+
+def record_singleflight(role):
+    SINGLEFLIGHT_REQUESTS.labels(role).inc()
+
+
+def record_run_saved():
+    SINGLEFLIGHT_RUNS_SAVED.inc()
+
+
+def record_batch_question(outcome):
+    BATCH_QUESTIONS.labels(outcome).inc()
+
+
+def record_schema_context(stats):
+    """
+    Called whenever a prompt is given its schema; observed once per request (the agent's
+    prompt is rebuilt every turn), and not outside a request.
+    """
+    trace = _current_trace.get()
+    if stats is None or trace is None:
+        return
+    if trace.set_schema_context(stats):
+        SCHEMA_CONTEXT_TOKENS.labels(stats["context"]).observe(stats["tokens"])
+
+
+def instrument_engine(engine):
+    """
+    Time every statement executed on engine while a request trace is active.
+    Statements outside a request (pool warm-up, rollup refreshes) are not recorded.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current_trace.get() is not None:
+            conn.info.setdefault("trace_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = _current_trace.get()
+        started = conn.info.get("trace_started")
+        if trace is None or not started:
+            return
+        seconds = time.perf_counter() - started.pop()
+        SQL_EXECUTE_SECONDS.observe(seconds)
+        trace.add_statement(statement, seconds)
+
+    return engine
+
+
+def _token_usage(response):
+    """
+    (prompt_tokens, completion_tokens) from an LLMResult, streamed or not.
+    """
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+
+@functools.lru_cache(maxsize=None)
+def _handler_class():
+    # Built on first use so importing this module does not import LangChain
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TraceCallbackHandler(BaseCallbackHandler):
+        """
+        Records LLM and tool calls of one run into its RequestTrace and the histograms.
+        """
+
+        # Runs on the event loop in the async path; the handler only appends to lists
+        run_inline = True
+
+        def __init__(self, trace):
+            self.trace = trace
+            self._started = {}
+
+        def _start(self, run_id, label):
+            self._started[run_id] = (time.perf_counter(), label)
+
+        def _stop(self, run_id):
+            started, label = self._started.pop(run_id, (None, None))
+            return (time.perf_counter() - started if started is not None else 0.0), label
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+            self._start(run_id, _model_name(serialized, metadata, kwargs))
+
+        def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+            self._start(run_id, _model_name(serialized, metadata, kwargs))
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            seconds, model = self._stop(run_id)
+            prompt_tokens, completion_tokens = _token_usage(response)
+            LLM_SECONDS.labels(model).observe(seconds)
+            if prompt_tokens is not None:
+                LLM_PROMPT_TOKENS.labels(model).observe(prompt_tokens)
+            if completion_tokens is not None:
+                LLM_COMPLETION_TOKENS.labels(model).observe(completion_tokens)
+            self.trace.add_llm_call(model, seconds, prompt_tokens, completion_tokens)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            seconds, model = self._stop(run_id)
+            LLM_ERRORS.labels(model).inc()
+            self.trace.add_llm_call(model, seconds, None, None, error=str(error))
+
+        def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+            self._start(run_id, (serialized or {}).get("name") or kwargs.get("name") or "unknown")
+
+        def on_tool_end(self, output, *, run_id, **kwargs):
+            seconds, name = self._stop(run_id)
+            content = getattr(output, "content", output)
+            failed = isinstance(content, str) and content.startswith("Error:")
+            TOOL_SECONDS.labels(name, "error" if failed else "ok").observe(seconds)
+            self.trace.add_tool_call(name, seconds, error=content[:200] if failed else None)
+
+        def on_tool_error(self, error, *, run_id, **kwargs):
+            seconds, name = self._stop(run_id)
+            TOOL_SECONDS.labels(name, "error").observe(seconds)
+            self.trace.add_tool_call(name, seconds, error=str(error))
+
+    return TraceCallbackHandler
+
+
+def _model_name(serialized, metadata, kwargs):
+    params = kwargs.get("invocation_params") or {}
+    return (params.get("model") or params.get("model_name") or (metadata or {}).get("ls_model_name")
+            or (serialized or {}).get("name") or "unknown")
+
+
+def callback_handler(trace):
+    """
+    A LangChain callback handler feeding trace.
+    """
+    return _handler_class()(trace)
+
+
+def metrics_response():
+    """
+    (body, content_type) for the /metrics endpoint.
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,344 @@
+"""
+Bounded, streaming execution of the agent's SQL queries.
+
+SQLDatabase.run fetches the whole result, turns it into one str(list_of_tuples)
+and hands that to the LLM, so "list all work orders at Hamilton Township" pulled
+tens of thousands of rows into memory several times over. QueryExecutor instead
+reads the result in fetchmany batches from a streaming cursor and:
+  - gives the model a preview of at most SQL_PREVIEW_ROWS rows / SQL_PREVIEW_BYTES
+    characters, plus the total row count
+  - writes the full result to a CSV spill file (created only when the preview is
+    truncated) that clients download from /results/<spill_id>
+  - stops reading at SQL_MAX_ROWS rows or SQL_MAX_BYTES bytes
+  - cancels the query after SQL_QUERY_TIMEOUT_SECONDS, or as soon as the
+    request it runs for is cancelled (cancellation)
+The preview is formatted exactly like SQLDatabase.run, so untruncated results
+look the same to the agent as before.
+
+Alongside the text the executor keeps the first SQL_ARTIFACT_MAX_ROWS rows in
+column-oriented form with their types (QueryResult.to_artifact). sql_db_query
+returns that as its tool message artifact, which the visualization layer reads
+directly instead of re-parsing the text.
+"""
+import csv
+import datetime
+import decimal
+import os
+import re
+import threading
+import time
+import uuid
+
+from langchain_community.utilities.sql_database import truncate_word
+
+from cancellation import RequestCancelled, current_token
+from instrumentation import record_sql_result
+
+SPILL_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Artifact type names for the Python types DB-API drivers return (bool before int: bool is an int)
+_TYPE_NAMES = (
+    (bool, "boolean"),
+    (int, "integer"),
+    (float, "float"),
+    (decimal.Decimal, "decimal"),
+    (datetime.datetime, "datetime"),
+    (datetime.date, "date"),
+    (datetime.time, "time"),
+    (str, "string"),
+    ((bytes, bytearray), "binary"),
+)
+
+
+def column_type(type_code, values):
+    """
+    Type name for a result column: from the driver's type_code when it is a
+    Python type (pyodbc), otherwise from the first non-NULL value (sqlite3).
+    """
+    if not isinstance(type_code, type):
+        type_code = next((type(value) for value in values if value is not None), None)
+    if type_code is None:
+        return "null"
+    for python_type, name in _TYPE_NAMES:
+        if issubclass(type_code, python_type):
+            return name
+    return "string"
+
+
+class QueryResult:
+    """
+    Outcome of one query: the preview rows and how much of the result they cover.
+    """
+
+    def __init__(self, columns, preview, row_count, truncated, complete, stop_reason=None, spill_id=None,
+                 types=None, data=None):
+        self.columns = columns
+        self.types = types or []
+        # Column-oriented values of the first artifact_max_rows rows
+        self.data = data or []
+        self.preview = preview
+        self.row_count = row_count
+        self.truncated = truncated
+        self.complete = complete
+        self.stop_reason = stop_reason
+        self.spill_id = spill_id
+
+    def to_text(self):
+        """
+        Tool output for the model: the preview rows, followed by a note when they are not the whole result.
+        """
+        text = str(self.preview) if self.preview else ""
+        if not self.truncated:
+            return text
+        total = f"{self.row_count:,}" if self.complete else f"at least {self.row_count:,}"
+        note = f"(Showing the first {len(self.preview):,} of {total} rows."
+        if not self.complete:
+            note += f" Reading stopped at the {self.stop_reason}."
+        if self.spill_id:
+            note += f" The full result can be downloaded from /results/{self.spill_id}."
+        note += " Aggregate in SQL instead of listing rows where possible.)"
+        return f"{text}\n\n{note}"
+
+    def to_artifact(self):
+        """
+        Typed, column-oriented result for the visualization layer.
+        """
+        artifact_rows = len(self.data[0]) if self.data else 0
+        return {
+            "columns": self.columns,
+            "types": self.types,
+            "data": self.data,
+            "row_count": self.row_count,
+            # False when data holds fewer rows than the query returned
+            "complete": self.complete and artifact_rows == self.row_count,
+            "spill_id": self.spill_id,
+        }
+
+
+class QueryExecutor:
+    """
+    Runs read queries against an engine with row, byte and time limits.
+    """
+
+    def __init__(self, engine, preview_rows=50, preview_bytes=8000, max_rows=200000,
+                 max_bytes=64 * 1024 * 1024, timeout_seconds=60, spill_dir="query_results",
+                 spill_max_age_seconds=3600, batch_size=1000, max_string_length=300, artifact_max_rows=50000):
+        self.engine = engine
+        self.preview_rows = preview_rows
+        self.preview_bytes = preview_bytes
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.timeout_seconds = timeout_seconds
+        self.spill_dir = spill_dir
+        self.spill_max_age_seconds = spill_max_age_seconds
+        self.batch_size = batch_size
+        self.max_string_length = max_string_length
+        self.artifact_max_rows = artifact_max_rows
+
+    def run_no_throw(self, sql):
+        """
+        Same contract as SQLDatabase.run_no_throw: the result text, or 'Error: ...'.
+        """
+        return self.run_with_artifact(sql)[0]
+
+    def run_with_artifact(self, sql):
+        """
+        Return (text, artifact); on failure ('Error: ...', None).
+        """
+        try:
+            result = self.run(sql)
+        except Exception as e:
+            return f"Error: {e}", None
+        return result.to_text(), result.to_artifact()
+
+    def run(self, sql):
+        """
+        Execute sql and return a QueryResult; raises on database errors and timeouts.
+        """
+        from sqlalchemy import event, text
+
+        timed_out = threading.Event()
+        started = time.perf_counter()
+        cancel_token = current_token()
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+        with self.engine.connect() as connection:
+            dbapi_connection = connection.connection.dbapi_connection
+            cursor_holder = []
+
+            def hold_cursor(_connection, cursor, *_args):
+                # Taken before the driver executes: pyodbc can only cancel a statement
+                # through its cursor, and execute() does not return until the statement has run
+                cursor_holder[:] = [cursor]
+
+            event.listen(connection, "before_cursor_execute", hold_cursor)
+            timer = None
+            remove_cancel_callback = None
+            remove_progress_check = None
+            if cancel_token is not None:
+                remove_cancel_callback = cancel_token.on_cancel(
+                    lambda: _cancel(dbapi_connection, cursor_holder[0] if cursor_holder else None))
+                remove_progress_check = _check_cancel_progress(dbapi_connection, cancel_token)
+            if self.timeout_seconds:
+                if hasattr(dbapi_connection, "timeout"):
+                    # pyodbc: the driver enforces the timeout itself while the statement executes
+                    dbapi_connection.timeout = self.timeout_seconds
+
+                def cancel():
+                    timed_out.set()
+                    _cancel(dbapi_connection, cursor_holder[0] if cursor_holder else None)
+
+                timer = threading.Timer(self.timeout_seconds, cancel)
+                timer.daemon = True
+                timer.start()
+            try:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                result = connection.execution_options(stream_results=True).execute(text(sql))
+                query_result = self._read(result, timed_out, cancel_token)
+            except Exception:
+                if timed_out.is_set():
+                    connection.invalidate()
+                    raise TimeoutError(f"Query cancelled after {self.timeout_seconds} seconds. "
+                                       "Simplify it or add filters.") from None
+                if cancel_token is not None and cancel_token.cancelled:
+                    connection.invalidate()
+                    raise RequestCancelled(f"Query cancelled: request {cancel_token.request_id} "
+                                           f"was cancelled ({cancel_token.reason})") from None
+                raise
+            finally:
+                event.remove(connection, "before_cursor_execute", hold_cursor)
+                if timer is not None:
+                    timer.cancel()
+                if remove_cancel_callback is not None:
+                    remove_cancel_callback()
+                if remove_progress_check is not None:
+                    remove_progress_check()
+            if not query_result.complete:
+                # Unread rows may still be on the wire; don't return this connection to the pool
+                connection.invalidate()
+            record_sql_result(query_result.row_count, time.perf_counter() - started)
+            return query_result
+
+    def _read(self, result, timed_out, cancel_token=None):
+        if not result.returns_rows:
+            return QueryResult([], [], 0, False, True)
+
+        columns = list(result.keys())
+        # Read before fetching: the cursor is released once the rows are exhausted
+        description = getattr(getattr(result, "cursor", None), "description", None) or []
+        type_codes = [column[1] for column in description] if len(description) == len(columns) else [None] * len(columns)
+        data = [[] for _column in columns]
+        preview = []
+        # Untruncated copies of the preview rows, for the spill file
+        preview_source = []
+        preview_size = 2
+        row_count = 0
+        byte_count = 0
+        truncated = False
+        stop_reason = None
+        spill = None
+        try:
+            while stop_reason is None:
+                batch = result.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                for row in batch:
+                    if row_count >= self.max_rows:
+                        stop_reason = f"{self.max_rows:,} row limit"
+                    elif byte_count >= self.max_bytes:
+                        stop_reason = f"{self.max_bytes:,} byte limit"
+                    if stop_reason:
+                        break
+                    preview_row = tuple(truncate_word(value, length=self.max_string_length) for value in row)
+                    row_size = len(str(preview_row)) + 2
+                    row_count += 1
+                    byte_count += row_size
+                    if row_count <= self.artifact_max_rows:
+                        for values, value in zip(data, row):
+                            values.append(value)
+                    if not truncated and len(preview) < self.preview_rows \
+                            and preview_size + row_size <= self.preview_bytes:
+                        preview.append(preview_row)
+                        preview_source.append(tuple(row))
+                        preview_size += row_size
+                        continue
+                    if not truncated:
+                        truncated = True
+                        spill = self._open_spill(columns, preview_source)
+                    spill[1].writerow(row)
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if timed_out.is_set() and stop_reason is None:
+                    stop_reason = f"{self.timeout_seconds} second time limit"
+        finally:
+            if spill is not None:
+                spill[0].close()
+
+        if stop_reason is not None:
+            # Rows beyond the limit are not read, so the total is a lower bound
+            truncated = True
+        types = [column_type(type_code, values) for type_code, values in zip(type_codes, data)]
+        return QueryResult(columns, preview, row_count, truncated, stop_reason is None, stop_reason,
+                           spill[2] if spill is not None else None, types, data)
+
+    def _open_spill(self, columns, rows):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self._remove_expired_spills()
+        spill_id = uuid.uuid4().hex
+        spill_file = open(self.spill_path(spill_id), "w", newline="", encoding="utf-8")
+        writer = csv.writer(spill_file)
+        writer.writerow(columns)
+        writer.writerows(rows)
+        return spill_file, writer, spill_id
+
+    def spill_path(self, spill_id):
+        """
+        Path of the CSV file for spill_id, or None if the id is malformed.
+        """
+        if not SPILL_ID_PATTERN.match(spill_id):
+            return None
+        return os.path.join(self.spill_dir, f"{spill_id}.csv")
+
+    def _remove_expired_spills(self):
+        cutoff = time.time() - self.spill_max_age_seconds
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if name.endswith(".csv") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _check_cancel_progress(dbapi_connection, cancel_token):
+    """
+    sqlite3: abort the statement at its next progress check once cancel_token is cancelled.
+    interrupt() only reaches a statement already running, so a cancel landing before
+    execute() starts it would otherwise be lost. Returns a function that removes the check.
+    """
+    if not hasattr(dbapi_connection, "set_progress_handler"):
+        return lambda: None
+    dbapi_connection.set_progress_handler(lambda: cancel_token.cancelled, 10000)
+
+    def remove():
+        try:
+            dbapi_connection.set_progress_handler(None, 0)
+        except Exception:
+            # Closed by connection.invalidate(); the handler went with it
+            pass
+
+    return remove
+
+
+def _cancel(dbapi_connection, cursor):
+    """
+    Abort a running statement: pyodbc cancels the cursor, sqlite3 interrupts the connection.
+    """
+    try:
+        if cursor is not None and hasattr(cursor, "cancel"):
+            cursor.cancel()
+        elif hasattr(dbapi_connection, "interrupt"):
+            dbapi_connection.interrupt()
+    except Exception:
+        pass
@@ -0,0 +1,262 @@
+"""
+Pre-execution cost guard for sql_db_query.
+
+The agent can write queries that are fine as SQL but far too expensive to run
+on production: a DISTINCT over every work order, or a join across all three
+views without a filter. Before a query reaches the QueryExecutor, the guard:
+
+  1. asks the database for the query's estimated plan, without running it
+       - SQL Server: SET SHOWPLAN_XML ON; the statement's StatementSubTreeCost
+         and StatementEstRows
+       - SQLite (the local stand-in): EXPLAIN QUERY PLAN; the cost is the product
+         of the row counts of the tables it has to SCAN (not SEARCH by index)
+  2. rejects the query if the estimate is above the limit, with a structured
+     error the agent can act on (which limit, the estimate, how to fix it)
+  3. otherwise adds TOP <row_limit> to a query that has no TOP / FETCH and may
+     return more rows than that, so the server stops producing rows at the
+     limit instead of the app discarding them after the fact
+
+Execution itself stays bounded by the QueryExecutor: a statement timeout
+(SQL_QUERY_TIMEOUT_SECONDS) after which the query is cancelled on the server
+and its connection discarded.
+
+Settings (agent_runtime._build_query_guard):
+  SQL_GUARD                 'on' (default) or 'off'
+  SQL_GUARD_MAX_COST        SQL Server estimated subtree cost above which a query is rejected (default 500)
+  SQL_GUARD_MAX_SCAN_ROWS   SQLite stand-in: estimated rows scanned above which a query is rejected
+  SQL_GUARD_ROW_LIMIT       TOP added to queries without one (default 10000)
+"""
+import logging
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, SqlglotError
+from sqlglot.tokens import TokenType
+
+SHOWPLAN_NAMESPACE = "{http://schemas.microsoft.com/sqlserver/2004/07/showplan}"
+
+# Table sizes for the SQLite estimate are re-counted after this many seconds
+TABLE_ROWS_MAX_AGE_SECONDS = 600
+
+logger = logging.getLogger(__name__)
+
+
+class GuardDecision:
+    """
+    Outcome of QueryGuard.check: the SQL to run (possibly with a TOP added) or an error.
+    """
+
+    def __init__(self, sql, cost=None, estimated_rows=None, limited=False, error=None, code=None):
+        self.sql = sql
+        self.cost = cost
+        self.estimated_rows = estimated_rows
+        self.limited = limited
+        self.error = error
+        self.code = code
+
+    @property
+    def action(self):
+        if self.error:
+            return "reject"
+        return "limit" if self.limited else "allow"
+
+
+def _format_number(value):
+    return f"{value:,.0f}" if value >= 100 else f"{value:,.1f}"
+
+
+def rejection_message(code, estimate, limit, estimated_rows=None):
+    """
+    The 'Error: ...' text returned to the agent for a rejected query.
+    """
+    what = "estimated cost" if code == "cost_limit" else "estimated rows scanned"
+    rows = f", estimated result rows {_format_number(estimated_rows)}" if estimated_rows is not None else ""
+    return (
+        f"Error: Query rejected by the cost guard ({code}): {what} {_format_number(estimate)} exceeds the limit "
+        f"of {_format_number(limit)}{rows}. The query was not run. Narrow it before retrying: filter on "
+        "statusdate or another indexed column, aggregate with GROUP BY instead of returning rows, and join the "
+        "views only on the documented keys."
+    )
+
+
+def add_row_limit(sql, row_limit):
+    """
+    Return sql with TOP row_limit added to the outer SELECT, or None if it
+    already has a TOP / FETCH, returns a single aggregate row, or is not a plain SELECT.
+
+    TOP is inserted into the query's own text: sqlglot's T-SQL output is not
+    always the query it read (DATENAME() comes back as FORMAT(), SYSDATETIME()
+    as GETDATE()). A query the insertion would not limit as intended is left alone.
+    """
+    try:
+        tree = sqlglot.parse_one(sql, read="tsql")
+    except ParseError:
+        return None
+    if not isinstance(tree, exp.Select) or tree.args.get("limit") or tree.args.get("fetch"):
+        return None
+    aggregate_only = not tree.args.get("group") and tree.expressions and all(
+        isinstance(expression.unalias(), exp.AggFunc) for expression in tree.expressions)
+    if aggregate_only:
+        return None
+
+    # The outer SELECT is the first one outside parentheses (CTE bodies and subqueries are inside)
+    try:
+        tokens = sqlglot.Dialect.get_or_raise("tsql").tokenize(sql)
+    except SqlglotError:
+        return None
+    depth, position = 0, None
+    for index, token in enumerate(tokens):
+        if token.token_type == TokenType.L_PAREN:
+            depth += 1
+        elif token.token_type == TokenType.R_PAREN:
+            depth -= 1
+        elif token.token_type == TokenType.SELECT and depth == 0:
+            following = tokens[index + 1] if index + 1 < len(tokens) else None
+            keyword = following if following is not None and following.token_type in (TokenType.DISTINCT, TokenType.ALL) else token
+            position = keyword.end + 1
+            break
+    if position is None:
+        return None
+    limited = f"{sql[:position]} TOP {int(row_limit)}{sql[position:]}"
+    try:
+        if sqlglot.parse_one(limited, read="tsql") != tree.limit(row_limit):
+            return None
+    except SqlglotError:
+        return None
+    return limited
+
+
+class QueryGuard:
+    """
+    Estimates a query's cost from the database's own planner and decides
+    whether, and in what form, it may run.
+    """
+
+    def __init__(self, engine, max_cost=500.0, max_scan_rows=5_000_000, row_limit=10000):
+        self.engine = engine
+        self.max_cost = max_cost
+        self.max_scan_rows = max_scan_rows
+        self.row_limit = row_limit
+        self._table_rows = {}
+        self._lock = threading.Lock()
+
+    def check(self, sql):
+        """
+        Return a GuardDecision for sql. Estimation failures let the query through:
+        the planner rejecting it means the database will report the real error.
+        """
+        dialect = self.engine.dialect.name
+        try:
+            if dialect == "mssql":
+                cost, estimated_rows = self._estimate_mssql(sql)
+                if cost is not None and cost > self.max_cost:
+                    return GuardDecision(sql, cost, estimated_rows, code="cost_limit",
+                                         error=rejection_message("cost_limit", cost, self.max_cost, estimated_rows))
+            elif dialect == "sqlite":
+                cost, estimated_rows = self._estimate_sqlite(sql), None
+                if cost is not None and cost > self.max_scan_rows:
+                    return GuardDecision(sql, cost, code="scan_limit",
+                                         error=rejection_message("scan_limit", cost, self.max_scan_rows))
+            else:
+                cost, estimated_rows = None, None
+        except Exception as e:
+            logger.warning("Query guard could not estimate the query, running it unguarded: %s", e)
+            cost, estimated_rows = None, None
+
+        if self.row_limit and (estimated_rows is None or estimated_rows > self.row_limit):
+            limited_sql = add_row_limit(sql, self.row_limit)
+            if limited_sql is not None:
+                return GuardDecision(limited_sql, cost, estimated_rows, limited=True)
+        return GuardDecision(sql, cost, estimated_rows)
+
+    def _estimate_mssql(self, sql):
+        """
+        (StatementSubTreeCost, StatementEstRows) from the estimated showplan; the query is compiled, not run.
+        """
+        with self.engine.connect() as connection:
+            cursor = connection.connection.dbapi_connection.cursor()
+            try:
+                # SHOWPLAN_XML must be the only statement in its batch
+                cursor.execute("SET SHOWPLAN_XML ON")
+                try:
+                    cursor.execute(sql)
+                    plan = cursor.fetchone()[0]
+                    while cursor.nextset():
+                        pass
+                finally:
+                    cursor.execute("SET SHOWPLAN_XML OFF")
+            except Exception:
+                # The session may still be in showplan mode; never hand it back to the pool
+                connection.invalidate()
+                raise
+            finally:
+                cursor.close()
+        return parse_showplan(plan)
+
+    def _estimate_sqlite(self, sql):
+        """
+        Product of the row counts of the tables EXPLAIN QUERY PLAN says will be scanned.
+        """
+        from sqlalchemy import text
+
+        try:
+            tree = sqlglot.parse_one(sql, read="tsql")
+        except ParseError:
+            return None
+        # A reference to a CTE is an exp.Table too; what it scans is in the plan under the real tables
+        ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        tables = {}
+        for table in tree.find_all(exp.Table):
+            if not table.db and table.name.lower() in ctes:
+                continue
+            qualified = f"{table.db}.{table.name}" if table.db else table.name
+            tables[table.alias_or_name.lower()] = qualified
+            tables[table.name.lower()] = qualified
+            # The plan names an unaliased table of an attached database as 'src.vw_...'
+            tables[qualified.lower()] = qualified
+
+        with self.engine.connect() as connection:
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}")).fetchall()
+            cost = None
+            for row in plan:
+                detail = row[-1]
+                if not detail.startswith("SCAN "):
+                    continue
+                name = detail.split()[1].lower()
+                if name not in tables:
+                    # CTEs, subqueries and constant rows
+                    continue
+                rows = self._count_rows(connection, tables[name])
+                cost = rows if cost is None else cost * max(rows, 1)
+        return cost
+
+    def _count_rows(self, connection, table):
+        from sqlalchemy import text
+
+        with self._lock:
+            cached = self._table_rows.get(table)
+        if cached is not None and time.time() - cached[1] < TABLE_ROWS_MAX_AGE_SECONDS:
+            return cached[0]
+        rows = connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+        with self._lock:
+            self._table_rows[table] = (rows, time.time())
+        return rows
+
+
+def parse_showplan(plan_xml):
+    """
+    The largest StatementSubTreeCost and StatementEstRows in a showplan XML document.
+    """
+    root = ElementTree.fromstring(plan_xml)
+    cost = rows = None
+    for statement in root.iter(f"{SHOWPLAN_NAMESPACE}StmtSimple"):
+        statement_cost = statement.get("StatementSubTreeCost")
+        statement_rows = statement.get("StatementEstRows")
+        if statement_cost is not None:
+            cost = max(cost or 0.0, float(statement_cost))
+        if statement_rows is not None:
+            rows = max(rows or 0.0, float(statement_rows))
+    return cost, rows
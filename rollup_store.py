@@ -0,0 +1,247 @@
+"""
+Local pre-aggregated rollup of work-order counts, refreshed incrementally.
+
+Most questions are work-order counts grouped by some mix of year, month, work
+type, location, asset and status, and each of them used to run a full GROUP BY
+over src.vw_Maximo_WorkOrders on the production SQL Server. This module keeps
+an embedded SQLite copy of the few columns those questions need:
+
+  wo_facts   one row per work order (wonum, statusdate, year, month, worktype, location, asset, status)
+  wo_rollup  work_order_count per (year, month, worktype, location, asset, status)
+
+Refreshes pull only rows whose statusdate is at or after the stored high-water
+mark, upsert them into wo_facts by wonum (a status change moves a work order to
+a new bucket rather than double counting it) and recompute wo_rollup for the
+affected (year, month) buckets only. Rows deleted at the source are only removed
+by a full refresh.
+
+The agent queries wo_rollup through the 'maximo_rollup_query' tool (sql_tools),
+which runs on a read-only connection and never touches SQL Server.
+"""
+import datetime
+import sqlite3
+import threading
+import time
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+
+SOURCE_QUERY = (
+    "SELECT wonum, statusdate, workype_description, location_description, asset_id, status_description "
+    "FROM {schema}.vw_Maximo_WorkOrders"
+)
+
+ROLLUP_COLUMNS = "year, month, worktype, location, asset, status"
+
+FETCH_BATCH_SIZE = 5000
+
+
+def _iso(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value.isoformat()
+    return value
+
+
+def _year_month(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.year, value.month
+    if isinstance(value, str) and len(value) >= 7:
+        return int(value[:4]), int(value[5:7])
+    return None, None
+
+
+class RollupStore:
+    """
+    SQLite rollup store fed from the work order view through source_engine.
+    """
+
+    def __init__(self, path, source_engine, source_schema="src", refresh_seconds=0):
+        self.path = path
+        self.source_engine = source_engine
+        self.source_schema = source_schema
+        self.refresh_seconds = refresh_seconds
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+        self._create_schema()
+
+    def _connect(self, read_only=False):
+        if read_only:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+            conn.execute("PRAGMA query_only = ON")
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _create_schema(self):
+        with self._connect() as conn:
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS wo_facts ("
+                " wonum TEXT PRIMARY KEY, statusdate TEXT, year INTEGER, month INTEGER,"
+                " worktype TEXT, location TEXT, asset TEXT, status TEXT);"
+                "CREATE INDEX IF NOT EXISTS ix_wo_facts_year_month ON wo_facts (year, month);"
+                "CREATE TABLE IF NOT EXISTS wo_rollup ("
+                " year INTEGER, month INTEGER, worktype TEXT, location TEXT, asset TEXT, status TEXT,"
+                " work_order_count INTEGER NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS ix_wo_rollup_year_month ON wo_rollup (year, month);"
+                "CREATE INDEX IF NOT EXISTS ix_wo_rollup_worktype ON wo_rollup (worktype);"
+                "CREATE INDEX IF NOT EXISTS ix_wo_rollup_location ON wo_rollup (location);"
+                "CREATE INDEX IF NOT EXISTS ix_wo_rollup_asset ON wo_rollup (asset);"
+                "CREATE TABLE IF NOT EXISTS rollup_meta (name TEXT PRIMARY KEY, value TEXT);"
+            )
+
+    def _meta(self, conn, name):
+        row = conn.execute("SELECT value FROM rollup_meta WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def status(self):
+        """
+        Return the high-water mark, the last refresh time and the table sizes.
+        """
+        with self._connect() as conn:
+            return {
+                "high_water_mark": self._meta(conn, "high_water_mark"),
+                "refreshed_at": self._meta(conn, "refreshed_at"),
+                "last_refresh_rows": int(self._meta(conn, "last_refresh_rows") or 0),
+                "facts": conn.execute("SELECT COUNT(*) FROM wo_facts").fetchone()[0],
+                "rollup_rows": conn.execute("SELECT COUNT(*) FROM wo_rollup").fetchone()[0],
+            }
+
+    def is_loaded(self):
+        with self._connect() as conn:
+            return self._meta(conn, "refreshed_at") is not None
+
+    def refresh(self, full=False):
+        """
+        Pull new and changed work orders from the source and update the affected buckets.
+        Returns the number of source rows read.
+        """
+        from sqlalchemy import text
+
+        with self._refresh_lock:
+            conn = self._connect()
+            try:
+                high_water_mark = None if full else self._meta(conn, "high_water_mark")
+                query = SOURCE_QUERY.format(schema=self.source_schema)
+                params = {}
+                if high_water_mark:
+                    # '>=' re-reads rows sharing the last timestamp; the upsert makes that harmless
+                    query += " WHERE statusdate >= :high_water_mark"
+                    params["high_water_mark"] = high_water_mark
+
+                if full:
+                    conn.execute("DELETE FROM wo_facts")
+                    conn.execute("DELETE FROM wo_rollup")
+
+                affected = set()
+                rows_read = 0
+                new_high_water_mark = high_water_mark
+                with self.source_engine.connect() as source:
+                    result = source.execution_options(stream_results=True).execute(text(query), params)
+                    while True:
+                        batch = result.fetchmany(FETCH_BATCH_SIZE)
+                        if not batch:
+                            break
+                        rows_read += len(batch)
+                        new_high_water_mark = self._apply_batch(conn, batch, affected, new_high_water_mark)
+
+                self._rebuild_buckets(conn, affected, full)
+                conn.execute(
+                    "INSERT OR REPLACE INTO rollup_meta (name, value) VALUES "
+                    "('high_water_mark', ?), ('refreshed_at', ?), ('last_refresh_rows', ?)",
+                    (new_high_water_mark, time.strftime("%Y-%m-%dT%H:%M:%S"), str(rows_read))
+                )
+                conn.commit()
+                return rows_read
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+    def _apply_batch(self, conn, batch, affected, high_water_mark):
+        wonums = [row[0] for row in batch]
+        # Buckets the changed work orders are leaving
+        for start in range(0, len(wonums), 500):
+            chunk = wonums[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            affected.update(conn.execute(
+                f"SELECT year, month FROM wo_facts WHERE wonum IN ({placeholders})", chunk
+            ).fetchall())
+
+        facts = []
+        for wonum, statusdate, worktype, location, asset, status in batch:
+            year, month = _year_month(statusdate)
+            statusdate = _iso(statusdate)
+            affected.add((year, month))
+            facts.append((wonum, statusdate, year, month, worktype, location, asset, status))
+            if statusdate is not None and (high_water_mark is None or statusdate > high_water_mark):
+                high_water_mark = statusdate
+
+        conn.executemany("INSERT OR REPLACE INTO wo_facts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", facts)
+        return high_water_mark
+
+    def _rebuild_buckets(self, conn, affected, full):
+        if full:
+            conn.execute(
+                f"INSERT INTO wo_rollup ({ROLLUP_COLUMNS}, work_order_count) "
+                f"SELECT {ROLLUP_COLUMNS}, COUNT(*) FROM wo_facts GROUP BY {ROLLUP_COLUMNS}"
+            )
+            return
+        for year, month in affected:
+            conn.execute("DELETE FROM wo_rollup WHERE year IS ? AND month IS ?", (year, month))
+            conn.execute(
+                f"INSERT INTO wo_rollup ({ROLLUP_COLUMNS}, work_order_count) "
+                f"SELECT {ROLLUP_COLUMNS}, COUNT(*) FROM wo_facts WHERE year IS ? AND month IS ? "
+                f"GROUP BY {ROLLUP_COLUMNS}",
+                (year, month)
+            )
+
+    def start_refreshing(self):
+        """
+        Refresh now in the background, then every refresh_seconds (if set).
+        """
+        def refresh_periodically():
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the existing rollup; the next tick will try again
+                pass
+            if self.refresh_seconds:
+                self._timer = threading.Timer(self.refresh_seconds, refresh_periodically)
+                self._timer.daemon = True
+                self._timer.start()
+
+        thread = threading.Thread(target=refresh_periodically, name="rollup-refresh", daemon=True)
+        thread.start()
+
+    def query(self, sql):
+        """
+        Run a read-only query against the rollup and return the rows.
+        """
+        conn = self._connect(read_only=True)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+
+def check_rollup_query(sql):
+    """
+    Return an error message unless sql is a single SELECT over wo_rollup only.
+    """
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read="sqlite") if statement is not None]
+    except ParseError as e:
+        error = e.errors[0] if e.errors else {}
+        return (f"Syntax error at line {error.get('line')}, column {error.get('col')}: "
+                f"{error.get('description', str(e))} near '{error.get('highlight', '')}'.")
+    if len(statements) != 1 or not isinstance(statements[0], (exp.Select, exp.Union)):
+        return "Only a single SELECT statement over wo_rollup is allowed."
+    cte_names = {cte.alias_or_name.lower() for cte in statements[0].find_all(exp.CTE)}
+    for table in statements[0].find_all(exp.Table):
+        if table.name.lower() != "wo_rollup" and table.name.lower() not in cte_names:
+            return f"Unknown table '{table.name}'. The only table available to this tool is wo_rollup."
+    return None
+
@@ -0,0 +1,252 @@
+"""
+Question-specific schema context: only the views and columns a question needs.
+
+The schema snapshot renders every column and sample row of the three Maximo
+views into every prompt, although most questions touch a handful of columns
+(a work type breakdown by month needs statusdate and workype_description).
+SchemaContext matches the question against the snapshot's columns and
+renders just the relevant subset, which replaces the full schema in the
+agent's system message and the direct pipeline's query-writing prompt.
+
+  - index:     one set of terms per column, from its name (split on '_'), its
+               description in prompts/schema_descriptions.v1.json and its known values
+               (the distinct values of the low-cardinality text columns the snapshot
+               sampled, so "Corrective Maintenance" finds workype_description); words are
+               normalised as in the example bank. Years, month names and words like
+               'monthly' or 'past' in a question add the term 'date'.
+  - matching:  a column is relevant if it shares a term with the question. A single word
+               naming the kind of column ('description', 'id', 'code'), naming the work orders
+               themselves, or in the names and descriptions of more than
+               SCHEMA_CONTEXT_MAX_TERM_SHARE of the columns ('location') does not select a
+               column on its own; as part of a two-word term ('location code') it does, and so
+               does any word of a known value ('Depot'). A view is included if its name or
+               one of its columns matches.
+  - always in: the key columns of each included view, and both columns of a join key when
+               both of its views are included, so joins keep working.
+  - fallback:  a question that matches no view, or whose subset would be no smaller,
+               gets the full schema.
+
+The pruned text says it is a subset and that sql_db_schema lists a view's other
+columns; the validator and rewriter still work from the full snapshot. The index is
+rebuilt when the snapshot is refreshed. Matching a question costs microseconds.
+
+Each request records the approximate tokens of the schema it was sent and of the
+full schema (trace 'schema_context', maximo_schema_context_tokens). The schema now
+varies per question, so it stays after the notes, keeping the base prompt and notes
+a fixed prefix for OpenAI's prompt caching.
+
+Settings (agent_runtime._build_schema_context):
+  SCHEMA_CONTEXT                  'pruned' (default) or 'full'
+  SCHEMA_CONTEXT_MAX_TERM_SHARE   share of the columns above which a word alone is too common (default 0.2)
+"""
+import json
+import os
+import re
+import threading
+
+from conversations import approximate_tokens
+from example_bank import tokenize
+from schema_snapshot import join_hint
+
+DESCRIPTIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts",
+                                 "schema_descriptions.v1.json")
+
+# Words of nearly every question ("how many work orders ..."), which say nothing about the columns
+GENERIC_TERMS = frozenset(["maximo", "vw", "work", "order", "workorder", "number"])
+
+# Words naming what kind of value a column holds; 'status description' picks status_description,
+# 'description' alone picks no column
+KIND_TERMS = frozenset(["description", "desc", "id", "code", "name", "num"])
+
+# Known values listed per column when the question matches them
+MAX_MATCHED_VALUES = 5
+
+_IDENTIFIER_SEPARATOR = re.compile(r"(?<=[a-z])[._](?=[a-z])")
+
+_DATE_WORDS = re.compile(
+    r"\b(?:(?:19|20)\d\d|jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|"
+    r"sep(?:tember)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?|years?|months?|monthly|yearly|annual(?:ly)?|"
+    r"quarters?|quarterly|weeks?|weekly|days?|daily|dates?|when|recent(?:ly)?|past|last|since|before|after)\b")
+
+
+def terms(text):
+    """
+    The words and word pairs of text, with identifiers like workype_description split into words.
+    """
+    return set(tokenize(_IDENTIFIER_SEPARATOR.sub(" ", str(text).lower())))
+
+
+def question_terms(question):
+    # "3 assets", "top 5": short numbers are counts, not values
+    found = {term for term in terms(question) if not (term.isdigit() and len(term) < 4)}
+    if _DATE_WORDS.search(question.lower()):
+        found.add("date")
+    return found
+
+
+def _matched_values(values, wanted):
+    """
+    The known values sharing the most terms with the question ('Corrective Maintenance', not
+    every value ending in 'Maintenance'), best first.
+    """
+    scores = {value: len(value_terms & wanted) for value, value_terms in values.items()}
+    best = max(scores.values(), default=0)
+    return sorted((value for value, score in scores.items() if score and 2 * score >= best),
+                  key=lambda value: -scores[value])
+
+
+def load_descriptions(path=DESCRIPTIONS_PATH):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as descriptions_file:
+        return json.load(descriptions_file)
+
+
+def full_context(rendered):
+    """
+    (text, stats) for a prompt sent the whole schema.
+    """
+    if rendered is None:
+        return None, None
+    tokens = approximate_tokens(rendered)
+    return rendered, {"context": "full", "tokens": tokens, "full_tokens": tokens}
+
+
+class SchemaContext:
+    """
+    Renders the part of the current schema snapshot relevant to a question.
+    """
+
+    def __init__(self, schema_snapshots, descriptions=None, max_term_share=0.2):
+        self.schema_snapshots = schema_snapshots
+        self.descriptions = load_descriptions() if descriptions is None else descriptions
+        self.max_term_share = max_term_share
+        self._lock = threading.Lock()
+        self._indexed = None
+        self._index = None
+
+    def _build_index(self, snapshot):
+        tables = []
+        for table in snapshot["tables"]:
+            described = self.descriptions.get(table["name"], {})
+            column_descriptions = described.get("columns", {})
+            known_values = table.get("known_values", {})
+            columns = []
+            for column in table["columns"]:
+                name = column["name"]
+                values = {value: terms(value) for value in known_values.get(name, [])}
+                column_terms = (terms(name) | terms(column_descriptions.get(name, ""))) - KIND_TERMS
+                columns.append({"name": name, "terms": column_terms,
+                                "value_terms": set().union(*values.values()), "values": values})
+            tables.append({
+                "name": table["name"],
+                "terms": terms(table["name"]) | terms(described.get("description", "")),
+                "keys": [key for key in described.get("keys", [])
+                         if any(column["name"] == key for column in table["columns"])],
+                "columns": columns,
+            })
+
+        # Words in every view's name ('vw', 'maximo') do not pick a view
+        shared = set.intersection(*(table["terms"] for table in tables)) if tables else set()
+        for table in tables:
+            table["terms"] -= shared
+
+        # Words too common among the column names and descriptions only count inside a word pair
+        counts = {}
+        for table in tables:
+            for column in table["columns"]:
+                for term in column["terms"]:
+                    counts[term] = counts.get(term, 0) + 1
+        total = sum(len(table["columns"]) for table in tables)
+        common = {term for term, count in counts.items()
+                  if " " not in term and count > max(1, self.max_term_share * total)}
+        return {"tables": tables, "ignored": common | GENERIC_TERMS, "total_columns": total}
+
+    def _current_index(self):
+        snapshot = self.schema_snapshots.snapshot
+        if snapshot is None:
+            return None, None
+        with self._lock:
+            if self._indexed is not snapshot:
+                self._index = self._build_index(snapshot)
+                self._indexed = snapshot
+            return snapshot, self._index
+
+    def select(self, question):
+        """
+        {view: [(column, matched known values), ...]} relevant to question, in snapshot order,
+        or None if no view matches.
+        """
+        snapshot, index = self._current_index()
+        return self._select(snapshot, index, question) if snapshot is not None else None
+
+    @staticmethod
+    def _select(snapshot, index, question):
+        wanted = question_terms(question)
+        column_wanted = wanted - index["ignored"]
+        value_wanted = wanted - GENERIC_TERMS
+        selected = {}
+        for table in index["tables"]:
+            kept = {}
+            for column in table["columns"]:
+                if column["terms"] & column_wanted or column["value_terms"] & value_wanted:
+                    kept[column["name"]] = _matched_values(column["values"], value_wanted)
+            if kept or table["terms"] & wanted:
+                selected[table["name"]] = kept
+        if not selected:
+            return None
+
+        for table in index["tables"]:
+            for key in table["keys"] if table["name"] in selected else ():
+                selected[table["name"]].setdefault(key, [])
+        for table, column, other_table, other_column in snapshot.get("join_keys", []):
+            if table in selected and other_table in selected:
+                selected[table].setdefault(column, [])
+                selected[other_table].setdefault(other_column, [])
+
+        return {table["name"]: [(column["name"], selected[table["name"]][column["name"]])
+                                for column in table["columns"] if column["name"] in selected[table["name"]]]
+                for table in index["tables"] if table["name"] in selected}
+
+    def render(self, question):
+        """
+        (text, stats) of the schema for question's prompt: the relevant views and columns
+        with their sample values and join hints, or the full schema if nothing matched.
+        """
+        full_text = self.schema_snapshots.rendered()
+        snapshot, index = self._current_index()
+        selection = self._select(snapshot, index, question) if snapshot is not None else None
+        if selection is None:
+            return full_context(full_text)
+
+        lines = [f"Database schema (fingerprint {snapshot['fingerprint']}), only the views and columns relevant "
+                 "to this question; sql_db_schema lists a view's other columns:"]
+        kept_columns = 0
+        for table in snapshot["tables"]:
+            kept = selection.get(table["name"])
+            if kept is None:
+                continue
+            names = [name for name, _values in kept]
+            positions = [position for position, column in enumerate(table["columns"]) if column["name"] in names]
+            columns = ", ".join(f"{table['columns'][position]['name']} {table['columns'][position]['type']}"
+                                for position in positions)
+            lines.append(f"{snapshot['schema']}.{table['name']}({columns})")
+            for row in table["sample_rows"]:
+                lines.append(f"  sample: {tuple(row[position] for position in positions)}")
+            for name, matched in kept:
+                # The exact spelling of the values the question refers to
+                if matched:
+                    lines.append(f"  values of {name} matching the question: "
+                                 f"{', '.join(repr(value) for value in matched[:MAX_MATCHED_VALUES])}")
+            kept_columns += len(positions)
+
+        hints = [join_hint(*key) for key in snapshot.get("join_keys", []) if key[0] in selection and key[2] in selection]
+        if hints:
+            lines.append("Join hints:")
+            lines.extend(f"- {hint}" for hint in hints)
+        text = "\n".join(lines)
+        if len(text) >= len(full_text):
+            return full_context(full_text)
+        return text, {"context": "pruned", "tables": list(selection), "columns": kept_columns,
+                      "total_columns": index["total_columns"],
+                      "tokens": approximate_tokens(text), "full_tokens": approximate_tokens(full_text)}
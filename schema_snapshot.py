@@ -0,0 +1,259 @@
+"""
+Persisted snapshot of the Maximo view schemas, injected into the agent prompt.
+
+Without it the agent spends its first iterations on every question calling
+sql_db_list_tables and sql_db_schema for the same three views. The snapshot
+holds the column names and types, a few sample rows and the join hints for
+each view, the known values of its low-cardinality text columns (which
+schema_context matches questions against), and its integer keys: the text
+columns whose numeric values are written plainly, so that sql_rewriter can
+quote a number compared with them. It is built once, saved to disk
+with a fingerprint of the column definitions, and refreshed on demand
+(POST /schema/refresh) or on a schedule.
+"""
+import datetime
+import decimal
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+SNAPSHOT_FORMAT_VERSION = 3
+
+# (table, column, other table, other column) pairs the views are joined on
+JOIN_KEYS = [
+    ("vw_Maximo_Locations", "location_description", "vw_Maximo_WorkOrders", "location_description"),
+    ("vw_Maximo_Asset", "assetnum", "vw_Maximo_WorkOrders", "asset_id"),
+]
+
+
+def join_hint(table, column, other_table, other_column):
+    return (f"When joining '{table}' and '{other_table}', use '{table}.{column}' "
+            f"to join with '{other_table}.{other_column}'.")
+
+
+JOIN_HINTS = [join_hint(*key) for key in JOIN_KEYS]
+
+# Sample values longer than this are truncated to keep the prompt compact
+MAX_SAMPLE_VALUE_LENGTH = 40
+
+# A text column with at most this many distinct values in the sampled rows has its values kept
+MAX_KNOWN_VALUES = 25
+
+# Text SQL Server converts to an int when it is compared with one
+_INTEGER_TEXT = re.compile(r"\s*[+-]?[0-9]+\s*")
+
+
+def _sample_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    text = str(value)
+    return text if len(text) <= MAX_SAMPLE_VALUE_LENGTH else text[:MAX_SAMPLE_VALUE_LENGTH] + "..."
+
+
+def schema_fingerprint(tables):
+    """
+    Hash the table and column definitions (not the sample rows), so that a
+    changed fingerprint means the schema itself has changed.
+    """
+    definition = [
+        [table["name"], [[column["name"], column["type"]] for column in table["columns"]]]
+        for table in tables
+    ]
+    return hashlib.sha256(json.dumps(definition).encode("utf-8")).hexdigest()[:16]
+
+
+def _known_values(columns, rows):
+    """
+    {column: sorted distinct values} for the text columns with at most MAX_KNOWN_VALUES values in rows.
+    """
+    known = {}
+    for position, column in enumerate(columns):
+        values = {row[position] for row in rows if isinstance(row[position], str) and row[position].strip()}
+        if values and len(values) <= MAX_KNOWN_VALUES:
+            known[column] = sorted(_sample_value(value) for value in values)
+    return known
+
+
+def _integer_keys(columns, rows):
+    """
+    The text columns whose values in rows include integers and write every one of them
+    plainly ('23257', not '023257', '+23257' or ' 23257'): for these, = 23257 and
+    = '23257' match the same rows.
+    """
+    keys = []
+    for position, column in enumerate(columns):
+        integers = [row[position] for row in rows
+                    if isinstance(row[position], str) and _INTEGER_TEXT.fullmatch(row[position])]
+        if integers and all(value == str(int(value)) for value in integers):
+            keys.append(column)
+    return keys
+
+
+def build_schema_snapshot(engine, table_names, schema="src", sample_rows=3, value_rows=1000):
+    """
+    Reflect the given tables/views and return the snapshot dict. The known values and
+    integer keys come from the first value_rows rows of each view (0 = none), read with
+    the sample rows.
+    """
+    from sqlalchemy import MetaData, Table, select
+
+    metadata = MetaData()
+    tables = []
+    with engine.connect() as connection:
+        for name in table_names:
+            table = Table(name, metadata, schema=schema, autoload_with=connection)
+            rows = []
+            if sample_rows or value_rows:
+                rows = connection.execute(select(table).limit(max(sample_rows, value_rows))).fetchall()
+            columns = [column.name for column in table.columns]
+            tables.append({
+                "name": name,
+                "columns": [
+                    {"name": column.name, "type": str(column.type), "nullable": bool(column.nullable)}
+                    for column in table.columns
+                ],
+                "sample_rows": [[_sample_value(value) for value in row] for row in rows[:sample_rows]],
+                "known_values": _known_values(columns, rows[:value_rows]),
+                "integer_keys": _integer_keys(columns, rows[:value_rows])
+            })
+
+    return {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "schema": schema,
+        "fingerprint": schema_fingerprint(tables),
+        "tables": tables,
+        "join_hints": list(JOIN_HINTS),
+        "join_keys": [list(key) for key in JOIN_KEYS]
+    }
+
+
+def save_snapshot(snapshot, path):
+    """
+    Write the snapshot atomically so concurrent readers never see a partial file.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file, indent=1)
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path):
+    """
+    Load a snapshot from disk, or return None if it is missing or from an older format.
+    """
+    try:
+        with open(path, encoding="utf-8") as snapshot_file:
+            snapshot = json.load(snapshot_file)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return snapshot
+
+
+def render_snapshot(snapshot):
+    """
+    Render the snapshot as compact prompt text, e.g.
+      src.vw_Maximo_WorkOrders(wonum VARCHAR(10), statusdate DATETIME, ...)
+        sample: ('1001', '2024-01-03T00:00:00', ...)
+    """
+    schema = snapshot["schema"]
+    lines = [f"Database schema (fingerprint {snapshot['fingerprint']}):"]
+    for table in snapshot["tables"]:
+        columns = ", ".join(f"{column['name']} {column['type']}" for column in table["columns"])
+        lines.append(f"{schema}.{table['name']}({columns})")
+        for row in table["sample_rows"]:
+            lines.append(f"  sample: {tuple(row)}")
+    if snapshot.get("join_hints"):
+        lines.append("Join hints:")
+        lines.extend(f"- {hint}" for hint in snapshot["join_hints"])
+    return "\n".join(lines)
+
+
+class SchemaSnapshotManager:
+    """
+    Holds the current snapshot, loading it from disk when available and
+    rebuilding it from the database on demand or every refresh_seconds.
+    """
+
+    def __init__(self, engine, table_names, path, schema="src", sample_rows=3, refresh_seconds=0, value_rows=1000):
+        self.engine = engine
+        self.table_names = table_names
+        self.path = path
+        self.schema = schema
+        self.sample_rows = sample_rows
+        self.value_rows = value_rows
+        self.refresh_seconds = refresh_seconds
+        self._snapshot = None
+        self._rendered = None
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def load_or_build(self):
+        """
+        Use the snapshot on disk if there is one, otherwise build and persist it.
+        """
+        snapshot = load_snapshot(self.path)
+        if snapshot is not None and [table["name"] for table in snapshot["tables"]] == list(self.table_names):
+            self._install(snapshot)
+        else:
+            self.refresh()
+        self._schedule()
+        return self._snapshot
+
+    def refresh(self):
+        """
+        Rebuild the snapshot from the database and persist it.
+        Returns True if the schema fingerprint changed.
+        """
+        snapshot = build_schema_snapshot(self.engine, self.table_names, self.schema, self.sample_rows,
+                                         self.value_rows)
+        save_snapshot(snapshot, self.path)
+        previous = self._snapshot
+        self._install(snapshot)
+        return previous is None or previous["fingerprint"] != snapshot["fingerprint"]
+
+    def _install(self, snapshot):
+        rendered = render_snapshot(snapshot)
+        with self._lock:
+            self._snapshot = snapshot
+            self._rendered = rendered
+
+    def _schedule(self):
+        if not self.refresh_seconds or self._timer is not None:
+            return
+
+        def refresh_periodically():
+            try:
+                self.refresh()
+            except Exception:
+                # Keep serving the previous snapshot; the next tick will try again
+                pass
+            self._timer = None
+            self._schedule()
+
+        self._timer = threading.Timer(self.refresh_seconds, refresh_periodically)
+        self._timer.daemon = True
+        self._timer.start()
+
+    @property
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot
+
+    def rendered(self):
+        """
+        Return the prompt text for the current snapshot, or None if there is none.
+        """
+        with self._lock:
+            return self._rendered
@@ -0,0 +1,402 @@
+"""
+Single-flight coalescing of identical concurrent questions.
+
+When a dashboard link goes round a team, the same question arrives a dozen
+times within seconds, and each would start its own agent run: a dozen times the
+LLM calls and SQL for one answer. Requests are keyed like the answer cache
+(normalized question plus the visualize flag):
+
+  - in one process, the first request is the leader and runs the question; the
+    others follow its Flight and receive the leader's tokens and messages as
+    they are produced (replayed from the start if they join late), from which
+    they build the same answer. A flight that finished stays joinable for
+    SINGLEFLIGHT_GRACE_SECONDS, until the leader has stored the answer.
+  - across the worker processes of one host, the leader also takes the key in a
+    small SQLite lock table (SINGLEFLIGHT_LOCK_PATH). A request in another
+    worker that finds the key taken waits for that run to finish and reads the
+    answer from the shared answer cache, so this part needs the answer cache.
+    Remote followers get the finished answer but not the steps as they happen.
+
+If the leader is cancelled (its client went away), the flight is abandoned and
+its followers start over; one of them becomes the new leader. If the leader's
+run fails, its followers get the same error. The leader's worker refreshes a
+heartbeat on its keys, so a crashed worker's lock goes stale after
+SINGLEFLIGHT_STALE_SECONDS and another worker takes over.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+
+from instrumentation import record_run_saved, record_singleflight
+
+# Lock owners are worker processes; the pid alone could be reused by a restarted worker
+_PROCESS_TOKEN = uuid.uuid4().hex[:8]
+
+logger = logging.getLogger(__name__)
+
+
+class SharedRunFailed(Exception):
+    """
+    Raised in a follower when the run it was following failed.
+    """
+
+
+def _set_events(events):
+    for event, loop in events:
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # The follower's loop has closed; it is not waiting any more
+            pass
+
+
+class Flight:
+    """
+    One in-process run of a question and the ('token' | 'message', ...) items it produced so far.
+    Published to from the leader's thread, followed from any thread or event loop.
+    """
+
+    def __init__(self, key, leader_id):
+        self.key = key
+        self.leader_id = leader_id
+        self.items = []
+        self.status = None
+        self.error = None
+        self.finished_at = None
+        self.followers = 0
+        self._condition = threading.Condition()
+        self._events = {}
+
+    def _notify(self):
+        # Called with the condition held; returns the async followers to wake outside of it
+        self._condition.notify_all()
+        return list(self._events.items())
+
+    def publish(self, item):
+        with self._condition:
+            self.items.append(item)
+            events = self._notify()
+        _set_events(events)
+
+    def finish(self, status, error=None):
+        """
+        End the flight: 'done', 'error' (error is passed on to the followers) or 'abandoned'.
+        """
+        with self._condition:
+            if self.status is not None:
+                return
+            self.status = status
+            self.error = error
+            self.finished_at = time.monotonic()
+            events = self._notify()
+        _set_events(events)
+
+    def _wake(self):
+        with self._condition:
+            events = self._notify()
+        _set_events(events)
+
+    def follow(self, cancel_token=None):
+        """
+        Yield the run's items from the first, then ('end', (status, error)) once it has finished.
+        Raises RequestCancelled if cancel_token is cancelled meanwhile.
+        """
+        remove = cancel_token.on_cancel(self._wake) if cancel_token is not None else None
+        position = 0
+        try:
+            while True:
+                with self._condition:
+                    while position == len(self.items) and self.status is None \
+                            and not (cancel_token is not None and cancel_token.cancelled):
+                        self._condition.wait()
+                    items = self.items[position:]
+                    status, error = self.status, self.error
+                position += len(items)
+                for item in items:
+                    yield item
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                # The leader finishes after its last publish, so these were all of the items
+                if status is not None:
+                    yield 'end', (status, error)
+                    return
+        finally:
+            if remove is not None:
+                remove()
+
+    async def afollow(self, cancel_token=None):
+        """
+        Async counterpart of follow() for followers on an event loop.
+        """
+        event = asyncio.Event()
+        with self._condition:
+            self._events[event] = asyncio.get_running_loop()
+        remove = cancel_token.on_cancel(self._wake) if cancel_token is not None else None
+        position = 0
+        try:
+            while True:
+                with self._condition:
+                    # Cleared under the lock: a publish after this snapshot sets it again
+                    event.clear()
+                    items = self.items[position:]
+                    status, error = self.status, self.error
+                position += len(items)
+                for item in items:
+                    yield item
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                if status is not None:
+                    yield 'end', (status, error)
+                    return
+                if not items:
+                    await event.wait()
+        finally:
+            with self._condition:
+                self._events.pop(event, None)
+            if remove is not None:
+                remove()
+
+
+class FlightLockStore:
+    """
+    The keys being answered by each worker process of the host, in a SQLite file they share.
+    A key is free when it has no row, its run has finished, or its owner's heartbeat is stale.
+    """
+
+    def __init__(self, path, stale_seconds=15, finished_ttl_seconds=60):
+        self.path = path
+        self.stale_seconds = stale_seconds
+        self.finished_ttl_seconds = finished_ttl_seconds
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared across threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            " flight_key TEXT PRIMARY KEY,"
+            " owner TEXT NOT NULL,"
+            " heartbeat REAL NOT NULL,"
+            " status TEXT)"
+        )
+
+    def acquire(self, key, owner):
+        """
+        Take key for owner; False if another live owner is running it.
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, heartbeat, status FROM flights WHERE flight_key = ?",
+                               (key,)).fetchone()
+            if row is not None and row[0] != owner and row[2] is None and now - row[1] < self.stale_seconds:
+                conn.execute("COMMIT")
+                return False
+            conn.execute("INSERT OR REPLACE INTO flights (flight_key, owner, heartbeat, status) "
+                         "VALUES (?, ?, ?, NULL)", (key, owner, now))
+            conn.execute("DELETE FROM flights WHERE status IS NOT NULL AND heartbeat < ?",
+                         (now - self.finished_ttl_seconds,))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, key, owner, status):
+        """
+        Record how owner's run of key ended, which frees the key.
+        """
+        self._connection().execute(
+            "UPDATE flights SET status = ?, heartbeat = ? WHERE flight_key = ? AND owner = ? AND status IS NULL",
+            (status, time.time(), key, owner))
+
+    def state(self, key):
+        """
+        'running', the finished run's status, 'stale' or None (no run recorded).
+        """
+        row = self._connection().execute("SELECT heartbeat, status FROM flights WHERE flight_key = ?",
+                                          (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] is not None:
+            return row[1]
+        return 'running' if time.time() - row[0] < self.stale_seconds else 'stale'
+
+    def heartbeat(self, owner):
+        self._connection().execute("UPDATE flights SET heartbeat = ? WHERE owner = ? AND status IS NULL",
+                                   (time.time(), owner))
+
+
+class SingleFlight:
+    """
+    The flights of this process, and with lock_path, the lock store shared with the host's other workers.
+    """
+
+    def __init__(self, lock_path=None, stale_seconds=15, poll_seconds=0.1, wait_seconds=300, grace_seconds=2.0):
+        self.store = FlightLockStore(lock_path, stale_seconds) if lock_path else None
+        self.stale_seconds = stale_seconds
+        self.poll_seconds = poll_seconds
+        self.wait_seconds = wait_seconds
+        self.grace_seconds = grace_seconds
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._heartbeat = None
+
+    @property
+    def owner(self):
+        # Computed on use: workers forked after import each get their own
+        return f"{os.getpid()}:{_PROCESS_TOKEN}"
+
+    def _count(self, name):
+        self._counts[name] += 1
+        if name in ('leader', 'follower', 'remote'):
+            record_singleflight(name)
+        elif name == 'runs_saved':
+            record_run_saved()
+        return name
+
+    def join(self, key, request_id):
+        """
+        ('leader', Flight) if the request for key should run it, ('follower', Flight) if it should
+        follow this process's run, ('remote', None) if another worker is running it.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for flight_key, flight in list(self._flights.items()):
+                if flight.status is not None and now - flight.finished_at > self.grace_seconds:
+                    del self._flights[flight_key]
+            flight = self._follow(key)
+            if flight is not None:
+                return self._count('follower'), flight
+        # The lock store waits on other workers' transactions: ask it without holding up this process
+        acquired = True
+        if self.store is not None:
+            try:
+                acquired = self.store.acquire(key, self.owner)
+            except sqlite3.Error as e:
+                # Coalescing within the process still works without the lock store
+                logger.warning("Single-flight lock store unavailable: %s", e)
+        with self._lock:
+            # Another request for key may have become its leader meanwhile (the store lets the same
+            # owner take a key again), so look again before leading
+            flight = self._follow(key)
+            if flight is not None:
+                return self._count('follower'), flight
+            if not acquired:
+                return self._count('remote'), None
+            if self.store is not None:
+                self._start_heartbeat()
+            flight = Flight(key, request_id)
+            self._flights[key] = flight
+            return self._count('leader'), flight
+
+    def _follow(self, key):
+        # Called with self._lock held
+        flight = self._flights.get(key)
+        if flight is None or flight.status not in (None, 'done'):
+            return None
+        flight.followers += 1
+        return flight
+
+    def finish(self, flight, status, error=None):
+        """
+        Called by the leader when its run ended; wakes the followers and frees the key.
+        """
+        with self._lock:
+            # A finished run is only worth following while its answer is being stored
+            if status != 'done' and self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.finish(status, error)
+        if self.store is not None:
+            try:
+                self.store.release(flight.key, self.owner, status)
+            except sqlite3.Error as e:
+                logger.warning("Could not release single-flight lock: %s", e)
+
+    def run_saved(self):
+        self._count('runs_saved')
+
+    def restarted(self):
+        self._count('restarts')
+
+    def remote_state(self, key):
+        if self.store is None:
+            return None
+        try:
+            return self.store.state(key)
+        except sqlite3.Error as e:
+            logger.warning("Single-flight lock store unavailable: %s", e)
+            return None
+
+    def wait_remote(self, key, cancel_token=None):
+        """
+        Wait for another worker's run of key; returns how it ended ('done', 'error', 'abandoned',
+        'stale', None) or 'timeout' after wait_seconds.
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            state = self.remote_state(key)
+            if state != 'running':
+                return state
+            if time.monotonic() > deadline:
+                return 'timeout'
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            time.sleep(self.poll_seconds)
+
+    async def await_remote(self, key, cancel_token=None):
+        """
+        Async counterpart of wait_remote().
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            state = await asyncio.to_thread(self.remote_state, key)
+            if state != 'running':
+                return state
+            if time.monotonic() > deadline:
+                return 'timeout'
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            await asyncio.sleep(self.poll_seconds)
+
+    def _start_heartbeat(self):
+        # Called with self._lock held
+        if self._heartbeat is not None and self._heartbeat.is_alive():
+            return
+
+        def beat():
+            while True:
+                time.sleep(self.stale_seconds / 3)
+                with self._lock:
+                    running = any(flight.status is None for flight in self._flights.values())
+                if running:
+                    try:
+                        self.store.heartbeat(self.owner)
+                    except sqlite3.Error as e:
+                        logger.warning("Single-flight heartbeat failed: %s", e)
+
+        self._heartbeat = threading.Thread(target=beat, name="singleflight-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def stats(self):
+        with self._lock:
+            in_flight = sum(1 for flight in self._flights.values() if flight.status is None)
+            followers = sum(flight.followers for flight in self._flights.values() if flight.status is None)
+        return {"in_flight": in_flight, "waiting_followers": followers, "cross_process": self.store is not None,
+                **{name: self._counts[name] for name in ('leader', 'follower', 'remote', 'runs_saved', 'restarts')}}
@@ -0,0 +1,155 @@
+"""
+In-memory cache of SQL query results keyed by canonicalized query text.
+
+Different phrasings of a question often make the agent generate the same SQL,
+so results are cached on a canonical form of the statement (comments stripped,
+whitespace collapsed and keywords/identifiers case-folded, string literals kept
+verbatim). The cache is bounded by entry count and by total bytes, evicting the
+least recently used entries first, and entries are invalidated either when they
+exceed a maximum age or when a watermark query (e.g. MAX(statusdate) on the
+work order view) reports that the underlying data has changed.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# String literals (including N'...' unicode literals) are preserved verbatim;
+# everything between them is canonicalized.
+_LITERAL_PATTERN = re.compile(r"N?'(?:[^']|'')*'", re.IGNORECASE)
+_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+_PUNCTUATION_SPACING = re.compile(r"\s*([(),=<>+*/])\s*")
+
+
+def canonicalize_sql(sql):
+    """
+    Return the canonical form of a SQL statement used as the cache key.
+    e.g. "SELECT  TOP 5 Name\\nFROM src.T WHERE x = 'Abc';" -> "select top 5 name from src.t where x='Abc'"
+    """
+    literals = []
+
+    def stash_literal(match):
+        literals.append(match.group(0))
+        return f"\x00{len(literals) - 1}\x00"
+
+    text = _LITERAL_PATTERN.sub(stash_literal, sql)
+    text = _COMMENT_PATTERN.sub(" ", text)
+    text = " ".join(text.split()).casefold()
+    text = _PUNCTUATION_SPACING.sub(r"\1", text).rstrip(";").strip()
+    return re.sub(r"\x00(\d+)\x00", lambda match: literals[int(match.group(1))], text)
+
+
+class SqlResultCache:
+    """
+    Thread-safe LRU cache of query results with entry, byte and freshness bounds.
+
+    max_age_seconds:          entries older than this are treated as missing (0 disables)
+    watermark_fn:             optional callable returning a value that changes when the data changes;
+                              a change invalidates every entry
+    watermark_check_seconds:  how often watermark_fn is consulted
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, max_age_seconds=300,
+                 watermark_fn=None, watermark_check_seconds=60):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.watermark_fn = watermark_fn
+        self.watermark_check_seconds = watermark_check_seconds
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._watermark_checked_at = 0.0
+        self._watermark_lock = threading.Lock()
+        self._counters = {"hit": 0, "miss": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+
+    def get(self, sql):
+        """
+        Return the cached result for a query, or None.
+        """
+        self._check_watermark()
+        key = canonicalize_sql(sql)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["miss"] += 1
+                return None
+            result, size, created_at = entry
+            if self.max_age_seconds and time.time() - created_at > self.max_age_seconds:
+                self._remove(key)
+                self._counters["expired"] += 1
+                self._counters["miss"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hit"] += 1
+            return result
+
+    def put(self, sql, result, size=None):
+        """
+        Cache a query result. Results larger than max_bytes are not cached.
+        """
+        if size is None:
+            size = len(str(result).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        key = canonicalize_sql(sql)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, time.time())
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._counters["evicted"] += 1
+
+    def _remove(self, key):
+        _result, size, _created_at = self._entries.pop(key)
+        self._bytes -= size
+
+    def invalidate(self):
+        """
+        Drop every cached result.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._counters["invalidated"] += 1
+
+    def _check_watermark(self):
+        if self.watermark_fn is None:
+            return
+        if time.time() - self._watermark_checked_at < self.watermark_check_seconds:
+            return
+        # Only one thread runs the watermark query; the others keep using the cache meanwhile
+        if not self._watermark_lock.acquire(blocking=False):
+            return
+        try:
+            self._watermark_checked_at = time.time()
+            try:
+                watermark = self.watermark_fn()
+            except Exception:
+                # Freshness cannot be confirmed, so do not serve anything cached before now
+                self.invalidate()
+                self._watermark = None
+                return
+            if watermark != self._watermark:
+                if self._watermark is not None:
+                    self.invalidate()
+                self._watermark = watermark
+        finally:
+            self._watermark_lock.release()
+
+    def stats(self):
+        """
+        Return hit/miss/eviction counters and the current size of the cache.
+        """
+        with self._lock:
+            lookups = self._counters["hit"] + self._counters["miss"]
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hit_rate": self._counters["hit"] / lookups if lookups else 0.0
+            }
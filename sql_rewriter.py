@@ -0,0 +1,416 @@
+"""
+Sargable rewrites of the agent's T-SQL before it runs.
+
+The model filters dates the way people say them: YEAR(statusdate) = 2024,
+YEAR(statusdate) IN (2022, 2023, 2024), YEAR(statusdate) = 2024 AND
+MONTH(statusdate) = 3. A function around the column hides it from the index,
+so SQL Server scans all of vw_Maximo_WorkOrders for each of these. The rewriter
+turns them into the equivalent half-open ranges on the bare column:
+  - YEAR(c) = 2024                  -> c >= '20240101' AND c < '20250101'
+  - YEAR(c) IN (2022, 2023, 2025)   -> (c >= '20220101' AND c < '20240101'
+                                        OR c >= '20250101' AND c < '20260101')
+  - YEAR(c) >, >=, <, <=, <>, BETWEEN, with the literal on either side
+  - YEAR(c) = 2024 AND MONTH(c) IN (1, 2, 3) in the same AND chain
+                                    -> c >= '20240101' AND c < '20240401'
+    (DATEPART(year, c) and DATEPART(month, c) alike)
+and quotes numeric literals compared with a string column (asset_id = 23257
+-> asset_id = '23257'). SQL Server otherwise converts every asset_id to int to
+compare it, which scans the index and fails outright on the first asset_id
+that is not a number. That conversion also matches '023257' to 23257, which the
+quoted literal does not, so a literal is only quoted for a column the schema
+snapshot lists in integer_keys: its sampled values that read as numbers have
+no leading zeros, signs or padding.
+
+A rewritten date predicate is true, false or unknown (NULL dates) for exactly
+the rows the original was. Only bare columns the schema snapshot lists with a
+date type are rewritten (nothing is without a snapshot: a varchar date column
+does not compare as a range), and only in WHERE and JOIN ... ON, never in
+HAVING, CASE or the select list. MONTH() without a YEAR() on the same
+column has no range form and is left alone. Literals are 'YYYYMMDD', the
+unseparated form SQL Server reads the same way for every date type whatever
+the login's language and DATEFORMAT; as untyped strings they convert to the
+column's type, so the comparison stays on the bare column.
+
+Only the rewritten predicates are generated by sqlglot; they are spliced into
+the query's own text and everything else comes back byte for byte. sqlglot's
+T-SQL output is not always the query it read (DATENAME() comes back as FORMAT(),
+SYSDATETIME() as GETDATE()). A predicate whose text cannot be found leaves the
+whole query as it was.
+
+Join keys of different types (varchar location_id = bigint location_id) are
+not cast to match: on these views such a join is the wrong join, not a slow
+one, and the validator rejects it with the correct join instead.
+"""
+import functools
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.optimizer.scope import traverse_scope
+from sqlglot.tokens import TokenType
+
+from sql_validator import type_family
+
+# Column types a range on the column's value compares the same way as YEAR()/MONTH() of it.
+# Not DATETIMEOFFSET: YEAR() reads its local time, a literal compares in UTC.
+RANGE_TYPES = ("DATE", "DATETIME", "DATETIME2", "SMALLDATETIME", "TIMESTAMP")
+
+DATEPART_UNITS = {"year": "year", "yy": "year", "yyyy": "year", "month": "month", "mm": "month", "m": "month"}
+
+_FLIPPED = {exp.EQ: exp.EQ, exp.NEQ: exp.NEQ, exp.GT: exp.LT, exp.GTE: exp.LTE, exp.LT: exp.GT, exp.LTE: exp.GTE}
+
+# Years a YEAR() IN / BETWEEN may span and still be combined with MONTH() month by month
+MAX_COMBINED_YEARS = 100
+
+# Tokens a predicate's text may extend past its outermost leaves with positions:
+# a function name and the start of its argument list, closing parentheses
+MAX_SPAN_EXTENSION = 6
+
+
+def _integer(node):
+    if isinstance(node, exp.Literal) and node.this.strip().isdigit():
+        return int(node.this)
+    return None
+
+
+def _date_part(node):
+    """
+    ('year' | 'month', column) for YEAR(column), MONTH(column) and DATEPART(...); None otherwise.
+    """
+    if isinstance(node, (exp.Year, exp.Month)):
+        unit, argument = ("year" if isinstance(node, exp.Year) else "month"), node.this
+        if isinstance(argument, exp.TsOrDsToDate):
+            argument = argument.this
+    elif isinstance(node, exp.Extract):
+        unit, argument = DATEPART_UNITS.get(node.this.name.lower()), node.expression
+    else:
+        return None
+    if unit is None or not isinstance(argument, exp.Column) or not argument.name:
+        return None
+    return unit, argument
+
+
+def _merge(values):
+    """
+    Half-open intervals [(first, last + 1), ...] covering the sorted integers in values.
+    """
+    intervals = []
+    for value in sorted(set(values)):
+        if intervals and intervals[-1][1] == value:
+            intervals[-1][1] = value + 1
+        else:
+            intervals.append([value, value + 1])
+    return [tuple(interval) for interval in intervals]
+
+
+def _intervals(node):
+    """
+    (unit, column, [(low, high), ...]) for a YEAR()/MONTH() predicate, where the
+    predicate holds when the part is in one of the half-open intervals (None = unbounded).
+    """
+    if isinstance(node, exp.In):
+        part = _date_part(node.this)
+        values = [_integer(value) for value in node.expressions]
+        if part is None or node.args.get("query") or not values or None in values:
+            return None
+        return part[0], part[1], _merge(values)
+
+    if isinstance(node, exp.Between):
+        part, low, high = _date_part(node.this), _integer(node.args.get("low")), _integer(node.args.get("high"))
+        if part is None or low is None or high is None:
+            return None
+        # low > high gives an empty range, which is as false as the original
+        return part[0], part[1], [(low, high + 1)]
+
+    comparison = type(node)
+    if comparison not in _FLIPPED:
+        return None
+    part, value = _date_part(node.left), _integer(node.right)
+    if part is None:
+        part, value, comparison = _date_part(node.right), _integer(node.left), _FLIPPED[comparison]
+    if part is None or value is None:
+        return None
+    return part[0], part[1], {
+        exp.EQ: [(value, value + 1)],
+        exp.NEQ: [(None, value), (value + 1, None)],
+        exp.GT: [(value + 1, None)],
+        exp.GTE: [(value, None)],
+        exp.LT: [(None, value)],
+        exp.LTE: [(None, value + 1)],
+    }[comparison]
+
+
+def _month_literal(index):
+    # Months are counted as year * 12 + (month - 1)
+    return exp.Literal.string(f"{index // 12:04d}{index % 12 + 1:02d}01")
+
+
+def _render(column, intervals):
+    """
+    The range predicate on column for half-open month-index intervals.
+    """
+    ranges = []
+    for low, high in intervals:
+        bounds = []
+        if low is not None:
+            bounds.append(exp.GTE(this=column.copy(), expression=_month_literal(low)))
+        if high is not None:
+            bounds.append(exp.LT(this=column.copy(), expression=_month_literal(high)))
+        ranges.append(functools.reduce(lambda left, right: exp.And(this=left, expression=right), bounds))
+    return functools.reduce(lambda left, right: exp.Or(this=left, expression=right), ranges)
+
+
+def _text(node, replacement):
+    """
+    The T-SQL for replacement in node's place, parenthesized where its operators would bind differently.
+    """
+    parent = node.parent
+    if isinstance(replacement, exp.Connector) and (
+            isinstance(parent, exp.Not) or isinstance(replacement, exp.Or) and isinstance(parent, exp.And)):
+        replacement = exp.Paren(this=replacement)
+    return replacement.sql(dialect="tsql")
+
+
+def _span(sql, tokens, node):
+    """
+    The (start, end) of node's text in sql, or None if it cannot be found.
+
+    Only identifiers, literals and function names carry positions, so the span is
+    widened token by token from those until its text parses back to node itself.
+    """
+    positions = [(child.meta["start"], child.meta["end"]) for child in node.walk() if "start" in child.meta]
+    if not positions:
+        return None
+    start, end = min(position[0] for position in positions), max(position[1] for position in positions)
+    first = next((index for index, token in enumerate(tokens) if token.end >= start), None)
+    last = next((index for index in range(len(tokens) - 1, -1, -1) if tokens[index].start <= end), None)
+    if first is None or last is None or first > last:
+        return None
+    for widened in range(2 * MAX_SPAN_EXTENSION + 1):
+        for left in range(max(0, widened - MAX_SPAN_EXTENSION), min(widened, MAX_SPAN_EXTENSION) + 1):
+            right = widened - left
+            if first - left < 0 or last + right >= len(tokens):
+                continue
+            span = (tokens[first - left].start, tokens[last + right].end + 1)
+            try:
+                if sqlglot.parse_one(sql[span[0]:span[1]], read="tsql") == node:
+                    return span
+            except SqlglotError:
+                continue
+    return None
+
+
+def _removal(tokens, span):
+    """
+    The span to delete for a predicate dropped from an AND chain: the predicate and one of its ANDs.
+    """
+    inside = [index for index, token in enumerate(tokens) if span[0] <= token.start < span[1]]
+    before, after = inside[0] - 1, inside[-1] + 1
+    if before > 0 and tokens[before].token_type == TokenType.AND:
+        return tokens[before - 1].end + 1, span[1]
+    if after + 1 < len(tokens) and tokens[after].token_type == TokenType.AND:
+        return span[0], tokens[after + 1].start
+    return None
+
+
+class SqlRewriter:
+    """
+    Rewrites queries against the current schema snapshot.
+
+    snapshot_fn returns the snapshot dict from schema_snapshot (or None, in which
+    case nothing is rewritten).
+    """
+
+    def __init__(self, snapshot_fn=None):
+        self.snapshot_fn = snapshot_fn
+        self._snapshot = None
+        self._columns = {}
+        self._integer_keys = set()
+
+    def _load_columns(self):
+        snapshot = self.snapshot_fn() if self.snapshot_fn else None
+        if snapshot is None:
+            return None
+        # By identity, not fingerprint: a refresh can change integer_keys without changing the schema
+        if snapshot is not self._snapshot:
+            self._columns = {
+                table["name"].lower(): {column["name"].lower(): column["type"] for column in table["columns"]}
+                for table in snapshot["tables"]
+            }
+            self._integer_keys = {
+                (table["name"].lower(), column.lower())
+                for table in snapshot["tables"] for column in table.get("integer_keys", [])
+            }
+            self._snapshot = snapshot
+        return self._columns
+
+    def rewrite(self, sql):
+        """
+        Return (sql, rules): the rewritten query and the rule applied for each rewritten
+        predicate. A query with nothing to rewrite, or that does not parse, is returned as it is.
+        """
+        try:
+            statements = [statement for statement in sqlglot.parse(sql, read="tsql") if statement is not None]
+        except SqlglotError:
+            return sql, []
+        if len(statements) != 1:
+            return sql, []
+
+        tree = statements[0]
+        columns = self._load_columns()
+        rules = []
+        # (original node, its replacement text, or None to drop it from its AND chain)
+        edits = []
+        try:
+            for scope in traverse_scope(tree):
+                select = scope.expression
+                if not isinstance(select, exp.Select):
+                    continue
+                views = {
+                    alias.lower(): source.name.lower()
+                    for alias, source in scope.sources.items()
+                    if isinstance(source, exp.Table) and columns is not None and source.name.lower() in columns
+                }
+                context = (views, columns, rules, edits)
+                where = select.args.get("where")
+                if where is not None:
+                    self._visit(where.this, context)
+                for join in select.args.get("joins") or []:
+                    if join.args.get("on") is not None:
+                        self._visit(join.args["on"], context)
+            if not rules:
+                return sql, []
+            tokens = sqlglot.Dialect.get_or_raise("tsql").tokenize(sql)
+        except SqlglotError:
+            return sql, []
+
+        spliced = []
+        for node, text in edits:
+            span = _span(sql, tokens, node)
+            if span is not None and text is None:
+                span = _removal(tokens, span)
+            if span is None:
+                return sql, []
+            spliced.append((span, text or ""))
+        spliced.sort()
+        if any(previous[0][1] > following[0][0] for previous, following in zip(spliced, spliced[1:])):
+            return sql, []
+        for (start, end), text in reversed(spliced):
+            sql = sql[:start] + text + sql[end:]
+        return sql, rules
+
+    def _column_view(self, column, context):
+        """
+        The snapshot view column belongs to, or None if it cannot be placed.
+        """
+        views, columns, _rules, _edits = context
+        if columns is None:
+            return None
+        name = column.name.lower()
+        if column.table:
+            view = views.get(column.table.lower())
+            candidates = [view] if view else []
+        else:
+            candidates = [view for view in set(views.values()) if name in columns[view]]
+        if len(candidates) != 1 or name not in columns[candidates[0]]:
+            return None
+        return candidates[0]
+
+    def _column_type(self, column, context):
+        view = self._column_view(column, context)
+        return None if view is None else context[1][view][column.name.lower()]
+
+    def _rangeable(self, column, context):
+        # A column the snapshot cannot place (CTE or derived table output) is left alone
+        column_type = self._column_type(column, context)
+        return column_type is not None and column_type.split("(")[0].split()[0].upper() in RANGE_TYPES
+
+    def _visit(self, node, context):
+        # Subqueries are scopes of their own and are visited with their own sources
+        if isinstance(node, exp.And):
+            for part in self._combine(list(node.flatten()), context):
+                self._visit(part, context)
+        elif isinstance(node, (exp.Or, exp.Not, exp.Paren)):
+            for key in ("this", "expression"):
+                child = node.args.get(key)
+                if child is not None:
+                    self._visit(child, context)
+        else:
+            self._rewrite_predicate(node, context)
+
+    def _rewrite_predicate(self, node, context):
+        rules = context[2]
+        found = _intervals(node)
+        if found is not None:
+            unit, column, intervals = found
+            if unit != "year" or not self._rangeable(column, context):
+                return
+            bounds = [bound for interval in intervals for bound in interval if bound is not None]
+            if not all(1 <= bound <= 9999 for bound in bounds):
+                return
+            rules.append("year_range")
+            context[3].append((node, _text(node, _render(
+                column, [(None if low is None else low * 12, None if high is None else high * 12)
+                         for low, high in intervals]))))
+            return
+
+        if self._quote_key_literals(node, context):
+            rules.append("string_key_literal")
+
+    def _combine(self, parts, context):
+        """
+        Replace YEAR(c) IN / = / BETWEEN ... AND MONTH(c) ... in one AND chain by month ranges on c,
+        returning the parts left to visit.
+        """
+        by_column = {}
+        for position, part in enumerate(parts):
+            found = _intervals(part)
+            if found is None:
+                continue
+            unit, column, intervals = found
+            key = (column.table.lower(), column.name.lower())
+            by_column.setdefault(key, {"year": [], "month": []})[unit].append((position, column, intervals))
+
+        removed = set()
+        for predicates in by_column.values():
+            if len(predicates["year"]) != 1 or not predicates["month"]:
+                continue
+            position, column, year_intervals = predicates["year"][0]
+            if any(low is None or high is None for low, high in year_intervals) \
+                    or sum(high - low for low, high in year_intervals if high > low) > MAX_COMBINED_YEARS \
+                    or not self._rangeable(column, context):
+                continue
+            years = [year for low, high in year_intervals for year in range(low, high) if 1 <= year <= 9998]
+            if len(years) != sum(max(high - low, 0) for low, high in year_intervals):
+                continue
+            months = set(range(1, 13))
+            for _position, _column, intervals in predicates["month"]:
+                months &= {month for month in range(1, 13) for low, high in intervals
+                           if (low is None or month >= low) and (high is None or month < high)}
+            if not months or not years:
+                continue
+            context[3].append((parts[position], _text(parts[position], _render(
+                column, _merge(year * 12 + month - 1 for year in years for month in months)))))
+            context[3].extend((parts[month_position], None) for month_position, _column, _intervals in predicates["month"])
+            removed.add(position)
+            removed.update(month_position for month_position, _column, _intervals in predicates["month"])
+            context[2].append("year_month_range")
+        return [part for position, part in enumerate(parts) if position not in removed]
+
+    def _quote_key_literals(self, node, context):
+        # varchar column = 23257 converts the column, not the literal; quote the literal instead
+        if isinstance(node, exp.In) and not node.args.get("query"):
+            column, literals = node.this, node.expressions
+        elif isinstance(node, (exp.EQ, exp.NEQ)):
+            column, literals = (node.left, [node.right]) if isinstance(node.left, exp.Column) \
+                else (node.right, [node.left])
+        else:
+            return False
+        if not isinstance(column, exp.Column) or not literals \
+                or not all(isinstance(literal, exp.Literal) and not literal.is_string and _integer(literal) is not None
+                           for literal in literals) \
+                or type_family(self._column_type(column, context)) != "string" \
+                or (self._column_view(column, context), column.name.lower()) not in self._integer_keys:
+            return False
+        context[3].extend((literal, exp.Literal.string(literal.this).sql(dialect="tsql")) for literal in literals)
+        return True
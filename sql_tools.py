@@ -0,0 +1,254 @@
+"""
+SQL tools used by the agent.
+
+Builds the standard SQLDatabaseToolkit tools and swaps in our own
+implementations where the app needs more control over query execution.
+"""
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from pydantic import Field
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
+from langchain_core.tools import BaseTool
+
+from instrumentation import copy_context_call, record_guard_decision, record_sql_rewrite
+
+# Bounded pool used to run blocking ODBC calls from the async serving path,
+# so that hundreds of in-flight questions cannot open hundreds of DB connections.
+_sql_executor = None
+
+
+def get_sql_executor():
+    """
+    Return the shared thread pool for SQL execution, sized by SQL_MAX_WORKERS.
+    """
+    global _sql_executor
+    if _sql_executor is None:
+        _sql_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("SQL_MAX_WORKERS", "16")),
+            thread_name_prefix="sql"
+        )
+    return _sql_executor
+
+
+def format_validation_errors(errors):
+    """
+    Render validator errors in the same 'Error: ...' form the database errors use.
+    """
+    return "Error: " + " ".join(errors)
+
+
+class CachedQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """
+    'sql_db_query' tool that serves repeated queries from a SqlResultCache.
+    Error results are never cached.
+
+    If a validator is set, queries failing local validation are rejected
+    before they reach the database. If a rewriter is set, YEAR()/MONTH()
+    filters and mistyped key literals are rewritten into index-friendly
+    predicates first (sql_rewriter). If a guard is set, queries whose
+    estimated plan is too expensive are rejected, and queries that may return
+    too many rows get a TOP added (query_guard). If an executor is set, queries run through
+    its bounded, streaming fetch instead of SQLDatabase.run, and the tool
+    returns (content, artifact) with the typed, columnar result as the
+    ToolMessage artifact (build_tools sets response_format accordingly).
+    """
+
+    cache: Any = Field(default=None, exclude=True)
+    validator: Any = Field(default=None, exclude=True)
+    executor: Any = Field(default=None, exclude=True)
+    guard: Any = Field(default=None, exclude=True)
+    rewriter: Any = Field(default=None, exclude=True)
+
+    def _execute(self, query):
+        if self.rewriter is not None:
+            query, rules = self.rewriter.rewrite(query)
+            for rule in rules:
+                record_sql_rewrite(rule)
+
+        decision = None
+        if self.guard is not None:
+            decision = self.guard.check(query)
+            record_guard_decision(decision.action)
+            if decision.error:
+                return decision.error, None
+            query = decision.sql
+
+        if self.executor is not None:
+            content, artifact = self.executor.run_with_artifact(query)
+        else:
+            content, artifact = self.db.run_no_throw(query), None
+
+        if decision is not None and decision.limited and not content.startswith("Error:") \
+                and (artifact is None or artifact["row_count"] >= self.guard.row_limit):
+            content += (f"\n(The query guard limited this query to {self.guard.row_limit} rows. "
+                        "Add filters or aggregate to see everything.)")
+        return content, artifact
+
+    def _output(self, content, artifact):
+        if self.response_format == "content_and_artifact":
+            return content, artifact
+        return content
+
+    def _run(self, query, run_manager=None):
+        if self.validator is not None:
+            errors = self.validator.validate(query)
+            if errors:
+                return self._output(format_validation_errors(errors), None)
+
+        if self.cache is None:
+            return self._output(*self._execute(query))
+
+        cached = self.cache.get(query)
+        if cached is not None:
+            return self._output(*cached)
+
+        content, artifact = self._execute(query)
+        # A result cut short by SQL_MAX_ROWS, SQL_MAX_BYTES or the time limit is not the query's answer
+        incomplete = artifact is not None and artifact.get("complete") is False
+        if not (isinstance(content, str) and content.startswith("Error:")) and not incomplete:
+            self.cache.put(query, (content, artifact), size=_result_size(content, artifact))
+        return self._output(content, artifact)
+
+    async def _arun(self, query, run_manager=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_sql_executor(), copy_context_call(self._run, query))
+
+
+def _result_size(content, artifact):
+    # Rough byte size for the cache budget; str() on a 50k-row artifact would cost more than the query
+    size = len(content.encode("utf-8")) if isinstance(content, str) else len(str(content))
+    if artifact is not None:
+        size += 16 * len(artifact["columns"]) * artifact["row_count"]
+    return size
+
+
+class RollupQueryTool(BaseTool):
+    """
+    'maximo_rollup_query' tool answering work order counts from the local
+    rollup store instead of SQL Server.
+    """
+
+    name: str = "maximo_rollup_query"
+    description: str = (
+        "Fast, local, pre-aggregated work order counts. Input is a SQLite SELECT over the single table "
+        "wo_rollup(year INTEGER, month INTEGER, worktype TEXT, location TEXT, asset TEXT, status TEXT, "
+        "work_order_count INTEGER), where year and month come from vw_Maximo_WorkOrders.statusdate, "
+        "worktype is workype_description, location is location_description, asset is asset_id and "
+        "status is status_description. Always aggregate with SUM(work_order_count), never COUNT(*). "
+        "Use SQLite syntax: LIMIT instead of TOP and no schema prefix."
+    )
+    store: Any = Field(exclude=True)
+
+    def _run(self, query, run_manager=None):
+        from rollup_store import check_rollup_query
+
+        if not self.store.is_loaded():
+            return "Error: the rollup store is still loading; use sql_db_query instead."
+        error = check_rollup_query(query)
+        if error:
+            return f"Error: {error}"
+        try:
+            return str(self.store.query(query))
+        except sqlite3.Error as e:
+            return f"Error: {e}"
+
+    async def _arun(self, query, run_manager=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_sql_executor(), copy_context_call(self._run, query))
+
+
+class PreviousResultsTool(BaseTool):
+    """
+    'previous_results_query' tool re-slicing the result sets kept by the
+    request's conversation thread (conversations), in memory.
+    """
+
+    name: str = "previous_results_query"
+    description: str = (
+        "Query the results of earlier questions in this conversation without going back to the database. "
+        "Input is a SQLite SELECT over the tables result_1, result_2, ... listed in the system message "
+        "(only when it lists any). Use it for follow-ups that filter, re-group, re-sort or chart an earlier "
+        "result; use sql_db_query when the earlier results do not have the columns or rows needed. "
+        "Use SQLite syntax: LIMIT instead of TOP and no schema prefix."
+    )
+    response_format: str = "content_and_artifact"
+    preview_rows: int = 50
+
+    def _run(self, query, run_manager=None):
+        from conversations import ResultQueryError, current_conversation
+        from query_executor import QueryResult, column_type
+
+        conversation = current_conversation()
+        if conversation is None or not conversation.results:
+            return "Error: there are no earlier results in this conversation; use sql_db_query instead.", None
+        try:
+            columns, rows, stop_reason = conversation.query(query)
+        except (ResultQueryError, sqlite3.Error) as e:
+            return f"Error: {e}", None
+        data = [list(values) for values in zip(*rows)] if rows else [[] for _column in columns]
+        preview = rows[:self.preview_rows]
+        complete = stop_reason is None
+        result = QueryResult(columns, preview, len(rows), len(rows) > len(preview) or not complete, complete,
+                             stop_reason, types=[column_type(None, values) for values in data], data=data)
+        return result.to_text(), result.to_artifact()
+
+    async def _arun(self, query, run_manager=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(get_sql_executor(), copy_context_call(self._run, query))
+
+
+class LocalQueryCheckerTool(BaseTool):
+    """
+    Drop-in replacement for the toolkit's LLM-based 'sql_db_query_checker'
+    that validates the query locally with a SqlValidator.
+    """
+
+    name: str = "sql_db_query_checker"
+    description: str = (
+        "Use this tool to double check if your query is correct before executing it. "
+        "Input is a SQL query; output is either 'The query is valid.' or a list of precise problems to fix."
+    )
+    validator: Any = Field(exclude=True)
+
+    def _run(self, query, run_manager=None):
+        errors = self.validator.validate(query)
+        if errors:
+            return format_validation_errors(errors)
+        return "The query is valid."
+
+
+def build_tools(db, llm, sql_cache=None, validator=None, validate_before_execute=True, rollup_store=None,
+                query_executor=None, query_guard=None, sql_rewriter=None, previous_results=False):
+    """
+    Return the agent's tools: the SQLDatabaseToolkit tools with 'sql_db_query'
+    replaced by the cached (and, with a query_executor and query_guard, bounded; with a
+    sql_rewriter, rewritten) implementation and, when a validator is given,
+    'sql_db_query_checker' replaced by the local checker. A rollup store adds
+    the 'maximo_rollup_query' tool, previous_results the 'previous_results_query' tool.
+    """
+    tools = []
+    for tool in SQLDatabaseToolkit(db=db, llm=llm).get_tools():
+        if tool.name == "sql_db_query":
+            tool = CachedQuerySQLDatabaseTool(
+                db=db,
+                description=tool.description,
+                cache=sql_cache,
+                validator=validator if validate_before_execute else None,
+                executor=query_executor,
+                guard=query_guard,
+                rewriter=sql_rewriter,
+                response_format="content_and_artifact" if query_executor is not None else "content"
+            )
+        elif tool.name == "sql_db_query_checker" and validator is not None:
+            tool = LocalQueryCheckerTool(validator=validator, description=tool.description)
+        tools.append(tool)
+    if rollup_store is not None:
+        tools.append(RollupQueryTool(store=rollup_store))
+    if previous_results:
+        tools.append(PreviousResultsTool())
+    return tools
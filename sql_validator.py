@@ -0,0 +1,219 @@
+"""
+Local, parser-based validator for the T-SQL the agent generates.
+
+Replaces the toolkit's sql_db_query_checker, which spent a whole LLM call
+proof-reading each query. The checks here run in well under a millisecond,
+need no database connection (only the schema snapshot), and catch the failures
+we actually see:
+  - syntax errors, with line and column
+  - statements that are not read-only (INSERT/UPDATE/DELETE/DDL/EXEC/SELECT INTO)
+  - tables that are not schema-qualified with 'src.' or are not one of the Maximo views
+  - columns that do not exist on the view they are read from
+  - join keys of incompatible types, e.g. varchar location_id = bigint location_id,
+    which SQL Server rejects with "Error converting data type varchar to bigint"
+"""
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError
+from sqlglot.optimizer.scope import traverse_scope
+
+READ_ONLY_ROOTS = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+WRITE_EXPRESSIONS = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Drop, exp.Create, exp.Alter,
+    exp.TruncateTable, exp.Command, exp.Execute,
+)
+
+# Type families that SQL Server compares without a lossy or failing implicit conversion
+_TYPE_FAMILIES = (
+    ("string", ("CHAR", "VARCHAR", "NCHAR", "NVARCHAR", "TEXT", "NTEXT", "UNIQUEIDENTIFIER")),
+    ("number", ("BIGINT", "INT", "INTEGER", "SMALLINT", "TINYINT", "BIT", "DECIMAL", "NUMERIC",
+                "FLOAT", "REAL", "MONEY", "SMALLMONEY")),
+    ("datetime", ("DATE", "DATETIME", "DATETIME2", "SMALLDATETIME", "DATETIMEOFFSET", "TIME", "TIMESTAMP")),
+)
+
+
+def type_family(sql_type):
+    """
+    Map a column type such as 'VARCHAR(50) COLLATE "SQL_Latin1_General_CP1_CI_AS"' to
+    'string', 'number' or 'datetime' (None if unknown).
+    """
+    base = sql_type.split("(")[0].split()[0].upper() if sql_type else ""
+    for family, names in _TYPE_FAMILIES:
+        if base in names:
+            return family
+    return None
+
+
+def _views(scope, columns):
+    """
+    {alias: view name} for the scope's sources that are one of our views.
+    """
+    return {
+        alias.lower(): source.name.lower()
+        for alias, source in scope.sources.items()
+        if isinstance(source, exp.Table) and source.name.lower() in columns
+    }
+
+
+class SqlValidator:
+    """
+    Validates queries against the current schema snapshot.
+
+    snapshot_fn returns the snapshot dict from schema_snapshot (or None, in which
+    case only syntax, read-only and qualification checks are applied).
+    """
+
+    def __init__(self, snapshot_fn, schema="src", allowed_tables=None):
+        self.snapshot_fn = snapshot_fn
+        self.schema = schema
+        self.allowed_tables = allowed_tables
+        self._fingerprint = None
+        self._columns = {}
+        self._table_names = {}
+
+    def _load_columns(self):
+        snapshot = self.snapshot_fn() if self.snapshot_fn else None
+        if snapshot is None:
+            return None
+        if snapshot["fingerprint"] != self._fingerprint:
+            self._columns = {
+                table["name"].lower(): {
+                    column["name"].lower(): (column["name"], column["type"]) for column in table["columns"]
+                }
+                for table in snapshot["tables"]
+            }
+            self._table_names = {table["name"].lower(): table["name"] for table in snapshot["tables"]}
+            self._fingerprint = snapshot["fingerprint"]
+        return self._columns
+
+    def validate(self, sql):
+        """
+        Return a list of error messages; an empty list means the query passed every check.
+        """
+        try:
+            statements = [statement for statement in sqlglot.parse(sql, read="tsql") if statement is not None]
+        except ParseError as e:
+            error = e.errors[0] if e.errors else {}
+            return [f"Syntax error at line {error.get('line')}, column {error.get('col')}: "
+                    f"{error.get('description', str(e))} near '{error.get('highlight', '')}'."]
+
+        if not statements:
+            return ["The query is empty."]
+        if len(statements) > 1:
+            return ["Only a single SELECT statement can be run per query."]
+
+        tree = statements[0]
+        errors = self._check_read_only(tree)
+        if errors:
+            return errors
+
+        columns = self._load_columns()
+        errors.extend(self._check_tables(tree, columns))
+        if columns is not None and not errors:
+            errors.extend(self._check_columns_and_joins(tree, columns))
+        return errors
+
+    def _check_read_only(self, tree):
+        if not isinstance(tree, READ_ONLY_ROOTS) or any(tree.find_all(*WRITE_EXPRESSIONS)):
+            return ["Only read-only SELECT queries are allowed; DML, DDL and EXEC statements are not permitted."]
+        if any(select.args.get("into") for select in tree.find_all(exp.Select)):
+            return ["SELECT ... INTO creates a table and is not permitted; remove the INTO clause."]
+        return []
+
+    def _check_tables(self, tree, columns):
+        errors = []
+        cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        allowed = self.allowed_tables or (list(self._table_names.values()) if columns is not None else None)
+        allowed_lower = {name.lower() for name in allowed} if allowed else None
+
+        for table in tree.find_all(exp.Table):
+            name = table.name
+            if not table.db and name.lower() in cte_names:
+                continue
+            if table.db.lower() != self.schema.lower():
+                errors.append(f"Table '{table.sql(dialect='tsql')}' must be qualified with the schema prefix: "
+                              f"use '{self.schema}.{name}'.")
+            elif allowed_lower is not None and name.lower() not in allowed_lower:
+                errors.append(f"Unknown table '{self.schema}.{name}'. Available views: "
+                              + ", ".join(f"{self.schema}.{known}" for known in sorted(allowed)) + ".")
+        return errors
+
+    def _check_columns_and_joins(self, tree, columns):
+        errors = []
+        for scope in traverse_scope(tree):
+            views = _views(scope, columns)
+            all_sources_known = len(views) == len(scope.sources)
+            # A correlated subquery may name the enclosing query's columns unqualified
+            outer_views = set()
+            parent = scope.parent
+            while parent is not None:
+                outer_views.update(_views(parent, columns).values())
+                parent = parent.parent
+            # Explicit output aliases may be referenced by ORDER BY
+            output_aliases = {
+                projection.alias.lower()
+                for projection in getattr(scope.expression, "expressions", [])
+                if isinstance(projection, exp.Alias)
+            }
+
+            for column in scope.columns:
+                name = column.name.lower()
+                if not name or name == "*":
+                    continue
+                # A subquery's columns (IN (SELECT ...), EXISTS) also show up in the enclosing
+                # scope; they are checked in the subquery's own scope, against its own sources
+                if column.find_ancestor(exp.Select) is not scope.expression:
+                    continue
+                qualifier = column.table.lower()
+                if qualifier:
+                    view = views.get(qualifier)
+                    if view is not None and name not in columns[view]:
+                        errors.append(self._unknown_column(column.sql(dialect="tsql"), [view], columns))
+                elif all_sources_known and name not in output_aliases \
+                        and not any(name in columns[view] for view in set(views.values()) | outer_views):
+                    errors.append(self._unknown_column(column.name, sorted(set(views.values())), columns))
+
+            for join in scope.expression.args.get("joins") or []:
+                condition = join.args.get("on")
+                if condition is None:
+                    continue
+                for comparison in condition.find_all(exp.EQ):
+                    error = self._check_join_types(comparison, views, columns)
+                    if error:
+                        errors.append(error)
+        return errors
+
+    def _resolve_type(self, column, views, columns):
+        if not isinstance(column, exp.Column):
+            return None, None
+        name = column.name.lower()
+        if column.table:
+            view = views.get(column.table.lower())
+            candidates = [view] if view else []
+        else:
+            candidates = [view for view in views.values() if name in columns[view]]
+        if len(candidates) != 1 or name not in columns[candidates[0]]:
+            return None, None
+        return candidates[0], columns[candidates[0]][name][1]
+
+    def _check_join_types(self, comparison, views, columns):
+        left_view, left_type = self._resolve_type(comparison.left, views, columns)
+        right_view, right_type = self._resolve_type(comparison.right, views, columns)
+        left_family, right_family = type_family(left_type), type_family(right_type)
+        if left_family is None or right_family is None or left_family == right_family:
+            return None
+        return (
+            f"Join condition '{comparison.sql(dialect='tsql')}' compares "
+            f"{self._table_names[left_view]}.{comparison.left.name} ({left_type}) with "
+            f"{self._table_names[right_view]}.{comparison.right.name} ({right_type}). "
+            f"SQL Server will implicitly convert one side and the join fails or cannot use an index "
+            f"(e.g. 'Error converting data type varchar to bigint'). Join on columns of the same type; "
+            f"see the join hints."
+        )
+
+    def _unknown_column(self, column, views, columns):
+        available = "; ".join(
+            f"{self._table_names[view]}: {', '.join(original for original, _type in columns[view].values())}"
+            for view in views
+        )
+        return f"Unknown column '{column}'. Available columns - {available}."
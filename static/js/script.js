@@ -1,34 +1,150 @@
+// The question currently being answered: {id, controller}
+let currentRequest = null;
+
+function cancelCurrentRequest() {
+    // Stop the server-side run right away instead of when it next writes to the closed stream
+    if (currentRequest) {
+        navigator.sendBeacon(`/ask/${currentRequest.id}/cancel`);
+        currentRequest.controller.abort();
+        currentRequest = null;
+    }
+}
+
+window.addEventListener('pagehide', cancelCurrentRequest);
+
+function newRequestId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID().replace(/-/g, '');
+    }
+    return Date.now().toString(16) + Math.random().toString(16).slice(2);
+}
+
+// Follow-up questions continue this conversation thread on the server until "New conversation"
+let threadId = newRequestId();
+
+function newConversation() {
+    cancelCurrentRequest();
+    threadId = newRequestId();
+    document.getElementById('question').value = '';
+    document.getElementById('response').innerHTML = 'Your answer will appear here.';
+    document.getElementById('chartContainer').style.display = 'none';
+}
+
 function submitQuestion() {
     const question = document.getElementById('question').value;
     const visualize = document.getElementById('visualize').checked;
+    const mode = document.getElementById('mode').value;
     const responseDiv = document.getElementById('response');
 
-    fetch('/ask', {
+    cancelCurrentRequest();
+    const thisRequest = {id: newRequestId(), controller: new AbortController()};
+    currentRequest = thisRequest;
+
+    responseDiv.innerHTML = '';
+    document.getElementById('chartContainer').style.display = 'none';
+    let liveTokens = null;
+
+    fetch('/ask/stream', {
         method: 'POST',
         headers: {'Content-Type': 'application/json'},
-        body: JSON.stringify({question: question, visualize: visualize})
+        body: JSON.stringify({question: question, visualize: visualize, mode: mode, request_id: thisRequest.id,
+                              thread_id: threadId}),
+        signal: thisRequest.controller.signal
     })
-    .then(response => response.json())
-    .then(data => {
-        responseDiv.innerHTML = '';
-        data.steps.forEach(step => {
-            responseDiv.innerHTML += `<strong>${step.type}:</strong><br>${step.content}<br><br>`;
-        });
-        responseDiv.innerHTML += `<hr><strong>Final Answer:</strong><br>${data.final_answer}`;
-
-        // Check if visualization data is available
-        if(data.visualizationData) {
-            renderChart(data.visualizationData);
-        } else {
-            // Hide the chart container if no visualization data is present
-            document.getElementById('chartContainer').style.display = 'none';
+    .then(response => readEventStream(response, (event, data) => {
+        if (event === 'token') {
+            // Show the LLM output as it is generated; replaced by the complete step when it arrives
+            if (!liveTokens) {
+                liveTokens = document.createElement('div');
+                responseDiv.appendChild(liveTokens);
+            }
+            liveTokens.textContent += data.content;
+        } else if (event === 'step') {
+            if (liveTokens) {
+                liveTokens.remove();
+                liveTokens = null;
+            }
+            responseDiv.innerHTML += `<strong>${data.type}:</strong><br>${data.content}<br><br>`;
+        } else if (event === 'tool_call') {
+            const detail = data.sql ? data.sql : JSON.stringify(data.args);
+            responseDiv.innerHTML += `<strong>Tool Call (${data.name}):</strong><br>${detail}<br><br>`;
+        } else if (event === 'final') {
+            responseDiv.innerHTML += `<hr><strong>Final Answer:</strong><br>${data.final_answer}`;
+            if (data.metadata) {
+                responseDiv.innerHTML += `<br><br><small>Answered by: ${data.metadata.path}, LLM calls: ${data.metadata.llm_calls}, time: ${data.metadata.elapsed_seconds}s</small>`;
+            }
+
+            // Check if visualization data is available
+            if (data.visualizationData) {
+                renderChart(data.visualizationData);
+            } else {
+                // Hide the chart container if no visualization data is present
+                document.getElementById('chartContainer').style.display = 'none';
+            }
+        } else if (event === 'error') {
+            responseDiv.innerHTML += `Error: ${data.error}`;
+        } else if (event === 'restart') {
+            // The identical question this one was sharing was abandoned; it is being answered again
+            responseDiv.innerHTML = '';
+            liveTokens = null;
+        } else if (event === 'cancelled') {
+            responseDiv.innerHTML += `<hr>Cancelled.`;
         }
-    })
+    }))
     .catch(error => {
-        responseDiv.innerHTML = `Error: ${error}`;
+        if (error.name !== 'AbortError') {
+            responseDiv.innerHTML += `Error: ${error}`;
+        }
+    })
+    .finally(() => {
+        if (currentRequest === thisRequest) {
+            currentRequest = null;
+        }
     });
 }
 
+function readEventStream(response, onEvent) {
+    // EventSource only supports GET, so parse the Server-Sent Events from the fetch body instead
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    function dispatch(block) {
+        let event = 'message';
+        const dataLines = [];
+        block.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (dataLines.length > 0) {
+            onEvent(event, JSON.parse(dataLines.join('\n')));
+        }
+    }
+
+    function pump() {
+        return reader.read().then(({done, value}) => {
+            if (done) {
+                if (buffer.trim()) {
+                    dispatch(buffer);
+                }
+                return;
+            }
+            buffer += decoder.decode(value, {stream: true});
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                dispatch(buffer.slice(0, boundary));
+                buffer = buffer.slice(boundary + 2);
+            }
+            return pump();
+        });
+    }
+
+    return pump();
+}
+
 // function renderChart(data) {
 //     // Show chart container
 //     document.getElementById('chartContainer').style.display = 'block';
@@ -108,7 +224,7 @@ function renderChart(data) {
         chartData = {
             labels: data.labels,
             datasets: [{
-                label: 'Work Orders',
+                label: data.label || 'Work Orders',
                 data: data.values,
                 backgroundColor: 'rgba(0, 123, 255, 0.5)',
                 borderColor: 'rgba(0, 123, 255, 1)',
@@ -118,7 +234,7 @@ function renderChart(data) {
     }
 
     window.myChart = new Chart(ctx, {
-        type: 'bar',
+        type: data.type || 'bar',
         data: chartData,
         options: {
             scales: {
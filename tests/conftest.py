@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules live at the top level of the repository; the offline stand-ins (replay
+# chat model, SQLite fixture, T-SQL shim) live with the benchmarks
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
@@ -0,0 +1,222 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import types
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+import query_executor
+from cancellation import CancelToken, RequestCancelled
+from cancellation_benchmark import SLOW_SQL, SLOW_SQL_QUESTION, StreamingReplayChatModel, wait_for_checkout
+from replay_benchmark import setup_app
+
+# How long a cancelled run may take to wind down; the slow query alone runs for much longer
+CANCEL_BOUND_SECONDS = 5
+
+
+@pytest.fixture(scope="module")
+def app(tmp_path_factory):
+    environ = dict(os.environ)
+    # The guard would reject the slow self-join before it ran; the statement timeout must outlast it
+    os.environ.update({"SQL_GUARD": "off", "SQL_QUERY_TIMEOUT_SECONDS": "600"})
+    args = types.SimpleNamespace(fixture=None, work_orders=10000, sql_cache=False, clients=4, llm_latency_ms=0.0)
+    llm = StreamingReplayChatModel(script={SLOW_SQL_QUESTION: SLOW_SQL}, streaming=True)
+    try:
+        yield setup_app(str(tmp_path_factory.mktemp("cancellation")), llm.script, args, llm=llm)
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+@pytest.fixture
+def engine(app):
+    import agent_runtime
+
+    return agent_runtime.get_runtime().db._engine
+
+
+@pytest.fixture
+def cancels(monkeypatch):
+    """
+    Statements aborted through query_executor._cancel, as (connection, cursor) pairs.
+    """
+    calls = []
+    cancel = query_executor._cancel
+
+    def recording_cancel(dbapi_connection, cursor):
+        calls.append((dbapi_connection, cursor))
+        cancel(dbapi_connection, cursor)
+
+    monkeypatch.setattr(query_executor, "_cancel", recording_cancel)
+    return calls
+
+
+def _events(response):
+    buffer = ""
+    for chunk in response.response:
+        buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+        while "\n\n" in buffer:
+            block, buffer = buffer.split("\n\n", 1)
+            fields = dict(line.split(": ", 1) for line in block.splitlines())
+            yield fields["event"], json.loads(fields["data"])
+
+
+def _wait_for_release(engine):
+    deadline = time.perf_counter() + CANCEL_BOUND_SECONDS
+    while engine.pool.checkedout() and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    return engine.pool.checkedout()
+
+
+def test_cancel_endpoint_aborts_the_running_query(app, engine, cancels):
+    client = app.test_client()
+    client.get("/ready")
+    outcome = {}
+
+    def ask():
+        response = client.post("/ask", json={"question": SLOW_SQL_QUESTION, "request_id": "slow-question"})
+        outcome.update(status=response.status_code, body=response.get_json(), returned=time.perf_counter())
+
+    thread = threading.Thread(target=ask)
+    thread.start()
+    wait_for_checkout(engine)
+    cancelled = time.perf_counter()
+    assert client.post("/ask/slow-question/cancel").get_json() == {"cancelled": True, "request_id": "slow-question"}
+    thread.join(CANCEL_BOUND_SECONDS)
+
+    assert not thread.is_alive()
+    assert outcome["status"] == 499
+    assert outcome["body"]["cancelled"] is True
+    assert outcome["body"]["metadata"]["llm_calls"] == 1
+    assert outcome["returned"] - cancelled < CANCEL_BOUND_SECONDS
+    assert len(cancels) == 1
+    assert _wait_for_release(engine) == 0
+
+
+def test_cancelled_stream_closes(app, engine, cancels):
+    client = app.test_client()
+    client.get("/ready")
+    response = client.post("/ask/stream", json={"question": SLOW_SQL_QUESTION}, buffered=False)
+    events = _events(response)
+    event, start = next(events)
+    assert event == "start"
+
+    def cancel():
+        wait_for_checkout(engine)
+        client.post(f"/ask/{start['request_id']}/cancel")
+
+    threading.Thread(target=cancel).start()
+    started = time.perf_counter()
+    names = [event for event, _data in events]
+    response.close()
+
+    assert names[-1] == "cancelled"
+    assert time.perf_counter() - started < CANCEL_BOUND_SECONDS
+    assert len(cancels) == 1
+    assert _wait_for_release(engine) == 0
+
+
+def test_request_ids_belong_to_their_session(app, engine, cancels):
+    owner = app.test_client()
+    owner.get("/ready")
+    other = app.test_client()
+    other.get("/ready")
+    outcome = {}
+
+    def ask():
+        outcome["status"] = owner.post("/ask", json={"question": SLOW_SQL_QUESTION, "request_id": "my-question"}).status_code
+
+    thread = threading.Thread(target=ask)
+    thread.start()
+    wait_for_checkout(engine)
+    try:
+        assert other.post("/ask/my-question/cancel").status_code == 404
+        duplicate = owner.post("/ask", json={"question": SLOW_SQL_QUESTION, "request_id": "my-question"})
+        assert duplicate.status_code == 409
+        assert not cancels
+    finally:
+        owner.post("/ask/my-question/cancel")
+        thread.join(CANCEL_BOUND_SECONDS)
+    assert outcome["status"] == 499
+    assert _wait_for_release(engine) == 0
+
+
+class BlockingCursor:
+    """
+    Cursor of a pyodbc-like driver: executing the slow statement blocks until cancel() is
+    called from another thread, then fails the way a cancelled statement does.
+    """
+
+    def __init__(self, cursor, driver):
+        self._cursor = cursor
+        self._driver = driver
+
+    def execute(self, statement, parameters=()):
+        if "work_orders" in statement:
+            self._driver.executing.set()
+            if not self._driver.cancelled.wait(CANCEL_BOUND_SECONDS * 2):
+                raise AssertionError("the statement was never cancelled")
+            raise sqlite3.OperationalError("Operation canceled")
+        return self._cursor.execute(statement, parameters)
+
+    def cancel(self):
+        self._driver.cancelled.set()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class BlockingDriverConnection:
+    """
+    sqlite3 connection without interrupt() or a progress handler, as with pyodbc: the
+    only way to stop a running statement is its cursor's cancel().
+    """
+
+    def __init__(self):
+        self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.executing = threading.Event()
+        self.cancelled = threading.Event()
+
+    def cursor(self):
+        return BlockingCursor(self._connection.cursor(), self)
+
+    def __getattr__(self, name):
+        if name in ("interrupt", "set_progress_handler"):
+            raise AttributeError(name)
+        return getattr(self._connection, name)
+
+
+def test_cancel_reaches_the_cursor_of_a_statement_still_executing():
+    driver = BlockingDriverConnection()
+    engine = create_engine("sqlite://", creator=lambda: driver, poolclass=QueuePool)
+    executor = query_executor.QueryExecutor(engine, timeout_seconds=0)
+    token = CancelToken()
+    outcome = {}
+
+    def run():
+        token.start()
+        try:
+            executor.run("SELECT wonum FROM work_orders")
+        except RequestCancelled as e:
+            outcome["error"] = e
+        finally:
+            token.stop()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    try:
+        assert driver.executing.wait(CANCEL_BOUND_SECONDS)
+        token.cancel("client disconnected")
+        thread.join(CANCEL_BOUND_SECONDS)
+        assert not thread.is_alive()
+        assert driver.cancelled.is_set()
+        assert isinstance(outcome.get("error"), RequestCancelled)
+        assert engine.pool.checkedout() == 0
+    finally:
+        driver.cancelled.set()
+        thread.join()
+        engine.dispose()
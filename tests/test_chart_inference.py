@@ -0,0 +1,23 @@
+from chart_inference import infer_chart
+
+
+def chart(columns, types, data):
+    return infer_chart({"columns": columns, "types": types, "data": data})
+
+
+def test_measure_named_after_a_period_is_not_a_time_axis():
+    for measure in ("monthly_avg", "avg_per_month", "total_years"):
+        result = chart(["location_description", measure], ["string", "float"], [["Depot", "Reservoir"], [37.5, 2.5]])
+        assert result["labels"] == ["Depot", "Reservoir"]
+        assert result["values"] == [37.5, 2.5]
+
+
+def test_year_and_month_columns_make_a_time_axis():
+    result = chart(["WorkOrderYear", "Month", "WorkOrderCount"], ["integer", "integer", "integer"],
+                   [[2023, 2024], [12, 1], [5, 6]])
+    assert result["labels"] == ["December 2023", "January 2024"]
+    assert result["values"] == [5, 6]
+
+
+def test_time_axis_without_valid_values_gives_no_chart():
+    assert chart(["month", "WorkOrderCount"], ["integer", "integer"], [[None, None], [5, 6]]) is None
@@ -0,0 +1,68 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from cancellation import CancelToken, RequestCancelled
+from conversations import ConversationStore, ResultQueryError, activate
+from sql_tools import PreviousResultsTool
+
+ROWS = 2000
+
+CROSS_JOIN = "SELECT COUNT(*) FROM result_1 a, result_1 b, result_1 c"
+
+
+def _conversation(**limits):
+    store = ConversationStore(**limits)
+    conversation = store.get("thread")
+    artifact = {"columns": ["wonum", "WorkOrderCount"], "types": ["string", "integer"],
+                "data": [[f"WO{number}" for number in range(ROWS)], list(range(ROWS))],
+                "row_count": ROWS, "complete": True}
+    message = SimpleNamespace(type="tool", name="sql_db_query", tool_call_id="call", artifact=artifact)
+    conversation.record_turn("question", "answer", [message])
+    return conversation
+
+
+def test_reading_stops_at_the_row_limit():
+    conversation = _conversation(query_max_rows=100)
+    columns, rows, stop_reason = conversation.query("SELECT wonum FROM result_1")
+    assert columns == ["wonum"]
+    assert len(rows) == 100
+    assert stop_reason == "100 row limit"
+    assert conversation.query("SELECT wonum FROM result_1 LIMIT 100")[2] is None
+
+
+def test_tool_reports_a_truncated_result_like_sql_db_query():
+    restore = activate(_conversation(query_max_rows=100))
+    try:
+        text, artifact = PreviousResultsTool()._run("SELECT wonum FROM result_1")
+    finally:
+        restore()
+    assert "of at least 100 rows. Reading stopped at the 100 row limit." in text
+    assert artifact["complete"] is False
+    assert artifact["row_count"] == 100
+
+
+def test_query_stops_at_the_deadline():
+    conversation = _conversation(query_timeout_seconds=1)
+    started = time.monotonic()
+    with pytest.raises(ResultQueryError, match="Query cancelled after 1 seconds"):
+        conversation.query(CROSS_JOIN)
+    assert time.monotonic() - started < 3
+
+
+def test_query_stops_when_the_request_is_cancelled():
+    conversation = _conversation()
+    token = CancelToken().start()
+    try:
+        token.cancel()
+        with pytest.raises(RequestCancelled):
+            conversation.query(CROSS_JOIN)
+    finally:
+        token.stop()
+
+
+def test_recursive_queries_are_not_allowed():
+    conversation = _conversation()
+    with pytest.raises(Exception, match="not authorized"):
+        conversation.query("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT i FROM n")
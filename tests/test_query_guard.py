@@ -0,0 +1,54 @@
+import logging
+import sqlite3
+
+import pytest
+
+from db_pool import create_maximo_engine
+from query_guard import QueryGuard, add_row_limit
+
+CTE_QUERY = (
+    "WITH WorkOrderCounts AS (SELECT workype_description, COUNT(*) AS n FROM src.vw_Maximo_WorkOrders "
+    "GROUP BY workype_description) SELECT workype_description, n FROM WorkOrderCounts ORDER BY n DESC"
+)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    path = tmp_path / "maximo.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE vw_Maximo_WorkOrders (wonum TEXT, workype_description TEXT)")
+        conn.executemany("INSERT INTO vw_Maximo_WorkOrders VALUES (?, ?)",
+                         [(f"WO{i}", "Corrective Maintenance" if i % 3 else "Proactive Maintenance")
+                          for i in range(1000)])
+    engine = create_maximo_engine(f"sqlite:///{path}")
+    yield engine
+    engine.dispose()
+
+
+def test_cte_query_is_estimated_from_the_tables_it_scans(engine, caplog):
+    with caplog.at_level(logging.WARNING, logger="query_guard"):
+        decision = QueryGuard(engine, max_scan_rows=100).check(CTE_QUERY)
+    assert not caplog.records
+    assert decision.action == "reject"
+    assert decision.code == "scan_limit"
+    assert decision.cost == 1000
+
+
+def test_cte_query_under_the_limit_runs(engine, caplog):
+    with caplog.at_level(logging.WARNING, logger="query_guard"):
+        decision = QueryGuard(engine, max_scan_rows=10_000, row_limit=0).check(CTE_QUERY)
+    assert not caplog.records
+    assert decision.action == "allow"
+    assert decision.cost == 1000
+
+
+@pytest.mark.parametrize("sql,limited", [
+    ("SELECT DATENAME(month, statusdate) AS m, SYSDATETIME() AS now FROM src.vw_Maximo_WorkOrders",
+     "SELECT TOP 50 DATENAME(month, statusdate) AS m, SYSDATETIME() AS now FROM src.vw_Maximo_WorkOrders"),
+    ("select distinct wonum\nfrom src.vw_Maximo_WorkOrders", "select distinct TOP 50 wonum\nfrom src.vw_Maximo_WorkOrders"),
+    (CTE_QUERY, CTE_QUERY.replace(") SELECT workype_description", ") SELECT TOP 50 workype_description")),
+    ("SELECT TOP 5 wonum FROM src.vw_Maximo_WorkOrders", None),
+    ("SELECT COUNT(*) FROM src.vw_Maximo_WorkOrders", None),
+])
+def test_row_limit_is_inserted_into_the_query_text(sql, limited):
+    assert add_row_limit(sql, 50) == limited
@@ -0,0 +1,47 @@
+import threading
+
+from singleflight import FlightLockStore, SingleFlight
+
+
+class SlowLockStore(FlightLockStore):
+    """
+    FlightLockStore whose acquire() records whether the caller held the SingleFlight lock,
+    and holds every caller until all of them have arrived.
+    """
+
+    def __init__(self, path, flights, callers):
+        super().__init__(path)
+        self.flights = flights
+        self.held_lock = []
+        self._arrived = threading.Barrier(callers, timeout=5)
+
+    def acquire(self, key, owner):
+        self.held_lock.append(self.flights._lock.locked())
+        self._arrived.wait()
+        return super().acquire(key, owner)
+
+
+def test_lock_store_is_asked_outside_the_lock_and_one_request_leads(tmp_path):
+    flights = SingleFlight()
+    flights.store = SlowLockStore(str(tmp_path / "singleflight.sqlite3"), flights, callers=3)
+    roles = []
+
+    def join(number):
+        role, _flight = flights.join("same question", f"request-{number}")
+        roles.append(role)
+
+    threads = [threading.Thread(target=join, args=(number,)) for number in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    # All three reached the store at once: none of them was holding up the others
+    assert flights.store.held_lock == [False, False, False]
+    assert sorted(roles) == ["follower", "follower", "leader"]
+
+
+def test_key_held_by_another_worker_is_remote(tmp_path):
+    path = str(tmp_path / "singleflight.sqlite3")
+    assert FlightLockStore(path).acquire("same question", "other-worker")
+    assert SingleFlight(path).join("same question", "request-1") == ("remote", None)
@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+
+import sqlite_tsql
+import synthetic_maximo
+from db_pool import create_maximo_engine
+from sargable_benchmark import CASES, add_edge_rows, replay_cases, view_snapshot
+from schema_snapshot import build_schema_snapshot
+from sql_rewriter import SqlRewriter
+
+
+@pytest.fixture(scope="module")
+def fixture(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("sargable") / "maximo.db")
+    synthetic_maximo.generate(path, 20000, indexes=True, progress=False)
+    add_edge_rows(path)
+    engine = sqlite_tsql.install(create_maximo_engine(f"sqlite:///{path}"))
+    snapshot = view_snapshot(engine)
+    yield engine, SqlRewriter(lambda: snapshot)
+    engine.dispose()
+
+
+def _rows(conn, sql):
+    return [tuple(row) for row in conn.execute(text(sql)).fetchall()]
+
+
+@pytest.mark.parametrize("name,sql", CASES + replay_cases(), ids=lambda value: value[:40])
+def test_rewrite_returns_the_same_rows(fixture, name, sql):
+    engine, rewriter = fixture
+    rewritten, rules = rewriter.rewrite(sql)
+    if not rules:
+        assert name.startswith("replay"), f"{name} was not rewritten"
+        return
+    with engine.connect() as conn:
+        before, after = _rows(conn, sql), _rows(conn, rewritten)
+    # Row order is only defined where the query orders
+    if "ORDER BY" not in sql:
+        before, after = sorted(before, key=repr), sorted(after, key=repr)
+    assert after == before
+
+
+def test_month_ranges_use_language_neutral_literals(fixture):
+    _engine, rewriter = fixture
+    rewritten, rules = rewriter.rewrite(
+        "SELECT COUNT(*) FROM src.vw_Maximo_WorkOrders WHERE YEAR(statusdate) = 2024 AND MONTH(statusdate) = 3")
+    assert rules == ["year_month_range"]
+    assert "statusdate >= '20240301' AND statusdate < '20240401'" in rewritten
+
+
+def test_only_rewritten_predicates_change(fixture):
+    _engine, rewriter = fixture
+    sql = ("SELECT DATENAME(month, statusdate) AS m, SYSDATETIME() AS now\n"
+           "FROM src.vw_Maximo_WorkOrders\n"
+           "WHERE  YEAR( statusdate ) = 2023 AND MONTH(statusdate) IN (1, 2)  AND status = 'COMP' -- open\n"
+           "ORDER BY m")
+    rewritten, rules = rewriter.rewrite(sql)
+    assert rules == ["year_month_range"]
+    assert rewritten == ("SELECT DATENAME(month, statusdate) AS m, SYSDATETIME() AS now\n"
+                         "FROM src.vw_Maximo_WorkOrders\n"
+                         "WHERE  statusdate >= '20230101' AND statusdate < '20230301'  AND status = 'COMP' -- open\n"
+                         "ORDER BY m")
+
+
+def test_nothing_is_rewritten_without_a_snapshot():
+    sql = "SELECT COUNT(*) FROM src.vw_Maximo_WorkOrders WHERE YEAR(statusdate) = 2024 AND asset_id = 23257"
+    assert SqlRewriter(lambda: None).rewrite(sql) == (sql, [])
+
+
+def _snapshot_with_asset_ids(tmp_path, asset_ids):
+    path = tmp_path / "maximo.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE vw_Maximo_WorkOrders (wonum TEXT, asset_id TEXT)")
+        conn.executemany("INSERT INTO vw_Maximo_WorkOrders VALUES (?, ?)",
+                         [(f"WO{number}", asset_id) for number, asset_id in enumerate(asset_ids)])
+    engine = create_maximo_engine(f"sqlite:///{path}")
+    try:
+        snapshot = build_schema_snapshot(engine, ["vw_Maximo_WorkOrders"])
+    finally:
+        engine.dispose()
+    for column in snapshot["tables"][0]["columns"]:
+        column["type"] = "VARCHAR(255)"
+    return snapshot
+
+
+@pytest.mark.parametrize("asset_ids,quoted", [
+    (["23257", "23230", None, "CP-17"], True),
+    (["23257", "023230"], False),
+    (["23257", " 23230"], False),
+    (["CP-17", "CP-18"], False),
+])
+def test_key_literals_are_quoted_only_for_plain_integer_keys(tmp_path, asset_ids, quoted):
+    snapshot = _snapshot_with_asset_ids(tmp_path, asset_ids)
+    sql = "SELECT COUNT(*) FROM src.vw_Maximo_WorkOrders WHERE asset_id = 23257"
+    rewritten, rules = SqlRewriter(lambda: snapshot).rewrite(sql)
+    if quoted:
+        assert rules == ["string_key_literal"]
+        assert "asset_id = '23257'" in rewritten
+    else:
+        assert (rewritten, rules) == (sql, [])
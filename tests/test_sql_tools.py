@@ -0,0 +1,34 @@
+import sqlite3
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+
+from db_pool import create_maximo_engine
+from query_executor import QueryExecutor
+from sql_cache import SqlResultCache
+from sql_tools import CachedQuerySQLDatabaseTool
+
+
+@pytest.fixture
+def engine(tmp_path):
+    path = tmp_path / "maximo.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE vw_Maximo_WorkOrders (wonum TEXT)")
+        conn.executemany("INSERT INTO vw_Maximo_WorkOrders VALUES (?)", [(f"WO{number}",) for number in range(20)])
+    engine = create_maximo_engine(f"sqlite:///{path}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.mark.parametrize("sql,cached", [
+    ("SELECT wonum FROM vw_Maximo_WorkOrders", False),
+    ("SELECT COUNT(*) FROM vw_Maximo_WorkOrders", True),
+])
+def test_only_complete_results_are_cached(engine, tmp_path, sql, cached):
+    db = SQLDatabase(engine, include_tables=["vw_Maximo_WorkOrders"], lazy_table_reflection=True)
+    cache = SqlResultCache()
+    tool = CachedQuerySQLDatabaseTool(db=db, cache=cache, response_format="content_and_artifact",
+                                      executor=QueryExecutor(engine, max_rows=5, spill_dir=str(tmp_path / "spill")))
+    _content, artifact = tool._run(sql)
+    assert artifact["complete"] is cached
+    assert (cache.get(sql) is not None) is cached
@@ -0,0 +1,119 @@
+import sqlite3
+
+import pytest
+from langchain_community.utilities import SQLDatabase
+
+import sqlite_tsql
+from db_pool import create_maximo_engine
+from direct_pipeline import build_direct_pipeline, initial_state
+from replay_benchmark import ReplayChatModel
+from sql_tools import CachedQuerySQLDatabaseTool, LocalQueryCheckerTool
+from sql_validator import SqlValidator
+
+# The columns of the three views as the snapshot records them; no database needed
+SNAPSHOT = {"fingerprint": "test", "tables": [
+    {"name": "vw_Maximo_WorkOrders", "columns": [
+        {"name": "wonum", "type": "VARCHAR(10)"}, {"name": "statusdate", "type": "DATETIME"},
+        {"name": "workype_description", "type": "VARCHAR(50)"}, {"name": "location_id", "type": "VARCHAR(30)"},
+        {"name": "location_description", "type": "VARCHAR(100)"}, {"name": "asset_id", "type": "VARCHAR(12)"}]},
+    {"name": "vw_Maximo_Asset", "columns": [
+        {"name": "assetnum", "type": "VARCHAR(12)"}, {"name": "asset_description", "type": "VARCHAR(100)"}]},
+    {"name": "vw_Maximo_Locations", "columns": [
+        {"name": "location_id", "type": "BIGINT"}, {"name": "location_code", "type": "VARCHAR(30)"},
+        {"name": "location_description", "type": "VARCHAR(100)"}]},
+]}
+
+
+@pytest.fixture
+def validator():
+    return SqlValidator(lambda: SNAPSHOT)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT TOP 5 wonum, statusdate FROM src.vw_Maximo_WorkOrders ORDER BY statusdate DESC",
+    "SELECT l.location_description, COUNT(w.wonum) AS work_order_count FROM src.vw_Maximo_Locations l "
+    "JOIN src.vw_Maximo_WorkOrders w ON l.location_description = w.location_description "
+    "GROUP BY l.location_description ORDER BY work_order_count DESC",
+    "WITH counts AS (SELECT asset_id, COUNT(*) AS n FROM src.vw_Maximo_WorkOrders GROUP BY asset_id) "
+    "SELECT a.asset_description, c.n FROM counts c JOIN src.vw_Maximo_Asset a ON a.assetnum = c.asset_id",
+    "SELECT wonum FROM src.vw_Maximo_WorkOrders WHERE asset_id IN "
+    "(SELECT assetnum FROM src.vw_Maximo_Asset WHERE asset_description LIKE '%pump%')",
+    "SELECT wonum FROM src.vw_Maximo_WorkOrders WHERE asset_id NOT IN (SELECT assetnum FROM src.vw_Maximo_Asset)",
+    "SELECT wonum FROM src.vw_Maximo_WorkOrders w "
+    "WHERE EXISTS (SELECT 1 FROM src.vw_Maximo_Asset a WHERE a.assetnum = asset_id)",
+])
+def test_valid_queries_pass(validator, sql):
+    assert validator.validate(sql) == []
+
+
+@pytest.mark.parametrize("sql,expected", [
+    ("SELECT wonum FROM src.vw_Maximo_WorkOrders WHERE", "Syntax error"),
+    ("DELETE FROM src.vw_Maximo_WorkOrders", "read-only"),
+    ("SELECT wonum INTO #copy FROM src.vw_Maximo_WorkOrders", "SELECT ... INTO"),
+    ("SELECT wonum FROM src.vw_Maximo_WorkOrders; SELECT 1", "single SELECT"),
+    ("SELECT wonum FROM vw_Maximo_WorkOrders", "use 'src.vw_Maximo_WorkOrders'"),
+    ("SELECT * FROM src.vw_Maximo_Users", "Unknown table 'src.vw_Maximo_Users'"),
+    ("SELECT w.wonumber FROM src.vw_Maximo_WorkOrders w", "Unknown column 'w.wonumber'"),
+    ("SELECT wonum FROM src.vw_Maximo_WorkOrders WHERE asset_id IN (SELECT assetnumber FROM src.vw_Maximo_Asset)",
+     "Unknown column 'assetnumber'. Available columns - vw_Maximo_Asset"),
+    # The failing join recorded in LangChainTutorial.py
+    ("SELECT l.location_id, COUNT(w.wonum) FROM src.vw_Maximo_Locations l "
+     "JOIN src.vw_Maximo_WorkOrders w ON l.location_id = w.location_id GROUP BY l.location_id",
+     "Error converting data type varchar to bigint"),
+])
+def test_invalid_queries_are_reported(validator, sql, expected):
+    errors = validator.validate(sql)
+    assert errors
+    assert expected in " ".join(errors)
+
+
+def test_without_a_snapshot_only_the_structural_checks_apply():
+    validator = SqlValidator(lambda: None)
+    assert validator.validate("SELECT anything FROM src.vw_Maximo_Anything") == []
+    assert validator.validate("SELECT wonum FROM vw_Maximo_WorkOrders")
+
+
+def test_checker_tool_answers_without_an_llm(validator):
+    tool = LocalQueryCheckerTool(validator=validator)
+    assert tool.invoke("SELECT wonum FROM src.vw_Maximo_WorkOrders") == "The query is valid."
+    assert tool.invoke("SELECT wonum FROM vw_Maximo_WorkOrders").startswith("Error: ")
+
+
+class ScriptedQueryModel(ReplayChatModel):
+    """
+    ReplayChatModel that writes the next of queries on each write_query attempt.
+    """
+
+    queries: list
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.structured:
+            self.script[self._question(messages)] = self.queries.pop(0)
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+
+def test_direct_pipeline_rewrites_a_rejected_query(tmp_path, validator):
+    path = tmp_path / "maximo.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE vw_Maximo_WorkOrders (wonum TEXT, workype_description TEXT)")
+        conn.executemany("INSERT INTO vw_Maximo_WorkOrders VALUES (?, 'Corrective Maintenance')",
+                         [(f"WO{number}",) for number in range(7)])
+    engine = sqlite_tsql.install(create_maximo_engine(f"sqlite:///{path}"))
+    db = SQLDatabase(engine, schema="src", include_tables=["vw_Maximo_WorkOrders"], lazy_table_reflection=True)
+    llm = ScriptedQueryModel(script={}, queries=[
+        "SELECT COUNT(*) AS work_orders FROM vw_Maximo_WorkOrders",
+        "SELECT COUNT(*) AS work_orders FROM src.vw_Maximo_WorkOrders",
+    ])
+    pipeline = build_direct_pipeline(llm, CachedQuerySQLDatabaseTool(db=db, validator=validator),
+                                     "{dialect} {top_k} {table_info}", lambda question: "")
+    try:
+        state = pipeline.invoke(initial_state("How many work orders are there?"))
+    finally:
+        engine.dispose()
+
+    rejected = [message for message in state["messages"] if message.type == "tool"][0]
+    assert "use 'src.vw_Maximo_WorkOrders'" in rejected.content
+    assert state["attempts"] == 2
+    assert state["llm_calls"] == 3
+    assert state["result"] == "[(7,)]"
+    assert "(7,)" in state["answer"]